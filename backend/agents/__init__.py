@@ -1,5 +1,5 @@
 from .parser_agent import ParserAgent, get_parser_agent
-from .codegen_agent import CodegenAgent, get_batch_codegen_agent
+from .codegen_agent import CodegenAgent, BatchCodegenAgent, get_batch_codegen_agent, get_message_batch_codegen_agent
 from .live_helper import LiveHelperAgent, get_live_helper_agent
 from .concept_example import ConceptExampleAgent, get_concept_example_agent
 
@@ -8,6 +8,8 @@ __all__ = [
     "get_parser_agent",
     "CodegenAgent", 
     "get_batch_codegen_agent",
+    "BatchCodegenAgent",
+    "get_message_batch_codegen_agent",
     "LiveHelperAgent",
     "get_live_helper_agent",
     "ConceptExampleAgent",
@@ -2,48 +2,169 @@
 Generates starter code templates with TODO comments for specific tasks
 """
 
+import asyncio
+import contextlib
+import functools
+import hashlib
 import logging
+import os
+import random
+import re
+import uuid
+from collections import Counter
 from typing import List
-from pyd_models.schemas import BoilerPlateCodeSchema, StarterCode
+import orjson
+from pydantic import ValidationError
+from pyd_models.schemas import BoilerPlateCodeSchema, StarterCode, FileScaffoldResponse
 from services import get_anthropic_client
-from utils.json_parser import extract_json_from_response
+from services.token_budget import TokenBudgetPredictor, get_token_budget_predictor
+from utils.cache import LRUCache
+from utils.json_parser import StreamingJSONParser
+from config import CODEGEN_CACHE_SIZE, CODEGEN_CACHE_TTL_SECONDS, MAX_CONCURRENT_FILE_GENERATIONS
 
 logger = logging.getLogger(__name__)
 
+# Successful scaffolding responses, stored as plain dicts keyed by a hash of the request
+_scaffolding_cache = LRUCache(maxsize=CODEGEN_CACHE_SIZE, ttl=CODEGEN_CACHE_TTL_SECONDS)
+# Same key -> the generation currently producing that file (overlapping scaffold_project calls share it)
+_in_flight_scaffolding = {}
+
+
+def _scaffolding_cache_key(model: str, filename: str, tasks_dict_list: list,
+                           class_structure: dict = None, template_variables: list = None,
+                           method_signatures_by_class: dict = None) -> str:
+    """Build a stable SHA-256 key from everything that goes into the prompt"""
+    payload = {
+        'model': model,
+        'filename': filename,
+        'tasks': tasks_dict_list,
+        'classes': sorted(class_structure.keys()) if class_structure else None,
+        'template_variables': sorted(template_variables) if template_variables else None,
+        'method_signatures': {cls: sorted(methods) for cls, methods in method_signatures_by_class.items()}
+                             if method_signatures_by_class else None
+    }
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+# Non-code files (data/config/build) get literal content instead of code scaffolding
+_NON_CODE_EXTENSIONS = frozenset({
+    '.xml', '.xsd', '.json', '.yaml', '.yml', '.toml',  # Data/config
+    '.txt', '.csv', '.md',  # Text/documentation
+    '.html', '.css', '.sql',  # Web/database
+    '.sh', '.bat', '.ps1',  # Shell scripts (treated as config)
+    '.dockerfile', '.dockerignore',  # Docker
+    '.gitignore', '.gitattributes',  # Git
+    '.env', '.properties', '.ini', '.cfg'  # Config files
+})
+
+# Special files without extensions (case-insensitive)
+_SPECIAL_FILENAMES = frozenset({'makefile', 'dockerfile', 'rakefile', 'gemfile', 'procfile', 'vagrantfile', 'cmakelists.txt'})
+
+
+@functools.lru_cache(maxsize=1024)
+def is_non_code_file(filename: str) -> bool:
+    """True for data/config/build files, which hold content rather than code to complete"""
+    name = os.path.basename(filename.lower())
+    # Dotfiles like .gitignore / .env have no splitext extension, so use the whole name
+    extension = os.path.splitext(name)[1] or (name if name.startswith('.') else '')
+    return (
+        extension in _NON_CODE_EXTENSIONS or
+        name in _SPECIAL_FILENAMES or
+        name.startswith('makefile')  # Makefile.inc, Makefile.am, etc.
+    )
+
+
+# Task fields the prompt builders read (everything except method_signatures)
+_PROMPT_TASK_FIELDS = {
+    'task_description', 'programming_language', 'concepts', 'known_language',
+    'filename', 'experience_level', 'class_name', 'template_variables'
+}
+
+
+def _dedupe_tasks(tasks: List[BoilerPlateCodeSchema]) -> tuple:
+    """
+    Drop repeated tasks (same description, language, concepts and class).
+    Returns (unique_tasks, slots) where slots[i] is the unique index for tasks[i].
+    """
+    unique_tasks = []
+    slots = []
+    first_index = {}
+    for task in tasks:
+        key = (task.task_description, task.programming_language, tuple(task.concepts),
+               task.known_language, task.class_name)
+        if key not in first_index:
+            first_index[key] = len(unique_tasks)
+            unique_tasks.append(task)
+        slots.append(first_index[key])
+    return unique_tasks, slots
+
+
+def _task_score(task: BoilerPlateCodeSchema) -> int:
+    """Rough size of a task: description length plus a weight per concept"""
+    return len(task.task_description) + 80 * len(task.concepts)
+
+
+def _task_token_estimate(task: BoilerPlateCodeSchema) -> int:
+    """Output tokens to budget for one task in a code file (~200 for a typical task)"""
+    return 120 + _task_score(task) // 4
+
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter between codegen attempts, capped at 30s"""
+    return min(2 ** attempt + random.random(), 30)
+
+
 #validation function to check for duplication
+_NAMESPACE_KEY = "namespace ConsoleApp1"
+
+
+@functools.lru_cache(maxsize=256)
+def _class_declaration_pattern(class_names: tuple) -> re.Pattern:
+    """
+    One alternation regex matching a declaration of any of the given classes
+    (group 1) or the default C# namespace (group 2), so both checks share one scan
+    """
+    # Pattern matches: (public|private|protected)? class ClassName
+    # This handles C#, Java, Python, etc.
+    alternatives = '|'.join(re.escape(name) for name in class_names)
+    return re.compile(
+        rf'\b(?:(?:public\s+|private\s+|protected\s+)?class\s+({alternatives})|(?-i:(namespace\s+ConsoleApp1)))\b',
+        re.IGNORECASE
+    )
+
+
 def validate_no_duplication(code_snippet: str, class_names: list) -> bool:
     """Check if classes are duplicated in the generated code"""
     if not class_names:
         return True  # No classes to check
 
+    # Single pass over the code for all classes and the namespace
+    pattern = _class_declaration_pattern(tuple(sorted(set(class_names))))
+    counts = Counter(
+        class_match.lower() if class_match else _NAMESPACE_KEY
+        for class_match, _ in pattern.findall(code_snippet)
+    )
+
     for class_name in class_names:
-        # Use regex to find actual class declarations (not overlapping patterns)
-        import re
-        
-        # Pattern matches: (public|private|protected)? class ClassName
-        # This handles C#, Java, Python, etc.
-        pattern = rf'\b(?:public\s+|private\s+|protected\s+)?class\s+{re.escape(class_name)}\b'
-        
-        matches = re.findall(pattern, code_snippet, re.IGNORECASE)
-        count = len(matches)
-        
+        count = counts[class_name.lower()]
+
         if count > 1:
             logger.error(f"Class {class_name} appears {count} times - DUPLICATION DETECTED!")
             # Find line numbers where class appears
             lines = code_snippet.split('\n')
             for i, line in enumerate(lines, 1):
-                if re.search(pattern, line, re.IGNORECASE):
+                match = pattern.search(line)
+                if match and match.group(1) and match.group(1).lower() == class_name.lower():
                     logger.error(f"  Line {i}: {line.strip()}")
             return False
         elif count == 0:
             logger.warning(f"Class {class_name} not found in generated code!")
-    
+
     # Also check for namespace/package duplication
-    namespace_count = code_snippet.count("namespace ConsoleApp1")
+    namespace_count = counts[_NAMESPACE_KEY]
     if namespace_count > 1:
         logger.error(f"Namespace duplicated {namespace_count} times!")
         return False
-    
+
     return True
 
 # Agent responsible for generating boilerplate code templates
@@ -53,61 +174,134 @@ class CodegenAgent:
         # Use Sonnet 4 for codegen - best quality for complex code generation
         self.client = get_anthropic_client(model="claude-sonnet-4-20250514")
         self.max_retries = 3
+        self.token_predictor = get_token_budget_predictor()
 
-    def generate_file_scaffolding(self, filename: str,
-                               tasks: List[BoilerPlateCodeSchema],
-                               class_structure: dict = None,
-                               template_variables: list = None,
-                               method_signatures_by_class: dict = None) -> List[StarterCode]:
+    async def generate_file_scaffolding(self, filename: str,
+                                        tasks: List[BoilerPlateCodeSchema],
+                                        class_structure: dict = None,
+                                        template_variables: list = None,
+                                        method_signatures_by_class: dict = None) -> List[StarterCode]:
         """
         Generate scaffolding for ONE complete file.
         Handles both code files and data files appropriately.
+        Async so several files can be generated concurrently (see scaffold_project).
+        Concurrent calls for an identical file share one generation.
+        """
+        file_request = self._prepare_file_request(
+            filename, tasks, class_structure, template_variables, method_signatures_by_class
+        )
+        cache_key = file_request['cache_key']
+        cached = _scaffolding_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Scaffolding cache hit for {filename}")
+            return self._fan_out([StarterCode(**result) for result in cached], file_request)
+
+        generation = _in_flight_scaffolding.get(cache_key)
+        if generation is None:
+            generation = asyncio.ensure_future(self._generate_file_results(file_request))
+            _in_flight_scaffolding[cache_key] = generation
+            generation.add_done_callback(lambda _: _in_flight_scaffolding.pop(cache_key, None))
+        else:
+            logger.info(f"Joining in-flight scaffolding generation for {filename}")
+        # Shielded so one caller giving up doesn't cancel the generation for the others
+        results = await asyncio.shield(generation)
+        return self._fan_out([result.model_copy() for result in results], file_request)
+
+    async def _generate_file_results(self, file_request: dict) -> List[StarterCode]:
+        """
+        Stream and validate one file's scaffolding, retrying and then falling back.
+        Returns one StarterCode per deduplicated task (callers fan out).
+        """
+        filename = file_request['filename']
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                logger.info(f"File codegen for {filename}, attempt {attempt + 1}/{self.max_retries}")
+
+                # Stream so duplication is caught as soon as code_snippet closes
+                parser = StreamingJSONParser()
+                final = {}
+                async with contextlib.aclosing(self.client.stream_response(
+                    file_request['prompt'],
+                    max_tokens=file_request['max_tokens'],
+                    system=file_request['system_prompt'],
+                    final=final
+                )) as stream:
+                    async for chunk in stream:
+                        self._check_stream_progress(parser, parser.feed(chunk), file_request)
+                return self._parse_file_response(parser, file_request, final)
+
+            except Exception as e:
+                last_error = e
+                logger.warning(f"Attempt {attempt + 1} failed: {e}")
+                if attempt < self.max_retries - 1:
+                    delay = _retry_delay(attempt)
+                    logger.info(f"Retrying {filename} in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
+
+        logger.error(f"All {self.max_retries} attempts failed for {filename}")
+        logger.warning(f"Falling back to basic scaffolding for {filename}")
+
+        # Fallback: Generate basic scaffolding manually
+        return self._generate_fallback_scaffolding(filename, file_request['tasks'], file_request['tasks_dict_list'])
+
+    async def scaffold_project(self, files: List[dict]) -> List[List[StarterCode]]:
+        """
+        Generate scaffolding for several files concurrently.
+        Each entry in `files` holds the keyword arguments for generate_file_scaffolding.
+        Results are returned in the same order as `files`.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILE_GENERATIONS)
+
+        async def generate_one(file_kwargs: dict) -> List[StarterCode]:
+            async with semaphore:
+                return await self.generate_file_scaffolding(**file_kwargs)
+
+        # Start the heaviest files first so a long generation isn't left queued at the end
+        order = sorted(
+            range(len(files)),
+            key=lambda i: sum(_task_score(task) for task in files[i]['tasks']),
+            reverse=True
+        )
+        ordered_results = await asyncio.gather(*[generate_one(files[i]) for i in order])
+
+        results = [None] * len(files)
+        for i, file_results in zip(order, ordered_results):
+            results[i] = file_results
+        return results
+
+    def _prepare_file_request(self, filename: str,
+                              tasks: List[BoilerPlateCodeSchema],
+                              class_structure: dict = None,
+                              template_variables: list = None,
+                              method_signatures_by_class: dict = None) -> dict:
+        """
+        Build the prompt, token budget and cache key for one file.
+        Shared by the live and message-batch generation paths.
         """
         if not tasks:
             raise ValueError(f"No tasks provided for {filename}")
 
+        # Identical tasks only need generating once; results are fanned back out afterwards
+        all_tasks = tasks
+        tasks, task_slots = _dedupe_tasks(all_tasks)
+        if len(tasks) < len(all_tasks):
+            logger.info(f"Deduplicated {len(all_tasks) - len(tasks)} repeated tasks in {filename}")
+
         # Detect if this is a non-code file (data/config/build files)
         # These should contain actual content, not code to generate them
-        non_code_extensions = [
-            '.xml', '.xsd', '.json', '.yaml', '.yml', '.toml',  # Data/config
-            '.txt', '.csv', '.md',  # Text/documentation
-            '.html', '.css', '.sql',  # Web/database
-            '.sh', '.bat', '.ps1',  # Shell scripts (treated as config)
-            '.dockerfile', '.dockerignore',  # Docker
-            '.gitignore', '.gitattributes',  # Git
-            '.env', '.properties', '.ini', '.cfg'  # Config files
-        ]
-
-        # Special files without extensions (case-insensitive)
-        special_filenames = ['makefile', 'dockerfile', 'rakefile', 'gemfile', 'procfile', 'vagrantfile', 'cmakelists.txt']
-
-        is_non_code_file = (
-            any(filename.lower().endswith(ext) for ext in non_code_extensions) or
-            filename.lower() in special_filenames or
-            filename.lower().startswith('makefile')  # Makefile.inc, Makefile.am, etc.
-        )
+        non_code = is_non_code_file(filename)
 
-        # Convert tasks to dict format
-        tasks_dict_list = []
-        for task in tasks:
-            task_dict = {
-                'task_description': task.task_description,
-                'programming_language': task.programming_language,
-                'concepts': task.concepts,
-                'known_language': task.known_language,
-                'filename': task.filename,
-                'experience_level': getattr(task, 'experience_level', 'intermediate'),
-                'class_name': getattr(task, 'class_name', None),
-                'template_variables': getattr(task, 'template_variables', None)
-            }
-            tasks_dict_list.append(task_dict)
+        # Convert tasks to dict format for the prompt builders
+        tasks_dict_list = [task.model_dump(include=_PROMPT_TASK_FIELDS) for task in tasks]
 
         # Use different prompt for non-code files vs code files
+        # Both split into a cached instruction prefix (system) and the task suffix
         from utils.agent_prompts import get_file_codegen_prompt, get_non_code_file_prompt
-        if is_non_code_file:
-            prompt = get_non_code_file_prompt(tasks_dict_list, filename)
+        if non_code:
+            system_prompt, prompt = get_non_code_file_prompt(tasks_dict_list, filename)
         else:
-            prompt = get_file_codegen_prompt(
+            system_prompt, prompt = get_file_codegen_prompt(
                 tasks_dict_list,
                 filename,
                 class_structure=class_structure,
@@ -116,107 +310,170 @@ class CodegenAgent:
             )
 
         # Smart token allocation for new compact format
+        budget_features = None
         # Data files need MORE tokens than code files (XML/JSON content is verbose)
-        if is_non_code_file:
+        if non_code:
             # Data files: allocate generously since they contain actual content
             base_tokens = 3000
             per_task = 500  # Data files can be large
             max_tokens = min(base_tokens + (len(tasks) * per_task), 8000)
         else:
-            # Code files: more generous allocation for quality
-            base_tokens = 2000  # Increased from 1000
-            per_task = 200  # Increased from 100 - each task needs method + TODOs
-            per_class = 600 if class_structure else 0  # Increased from 400
-            estimated_tokens = base_tokens + (len(tasks) * per_task)
-            if class_structure:
-                estimated_tokens += len(class_structure) * per_class
-            max_tokens = min(estimated_tokens, 8000)
+            budget_features = TokenBudgetPredictor.features(
+                n_tasks=len(tasks),
+                n_classes=len(class_structure) if class_structure else 0,
+                avg_task_len=sum(len(task.task_description) for task in tasks) / len(tasks),
+                experience_level=tasks_dict_list[0].get('experience_level')
+            )
+            # Learned from past generations once enough samples exist
+            max_tokens = self.token_predictor.predict(budget_features)
+            if max_tokens is None:
+                # Code files: more generous allocation for quality
+                base_tokens = 2000  # Increased from 1000
+                per_class = 600 if class_structure else 0  # Increased from 400
+                # Each task needs method + TODOs; longer tasks with more concepts need more
+                estimated_tokens = base_tokens + sum(_task_token_estimate(task) for task in tasks)
+                if class_structure:
+                    estimated_tokens += len(class_structure) * per_class
+                max_tokens = min(estimated_tokens, 8000)
 
         logger.info(f"Using {max_tokens} tokens for {len(tasks)} tasks in {filename}")
 
-        # ADD THIS: Extra instruction for complex files
+        # Extra instruction for complex files - goes in the user suffix so the
+        # cached system prefix stays identical
         if len(tasks) > 5 or (class_structure and len(class_structure) > 2):
             prompt += "\n\nCRITICAL: Generate ONE complete file. Each class should appear EXACTLY ONCE. NO duplication."
 
-        last_error = None
-        for attempt in range(self.max_retries):
-            try:
-                logger.info(f"File codegen for {filename}, attempt {attempt + 1}/{self.max_retries}")
+        return {
+            'filename': filename,
+            'tasks': tasks,
+            'all_tasks': all_tasks,
+            'task_slots': task_slots,
+            'tasks_dict_list': tasks_dict_list,
+            'class_structure': class_structure,
+            'system_prompt': system_prompt,
+            'prompt': prompt,
+            'max_tokens': max_tokens,
+            'budget_features': budget_features,
+            'cache_key': _scaffolding_cache_key(
+                self.client.model, filename, tasks_dict_list,
+                class_structure, template_variables, method_signatures_by_class
+            )
+        }
+
+    def _check_stream_progress(self, parser: StreamingJSONParser, completed_keys: list, file_request: dict):
+        """Validate top-level values as they finish streaming, aborting the attempt early on failure"""
+        for key in completed_keys:
+            logger.debug("%s: '%s' complete after %d chars", file_request['filename'], key, len(parser.text))
+            if key == 'code_snippet' and file_request['class_structure']:
+                code = parser.value('code_snippet')
+                if code is not None:
+                    self._check_duplication(code, file_request['class_structure'])
+
+    def _check_duplication(self, code: str, class_structure: dict):
+        """Raise ValueError if any class is declared more than once"""
+        if not validate_no_duplication(code, list(class_structure.keys())):
+            # Log the problematic code for debugging
+            logger.error("=" * 80)
+            logger.error("DUPLICATION DETECTED - Dumping code_snippet for analysis:")
+            logger.error(f"Code length: {len(code)} chars")
+            logger.error("First 2000 chars:")
+            logger.error(code[:2000])
+            logger.error("=" * 80)
+            raise ValueError("Class duplication detected")
+
+    def _parse_file_response(self, parser: StreamingJSONParser, file_request: dict,
+                             final: dict) -> List[StarterCode]:
+        """
+        Validate the AI response for one file and expand it into one StarterCode per deduplicated task.
+        `final` holds the stop_reason and output_tokens reported for the response.
+        Raises ValueError if the response is unusable so the caller can retry.
+        """
+        response_text = parser.text
+        filename = file_request['filename']
+        tasks = file_request['tasks']
+        tasks_dict_list = file_request['tasks_dict_list']
+        class_structure = file_request['class_structure']
+
+        # Log response for debugging (large strings - only built when DEBUG is on)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("AI response preview (first 500 chars): %s", response_text[:500])
+            logger.debug("AI response last 200 chars: %s", response_text[-200:])
+            logger.debug("Total response length: %d characters", len(response_text))
+
+        data = parser.parse()
+        logger.debug("Extracted keys: %s", list(data.keys()))
+
+        # New format: {"code_snippet": "...", "task_todos": {"1": [...], "2": [...]}}
+        # One pydantic pass checks both keys and every TODO list
+        try:
+            response = FileScaffoldResponse.model_validate(data)
+        except ValidationError as e:
+            raise ValueError(f"Missing or invalid code_snippet/task_todos: {e.error_count()} errors") from e
+
+        code = response.code_snippet
+        task_todos = response.task_todos
+
+        # Validate no class duplication
+        if class_structure:
+            self._check_duplication(code, class_structure)
+
+        # Validate TODO counts per experience level
+        experience_level = tasks_dict_list[0].get('experience_level', 'intermediate')
+        todo_ranges = {
+            'beginner': (5, 8),
+            'intermediate': (3, 5),
+            'advanced': (1, 3)
+        }
+        min_todos, max_todos = todo_ranges.get(experience_level, (3, 5))
+
+        # Expand into N task objects (fields already validated above)
+        results = []
+        for i, task in enumerate(tasks, 1):
+            todos = task_todos.get(str(i), [])
+
+            # Validate TODO count for this task
+            if len(todos) < min_todos:
+                logger.error(f"❌ Task {i} has {len(todos)} TODOs, expected {min_todos}-{max_todos} for {experience_level} level")
+                logger.error(f"   Task description: {task.task_description}")
+                logger.error(f"   This indicates the AI didn't follow TODO generation guidelines")
+                # Don't fail, but log prominently
+            elif len(todos) > max_todos:
+                logger.warning(f"⚠️  Task {i} has {len(todos)} TODOs, expected {min_todos}-{max_todos} for {experience_level} level")
+
+            results.append(StarterCode.model_construct(
+                code_snippet=code,  # Same for all
+                instructions=f"Task {i}: {task.task_description}",
+                todos=todos,
+                concept_examples=None,
+                filename=filename
+            ))
 
-                response_text = self.client.generate_response(prompt, max_tokens=max_tokens)
-
-                # Log response for debugging
-                logger.info(f"AI response preview (first 500 chars): {response_text[:500]}")
-                logger.info(f"AI response last 200 chars: {response_text[-200:]}")
-                logger.info(f"Total response length: {len(response_text)} characters")
-
-                data = extract_json_from_response(response_text)
-                logger.info(f"Extracted keys: {list(data.keys())}")
-
-                # New format: {"code_snippet": "...", "task_todos": {"1": [...], "2": [...]}}
-                if "code_snippet" in data and "task_todos" in data:
-                    code = data["code_snippet"]
-                    task_todos = data["task_todos"]
-
-                    # Validate no class duplication
-                    if class_structure:
-                        if not validate_no_duplication(code, list(class_structure.keys())):
-                            # Log the problematic code for debugging
-                            logger.error("=" * 80)
-                            logger.error("DUPLICATION DETECTED - Dumping code_snippet for analysis:")
-                            logger.error(f"Code length: {len(code)} chars")
-                            logger.error("First 2000 chars:")
-                            logger.error(code[:2000])
-                            logger.error("=" * 80)
-                            raise ValueError("Class duplication detected")
-
-                    # Validate TODO counts per experience level
-                    experience_level = tasks_dict_list[0].get('experience_level', 'intermediate')
-                    todo_ranges = {
-                        'beginner': (5, 8),
-                        'intermediate': (3, 5),
-                        'advanced': (1, 3)
-                    }
-                    min_todos, max_todos = todo_ranges.get(experience_level, (3, 5))
-
-                    # Expand into N task objects
-                    results = []
-                    for i, task in enumerate(tasks, 1):
-                        todos = task_todos.get(str(i), [])
-
-                        # Validate TODO count for this task
-                        if len(todos) < min_todos:
-                            logger.error(f"❌ Task {i} has {len(todos)} TODOs, expected {min_todos}-{max_todos} for {experience_level} level")
-                            logger.error(f"   Task description: {task.task_description}")
-                            logger.error(f"   This indicates the AI didn't follow TODO generation guidelines")
-                            # Don't fail, but log prominently
-                        elif len(todos) > max_todos:
-                            logger.warning(f"⚠️  Task {i} has {len(todos)} TODOs, expected {min_todos}-{max_todos} for {experience_level} level")
-
-                        results.append(StarterCode(
-                            code_snippet=code,  # Same for all
-                            instructions=f"Task {i}: {task.task_description}",
-                            todos=todos,
-                            concept_examples=None,
-                            filename=filename
-                        ))
-
-                    logger.info(f"Expanded to {len(results)} tasks")
-                    return results
-
-                raise ValueError("Missing code_snippet or task_todos")
+        logger.info(f"Expanded to {len(results)} tasks")
 
-            except Exception as e:
-                last_error = e
-                logger.warning(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < self.max_retries - 1:
-                    continue
+        truncated = final.get('stop_reason') == "max_tokens"
+        output_tokens = final.get('output_tokens')
 
-        logger.error(f"All {self.max_retries} attempts failed for {filename}")
-        logger.warning(f"Falling back to basic scaffolding for {filename}")
+        # Feed the token budget model; truncated or repaired responses would bias it low
+        if file_request['budget_features'] and output_tokens and parser.complete and not truncated:
+            self.token_predictor.record(file_request['budget_features'], output_tokens)
 
-        # Fallback: Generate basic scaffolding manually
-        return self._generate_fallback_scaffolding(filename, tasks, tasks_dict_list)
+        # A truncated response, or one the parser had to repair (its JSON never closed),
+        # is good enough to return once but must not be served to every identical request
+        if parser.complete and not truncated:
+            _scaffolding_cache.set(file_request['cache_key'], [result.model_dump() for result in results])
+        else:
+            logger.warning(f"Not caching truncated scaffolding response for {filename}")
+        return results
+
+    def _fan_out(self, results: List[StarterCode], file_request: dict) -> List[StarterCode]:
+        """Map results for the deduplicated tasks back onto every original task"""
+        all_tasks = file_request['all_tasks']
+        if len(all_tasks) == len(results):
+            return results
+        return [
+            results[slot].model_copy(update={'instructions': f"Task {i}: {task.task_description}"})
+            for i, (task, slot) in enumerate(zip(all_tasks, file_request['task_slots']), 1)
+        ]
 
     def _generate_fallback_scaffolding(self, filename: str, tasks, tasks_dict_list) -> List[StarterCode]:
         """
@@ -256,9 +513,127 @@ class CodegenAgent:
         return results
 
 
-codegen_agent = None
+def group_tasks_by_file(tasks: List[BoilerPlateCodeSchema]) -> List[dict]:
+    """Group tasks by filename into scaffold_project jobs (same grouping as the batch endpoint)"""
+    files_map = {}
+    for task in tasks:
+        job = files_map.setdefault(task.filename, {
+            'filename': task.filename,
+            'tasks': [],
+            'class_structure': {},
+            'template_variables': set(),
+            'method_signatures_by_class': {}
+        })
+        job['tasks'].append(task)
+        if task.template_variables:
+            job['template_variables'].update(task.template_variables)
+        if task.class_name:
+            job['class_structure'].setdefault(task.class_name, []).append(task)
+            if task.method_signatures:
+                job['method_signatures_by_class'].setdefault(task.class_name, set()).update(task.method_signatures)
+
+    file_jobs = []
+    for job in files_map.values():
+        file_jobs.append({
+            'filename': job['filename'],
+            'tasks': job['tasks'],
+            'class_structure': job['class_structure'] or None,
+            'template_variables': list(job['template_variables']) or None,
+            'method_signatures_by_class': {cls: list(methods) for cls, methods in job['method_signatures_by_class'].items()} or None
+        })
+    return file_jobs
+
+
+class BatchCodegenAgent(CodegenAgent):
+    """
+    Scaffolds files through the Message Batches API for non-interactive runs
+    (half the cost, separate rate-limit quota). Results can take minutes, so
+    submit() returns a batch id and poll() returns the scaffolding once it has ended.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # batch_id -> (file requests by custom_id, results already known from the cache)
+        self._pending = {}
+
+    async def submit(self, files: List[dict]) -> str:
+        """Submit one batch request per file. Each entry holds generate_file_scaffolding kwargs."""
+        file_requests = {}
+        results = {}
+        for index, file_kwargs in enumerate(files):
+            file_request = self._prepare_file_request(**file_kwargs)
+            cached = _scaffolding_cache.get(file_request['cache_key'])
+            if cached is not None:
+                logger.info(f"Scaffolding cache hit for {file_request['filename']}")
+                results[file_request['filename']] = self._fan_out(
+                    [StarterCode(**result) for result in cached], file_request
+                )
+                continue
+            # custom_id only allows [a-zA-Z0-9_-], so filenames can't be used directly
+            file_requests[f"file-{index}"] = file_request
+
+        if file_requests:
+            batch_id = await self.client.submit_batch([
+                {
+                    'custom_id': custom_id,
+                    'prompt': file_request['prompt'],
+                    'max_tokens': file_request['max_tokens'],
+                    'system': file_request['system_prompt']
+                }
+                for custom_id, file_request in file_requests.items()
+            ])
+        else:
+            batch_id = f"cached-{uuid.uuid4().hex}"
+
+        self._pending[batch_id] = (file_requests, results)
+        return batch_id
+
+    async def poll(self, batch_id: str) -> dict | None:
+        """
+        Return {filename: List[StarterCode]} once the batch has ended, or None while
+        it is still processing. Files whose request failed get fallback scaffolding.
+        """
+        if batch_id not in self._pending:
+            raise ValueError(f"Unknown batch id: {batch_id}")
+
+        file_requests, results = self._pending[batch_id]
+        responses = {}
+        finals = {}
+        if file_requests:
+            responses = await self.client.get_batch_results(batch_id, final=finals)
+            if responses is None:
+                return None
+
+        for custom_id, file_request in file_requests.items():
+            filename = file_request['filename']
+            try:
+                response_text = responses.get(custom_id)
+                if response_text is None:
+                    raise ValueError("No successful result in batch")
+                parser = StreamingJSONParser()
+                parser.feed(response_text)
+                results[filename] = self._fan_out(
+                    self._parse_file_response(parser, file_request, finals.get(custom_id, {})),
+                    file_request
+                )
+            except Exception as e:
+                logger.warning(f"Batch result for {filename} unusable: {e}")
+                results[filename] = self._fan_out(
+                    self._generate_fallback_scaffolding(
+                        filename, file_request['tasks'], file_request['tasks_dict_list']
+                    ),
+                    file_request
+                )
+
+        del self._pending[batch_id]
+        return results
+
+
+@functools.cache
 def get_batch_codegen_agent() -> CodegenAgent:
-    global codegen_agent
-    if codegen_agent is None:
-        codegen_agent = CodegenAgent()
-    return codegen_agent
\ No newline at end of file
+    return CodegenAgent()
+
+
+@functools.cache
+def get_message_batch_codegen_agent() -> BatchCodegenAgent:
+    return BatchCodegenAgent()
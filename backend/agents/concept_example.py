@@ -2,10 +2,11 @@
 Provides targeted examples when students request help with specific concepts.
 """
 
+import functools
 import logging
 from typing import Optional
 from pyd_models.schemas import ConceptExampleRequest, ConceptExampleResponse
-from services import get_anthropic_client
+from services import get_anthropic_client, build_retry_messages
 from utils.json_parser import extract_json_from_response
 
 logger = logging.getLogger(__name__)
@@ -19,7 +20,7 @@ class ConceptExampleAgent:
         self.client = get_anthropic_client(model="claude-3-5-haiku-20241022")
         self.max_retries = 3
     
-    def generate_example(self, request: ConceptExampleRequest) -> ConceptExampleResponse:
+    async def generate_example(self, request: ConceptExampleRequest) -> ConceptExampleResponse:
         """
         Generate a concept example with retry logic.
         Categorizes the concept and provides appropriate example depth.
@@ -38,10 +39,12 @@ class ConceptExampleAgent:
         )
         
         last_error = None
+        messages = prompt
         for attempt in range(self.max_retries):
+            response_text = None
             try:
                 logger.info(f"Concept Example Agent attempt {attempt + 1}/{self.max_retries} for concept: {request.concept}")
-                response_text = self.client.generate_response(prompt, max_tokens=1000)
+                response_text = await self.client.generate_response(messages, max_tokens=1000)
                 
                 data = extract_json_from_response(response_text)
                 
@@ -66,7 +69,7 @@ class ConceptExampleAgent:
                 logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
                 
                 if attempt < self.max_retries - 1:
-                    prompt += f"\n\nIMPORTANT: Previous attempt failed. Ensure your response is ONLY valid JSON."
+                    messages = build_retry_messages(prompt, response_text, "IMPORTANT: Previous attempt failed. Ensure your response is ONLY valid JSON.")
                 continue
         
         logger.error(f"All {self.max_retries} attempts failed")
@@ -227,11 +230,7 @@ EXAMPLE VALID RESPONSE:
 
 
 # Singleton instance
-_concept_example_agent = None
-
+@functools.cache
 def get_concept_example_agent() -> ConceptExampleAgent:
     """Get the concept example agent singleton"""
-    global _concept_example_agent
-    if _concept_example_agent is None:
-        _concept_example_agent = ConceptExampleAgent()
-    return _concept_example_agent
\ No newline at end of file
+    return ConceptExampleAgent()
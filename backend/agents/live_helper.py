@@ -2,28 +2,137 @@
 Provides contextual hints to students while they code
 """
 
+import contextlib
+import functools
+import hashlib
+import json
 import logging
+from pydantic import ValidationError
+from config import HINT_FAST_MODEL_MAX_CODE_CHARS, HINT_REPEAT_CACHE_SIZE, HINT_REPEAT_CACHE_TTL_SECONDS
 from pyd_models.schemas import HintResponseSchema, HintSchema
-from services import get_anthropic_client
-from utils.agent_prompts import get_helper_prompt
-from utils.json_parser import extract_json_from_response
+from services import get_anthropic_client, build_retry_messages, get_hint_cache
+from utils.agent_prompts import build_test_results_section, get_helper_prompt
+from utils.cache import LRUCache
+from utils.json_parser import StreamingJSONParser
 
 logger = logging.getLogger(__name__)
 
+_HINT_SCHEMA = HintSchema.model_json_schema()
+
 # Agent responsible for providing live coding hints
 class LiveHelperAgent:
     
     def __init__(self):
         # Use Sonnet 4 for hints - best for nuanced educational guidance
         self.client = get_anthropic_client(model="claude-sonnet-4-20250514")
+        # First gentle hints on short code don't need Sonnet - Haiku is faster and cheaper
+        self.fast_client = get_anthropic_client(model="claude-3-5-haiku-20241022")
         self.max_retries = 3
+        self.hint_cache = get_hint_cache()
+        # Exact repeats of requests the semantic cache skips (those with test results)
+        self._repeat_cache = LRUCache(maxsize=HINT_REPEAT_CACHE_SIZE, ttl=HINT_REPEAT_CACHE_TTL_SECONDS)
 
-    def provide_hint(self, inputData: HintResponseSchema) -> HintSchema:
+    async def provide_hint(self, inputData: HintResponseSchema) -> HintSchema:
         """
-        Provide hint with retry logic for robust JSON extraction.
-        Retries up to max_retries times if JSON parsing fails.
+        Provide hint as a structured tool call, with retry logic.
+        Retries up to max_retries times if the hint fails validation.
         NEW: Can analyze test results to help debug test cases when code is correct.
         """
+        cache_query, cache_scope, use_cache = self._cache_entry(inputData)
+        cached_hint = self._cached_hint(inputData, cache_query, cache_scope, use_cache)
+        if cached_hint is not None:
+            return cached_hint.model_copy()
+
+        system_prompt, prompt = self._build_prompt(inputData)
+        return await self._generate_with_retries(inputData, system_prompt, prompt, cache_query, cache_scope, use_cache)
+
+    async def stream_hint(self, inputData: HintResponseSchema):
+        """
+        Stream a hint as NDJSON-ready events so the IDE can render before Claude finishes:
+        {"type": "delta", "text": ...} for raw output, {"type": "field", "key": ..., "value": ...}
+        as each top-level field closes, then a final {"type": "hint", "hint": {...}}
+        (or {"type": "error", "detail": ...}). The JSON is validated only at the end;
+        if it is invalid, the usual retry loop produces the final hint.
+        """
+        cache_query, cache_scope, use_cache = self._cache_entry(inputData)
+        cached_hint = self._cached_hint(inputData, cache_query, cache_scope, use_cache)
+        if cached_hint is not None:
+            yield {"type": "hint", "hint": cached_hint.model_dump()}
+            return
+
+        system_prompt, prompt = self._build_prompt(inputData)
+        parser = StreamingJSONParser()
+        try:
+            async with contextlib.aclosing(self._select_client(inputData).stream_response(
+                prompt, max_tokens=1000, system=system_prompt
+            )) as stream:
+                async for text in stream:
+                    yield {"type": "delta", "text": text}
+                    for key in parser.feed(text):
+                        yield {"type": "field", "key": key, "value": parser.value(key)}
+
+            hint = self._hint_from_response(parser.text, parser.parse)
+        except Exception as e:
+            logger.warning(f"Streamed hint failed, falling back to retries: {str(e)}")
+            try:
+                hint = await self._generate_with_retries(inputData, system_prompt, prompt, cache_query, cache_scope, use_cache)
+            except Exception as retry_error:
+                yield {"type": "error", "detail": f"Failed to generate hint: {str(retry_error)}"}
+                return
+        else:
+            self._store_hint(inputData, cache_query, cache_scope, use_cache, hint)
+
+        yield {"type": "hint", "hint": hint.model_dump()}
+
+    def _cache_entry(self, inputData: HintResponseSchema) -> tuple:
+        """
+        Near-identical questions on the same task and the same code reuse a cached hint.
+        Hints that analyze test results are specific to the student's run, so skip the cache.
+        """
+        cache_query = (inputData.task_description, inputData.question)
+        cache_scope = (inputData.help_count, inputData.target_language, inputData.experience_level,
+                       self._code_digest(inputData.student_code))
+        return cache_query, cache_scope, not inputData.test_results
+
+    def _cached_hint(self, inputData: HintResponseSchema, cache_query: tuple, cache_scope: tuple,
+                     use_cache: bool) -> HintSchema | None:
+        """
+        Look up a cached hint. Requests with test results skip the semantic cache, but a student
+        clicking Help again with the same code, question and results gets the same hint back.
+        """
+        if use_cache:
+            return self.hint_cache.get(*cache_query, cache_scope)
+        return self._repeat_cache.get(self._repeat_key(inputData))
+
+    def _store_hint(self, inputData: HintResponseSchema, cache_query: tuple, cache_scope: tuple,
+                    use_cache: bool, hint: HintSchema):
+        if use_cache:
+            self.hint_cache.put(*cache_query, cache_scope, hint)
+        else:
+            self._repeat_cache.set(self._repeat_key(inputData), hint)
+
+    @staticmethod
+    def _code_digest(student_code: str) -> str:
+        """Hash the code, ignoring trailing whitespace and leading/trailing blank lines"""
+        normalized = "\n".join(line.rstrip() for line in student_code.strip().splitlines())
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    @staticmethod
+    def _repeat_key(inputData: HintResponseSchema) -> str:
+        return hashlib.sha256(inputData.model_dump_json().encode()).hexdigest()
+
+    def _select_client(self, inputData: HintResponseSchema):
+        """
+        Route gentle first hints on short code to Haiku. Escalating hints, long code
+        and test-failure analysis stay on Sonnet.
+        """
+        if (inputData.help_count <= 1 and len(inputData.student_code) < HINT_FAST_MODEL_MAX_CODE_CHARS
+                and not inputData.test_results):
+            return self.fast_client
+        return self.client
+
+    def _build_prompt(self, inputData: HintResponseSchema) -> tuple:
+        """Log the request's test results and return (system_prompt, prompt)"""
         # Log test results info with detailed data
         if inputData.test_results:
             logger.info("=" * 80)
@@ -50,7 +159,10 @@ class LiveHelperAgent:
         else:
             logger.info("📊 No test results provided")
 
-        prompt = get_helper_prompt(
+        # Built once here so its size can be logged without searching the prompt
+        test_results_section = build_test_results_section(inputData.test_results) if inputData.test_results else ""
+
+        system_prompt, prompt = get_helper_prompt(
             task_description=inputData.task_description,
             concepts=inputData.concepts,
             student_code=inputData.student_code,
@@ -60,37 +172,56 @@ class LiveHelperAgent:
             known_language=inputData.known_language,
             target_language=inputData.target_language,
             experience_level=inputData.experience_level,
-            test_results=inputData.test_results  # NEW: Pass test results for analysis
+            test_results=inputData.test_results,  # NEW: Pass test results for analysis
+            test_results_section=test_results_section
         )
 
         # Log if test results section is in prompt
         if inputData.test_results:
-            if "TEST RESULTS:" in prompt:
+            if test_results_section:
                 logger.info("✅ Test results section FOUND in prompt")
                 # Log how many characters the test section is
-                test_section_start = prompt.find("TEST RESULTS:")
-                test_section_end = prompt.find("Student's Question:", test_section_start)
-                if test_section_start != -1 and test_section_end != -1:
-                    section_length = test_section_end - test_section_start
-                    logger.info(f"   Test results section length: {section_length} chars")
+                logger.info(f"   Test results section length: {len(test_results_section)} chars")
             else:
                 logger.warning("❌ Test results were provided but NOT FOUND in prompt!")
 
+        return system_prompt, prompt
+
+    def _hint_from_response(self, response_text: str, extract) -> HintSchema:
+        """
+        Clean JSON responses are parsed and validated in one pass by pydantic's Rust core;
+        anything else goes through `extract` (the lenient JSON extraction) first.
+        """
+        try:
+            return HintSchema.model_validate_json(response_text)
+        except ValidationError:
+            return self._validate_hint(extract())
+
+    def _validate_hint(self, data: dict) -> HintSchema:
+        requirements = ["hint", "hint_type"]
+        for req in requirements:
+            if req not in data:
+                raise ValueError(f"Missing required field '{req}' in the response data.")
+
+        if "example_code" not in data:
+            data["example_code"] = None
+
+        return HintSchema(**data)
+
+    async def _generate_with_retries(self, inputData: HintResponseSchema, system_prompt: str, prompt: str,
+                                     cache_query: tuple, cache_scope: tuple, use_cache: bool) -> HintSchema:
         last_error = None
+        messages = prompt
         for attempt in range(self.max_retries):
+            response_text = None
             try:
                 logger.info(f"Live Helper Agent attempt {attempt + 1}/{self.max_retries}")
-                response_text = self.client.generate_response(prompt, max_tokens=1000)
-                
-                data = extract_json_from_response(response_text)
-
-                requirements = ["hint", "hint_type"]
-                for req in requirements:
-                    if req not in data:
-                        raise ValueError(f"Missing required field '{req}' in the response data.")
+                data = await self._select_client(inputData).generate_structured(
+                    messages, _HINT_SCHEMA, max_tokens=1000, system=system_prompt
+                )
+                response_text = json.dumps(data)
 
-                if "example_code" not in data:
-                    data["example_code"] = None
+                hint = self._validate_hint(data)
 
                 logger.info(f"Successfully generated hint on attempt {attempt + 1}")
 
@@ -98,28 +229,27 @@ class LiveHelperAgent:
                 if inputData.test_results:
                     logger.info("=" * 80)
                     logger.info("🎯 GENERATED HINT (with test results):")
-                    logger.info(f"   Hint Type: {data.get('hint_type', 'N/A')}")
-                    logger.info(f"   Hint Preview: {data.get('hint', '')[:200]}...")
+                    logger.info(f"   Hint Type: {hint.hint_type}")
+                    logger.info(f"   Hint Preview: {hint.hint[:200]}...")
                     logger.info("=" * 80)
 
-                return HintSchema(**data)
+                self._store_hint(inputData, cache_query, cache_scope, use_cache, hint)
+                return hint
                 
             except (ValueError, KeyError) as e:
                 last_error = e
                 logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
                 
-                # If not the last attempt, add a note to the prompt to be more strict
+                # If not the last attempt, ask for a correction in a follow-up turn
+                # (the original prompt stays unchanged so it can hit the prompt cache)
                 if attempt < self.max_retries - 1:
-                    prompt += f"\n\nIMPORTANT: Previous attempt failed due to invalid JSON format. Ensure your response is ONLY valid JSON with no additional text."
+                    messages = build_retry_messages(prompt, response_text, f"IMPORTANT: Previous attempt failed: {str(e)}. Include both 'hint' and 'hint_type'.")
                 continue
         
         # If all retries failed, raise the last error
         logger.error(f"All {self.max_retries} attempts failed")
         raise ValueError(f"Failed to generate hint after {self.max_retries} attempts: {str(last_error)}")
     
-live_helper_agent = None
+@functools.cache
 def get_live_helper_agent() -> LiveHelperAgent:
-    global live_helper_agent
-    if live_helper_agent is None:
-        live_helper_agent = LiveHelperAgent()
-    return live_helper_agent
\ No newline at end of file
+    return LiveHelperAgent()
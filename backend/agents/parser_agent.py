@@ -2,16 +2,26 @@
 Parse Assignments and break them down into smaller tasks with dependencies.
 """
 
+import functools
+import asyncio
 import logging
 import json
-from typing import List
+from typing import Dict, List
 from pyd_models.schemas import AssignmentSchema, TaskBreakdownSchema, TestCase
-from services import get_anthropic_client
+from services import get_anthropic_client, build_retry_messages
 from utils.agent_prompts import get_parser_prompt, get_test_generation_prompt
 from utils.json_parser import extract_json_from_response, validate_task_breakdown
 
 logger = logging.getLogger(__name__)
 
+# Output schemas for structured (tool-call) responses, derived from the models so they can't drift
+_TASK_BREAKDOWN_SCHEMA = TaskBreakdownSchema.model_json_schema()
+_TEST_CASES_SCHEMA = {
+    "type": "object",
+    "properties": {"tests": {"type": "array", "items": TestCase.model_json_schema()}},
+    "required": ["tests"]
+}
+
 #Agent responsible for parsing assignments and creating task breakdowns
 class ParserAgent:
 
@@ -19,8 +29,10 @@ class ParserAgent:
         # Use Haiku for parser - fast and cost-effective for structured output
         self.client = get_anthropic_client(model="claude-3-5-haiku-20241022")
         self.max_retries = 3
+        # Message Batches test jobs: batch_id -> {custom_id: filename}
+        self._pending_test_batches = {}
 
-    def generate_test_cases_for_file(self, assignment_text: str, file_data: dict, target_language: str) -> List[TestCase]:
+    async def generate_test_cases_for_file(self, assignment_text: str, file_data: dict, target_language: str) -> List[TestCase]:
         """
         Generate test cases for a SINGLE file (PER-FILE GENERATION)
 
@@ -47,70 +59,146 @@ class ParserAgent:
             else:
                 file_dict = file_data
 
-            prompt = get_test_generation_prompt(assignment_text, [file_dict], target_language)
+            system_prompt, prompt = get_test_generation_prompt(assignment_text, [file_dict], target_language)
 
-            # Try to generate test cases with retries
-            for attempt in range(self.max_retries):
-                try:
-                    logger.info(f"Test generation for {filename}: attempt {attempt + 1}/{self.max_retries}")
-                    response_text = self.client.generate_response(prompt, max_tokens=2500)
+            return await self._generate_tests(system_prompt, prompt, filename)
 
-                    logger.info(f"Received response from AI for {filename} (length: {len(response_text)} chars)")
-                    logger.debug(f"Response preview: {response_text[:500]}")
+        except Exception as e:
+            logger.error("=" * 80)
+            logger.error(f"✗ UNEXPECTED ERROR generating test cases for {filename}: {str(e)}")
+            logger.error("Returning empty list")
+            logger.error("=" * 80)
+            return []  # Return empty list instead of crashing
 
-                    # Extract JSON array from response
-                    test_data = extract_json_from_response(response_text)
 
-                    # If response is a dict with 'tests' key, extract it
-                    if isinstance(test_data, dict) and 'tests' in test_data:
-                        test_data = test_data['tests']
+    async def generate_test_cases(self, assignment_text: str, files: List[dict], target_language: str) -> Dict[str, List[TestCase]]:
+        """
+        Generate test cases for every file concurrently (one Claude call per file).
+        A file whose generation fails gets an empty list instead of failing the others.
+        """
+        results = await asyncio.gather(
+            *[self.generate_test_cases_for_file(assignment_text, file_data, target_language) for file_data in files],
+            return_exceptions=True
+        )
 
-                    # Ensure it's a list
-                    if not isinstance(test_data, list):
-                        raise ValueError(f"Test data must be a list, got {type(test_data)}")
+        tests_by_file = {}
+        for file_data, result in zip(files, results):
+            filename = file_data.get('filename', 'unknown')
+            if isinstance(result, BaseException):
+                logger.error(f"Test generation for {filename} raised: {result}")
+                result = []
+            tests_by_file[filename] = result
+        return tests_by_file
 
-                    # Validate and create TestCase objects
-                    test_cases = []
-                    for idx, test in enumerate(test_data):
-                        try:
-                            test_case = TestCase(**test)
-                            test_cases.append(test_case)
-                        except Exception as e:
-                            logger.warning(f"Skipping invalid test case {idx}: {e} - Data: {test}")
-                            continue
+    async def submit_test_cases_batch(self, assignment_text: str, files: List[dict], target_language: str) -> str:
+        """
+        Submit one test generation request per file as a Message Batches job
+        (half the cost, results can take minutes). Returns the batch id.
+        """
+        filenames = {}
+        requests = []
+        for index, file_data in enumerate(files):
+            system_prompt, prompt = get_test_generation_prompt(assignment_text, [file_data], target_language)
+            # custom_id only allows [a-zA-Z0-9_-], so filenames can't be used directly
+            custom_id = f"file-{index}"
+            filenames[custom_id] = file_data.get('filename', 'unknown')
+            requests.append({
+                'custom_id': custom_id,
+                'prompt': prompt,
+                'max_tokens': 2500,
+                'system': system_prompt
+            })
+
+        batch_id = await self.client.submit_batch(requests)
+        self._pending_test_batches[batch_id] = filenames
+        return batch_id
+
+    async def get_test_cases_batch(self, batch_id: str) -> Dict[str, List[TestCase]] | None:
+        """
+        Return {filename: List[TestCase]} once the batch has ended, or None while it is
+        still processing. Files whose request failed or returned invalid JSON get [].
+        """
+        if batch_id not in self._pending_test_batches:
+            raise ValueError(f"Unknown batch id: {batch_id}")
 
-                    logger.info("=" * 80)
-                    logger.info(f"✓ Successfully generated {len(test_cases)} test cases for {filename}")
-                    logger.info("=" * 80)
-                    return test_cases
+        responses = await self.client.get_batch_results(batch_id)
+        if responses is None:
+            return None
 
-                except (ValueError, KeyError, json.JSONDecodeError) as e:
-                    logger.warning(f"Test generation for {filename} attempt {attempt + 1} failed: {str(e)}")
+        tests_by_file = {}
+        for custom_id, filename in self._pending_test_batches.pop(batch_id).items():
+            tests_by_file[filename] = []
+            if custom_id not in responses:
+                continue
+            try:
+                tests_by_file[filename] = self._test_cases_from_response(responses[custom_id])
+            except ValueError as e:
+                logger.warning(f"Batch test generation for {filename} returned invalid tests: {e}")
+        return tests_by_file
+
+    async def _generate_tests(self, system_prompt: str, prompt: str, label: str) -> List[TestCase]:
+        """Shared retry loop for test generation; returns [] once all attempts fail"""
+        messages = prompt
+        for attempt in range(self.max_retries):
+            response_text = None
+            try:
+                logger.info(f"Test generation for {label}: attempt {attempt + 1}/{self.max_retries}")
+                data = await self.client.generate_structured(messages, _TEST_CASES_SCHEMA, max_tokens=2500, system=system_prompt)
+                response_text = json.dumps(data)
 
-                    if attempt < self.max_retries - 1:
-                        prompt += f"\n\nIMPORTANT: Previous attempt failed. Ensure your response is ONLY a valid JSON array starting with [ and ending with ]."
-                    continue
+                logger.debug(f"Response preview: {response_text[:500]}")
 
-            logger.error("=" * 80)
-            logger.error(f"✗ FAILED to generate test cases for {filename} after all retries")
-            logger.error("Returning empty list")
-            logger.error("=" * 80)
-            return []
+                test_cases = self._test_cases_from_data(data)
 
-        except Exception as e:
-            logger.error("=" * 80)
-            logger.error(f"✗ UNEXPECTED ERROR generating test cases for {filename}: {str(e)}")
-            logger.error("Returning empty list")
-            logger.error("=" * 80)
-            return []  # Return empty list instead of crashing
+                logger.info("=" * 80)
+                logger.info(f"✓ Successfully generated {len(test_cases)} test cases for {label}")
+                logger.info("=" * 80)
+                return test_cases
 
+            except (ValueError, KeyError, json.JSONDecodeError) as e:
+                logger.warning(f"Test generation for {label} attempt {attempt + 1} failed: {str(e)}")
 
-    def parse_assignment(self, inputData: AssignmentSchema) -> TaskBreakdownSchema:
+                if attempt < self.max_retries - 1:
+                    messages = build_retry_messages(prompt, response_text, f"IMPORTANT: Previous attempt failed: {str(e)}. Return every test case in the 'tests' array.")
+                continue
+
+        logger.error("=" * 80)
+        logger.error(f"✗ FAILED to generate test cases for {label} after all retries")
+        logger.error("Returning empty list")
+        logger.error("=" * 80)
+        return []
+
+    def _test_cases_from_response(self, response_text: str) -> List[TestCase]:
+        """Extract the JSON test array from a text response (batch results)"""
+        return self._test_cases_from_data(extract_json_from_response(response_text))
+
+    def _test_cases_from_data(self, test_data) -> List[TestCase]:
+        """Build TestCase objects from parsed JSON, skipping invalid entries"""
+        # If response is a dict with 'tests' key, extract it
+        if isinstance(test_data, dict) and 'tests' in test_data:
+            test_data = test_data['tests']
+
+        # Ensure it's a list
+        if not isinstance(test_data, list):
+            raise ValueError(f"Test data must be a list, got {type(test_data)}")
+
+        # Validate and create TestCase objects
+        test_cases = []
+        for idx, test in enumerate(test_data):
+            try:
+                test_case = TestCase(**test)
+                test_cases.append(test_case)
+            except Exception as e:
+                logger.warning(f"Skipping invalid test case {idx}: {e} - Data: {test}")
+                continue
+        return test_cases
+
+    async def parse_assignment(self, inputData: AssignmentSchema) -> TaskBreakdownSchema:
         """
-        Parse assignment with retry logic for robust JSON extraction.
-        Retries up to max_retries times if JSON parsing fails.
+        Parse assignment into a task breakdown returned as a structured tool call.
+        Retries up to max_retries times if the result fails validation.
         """
-        prompt = get_parser_prompt(
+        system_prompt, prompt = get_parser_prompt(
             assignment_text=inputData.assignment_text,
             target_language=inputData.target_language,
             known_language=inputData.known_language,
@@ -119,17 +207,18 @@ class ParserAgent:
 
         last_error = None
         task_breakdown_result = None
+        messages = prompt
 
         for attempt in range(self.max_retries):
+            response_text = None
             try:
                 logger.info(f"Parser Agent attempt {attempt + 1}/{self.max_retries}")
-                response_text = self.client.generate_response(prompt, max_tokens=3000)
+                data = await self.client.generate_structured(messages, _TASK_BREAKDOWN_SCHEMA, max_tokens=3000, system=system_prompt)
+                response_text = json.dumps(data)
 
                 # Log response for debugging
                 logger.info(f"AI response preview (first 500 chars): {response_text[:500]}")
 
-                data = extract_json_from_response(response_text)
-
                 # Log parsed data keys
                 logger.info(f"Parsed JSON keys: {list(data.keys()) if isinstance(data, dict) else 'not a dict'}")
 
@@ -183,11 +272,13 @@ class ParserAgent:
                 logger.warning(f"Attempt {attempt + 1} failed: {error_msg}")
 
                 # If not the last attempt, add specific guidance based on the error
+                # as a follow-up turn so the original prompt stays cacheable
                 if attempt < self.max_retries - 1:
                     if "overview" in error_msg:
-                        prompt += f"\n\nCRITICAL: Your response MUST start with the 'overview' field at the top level. Structure: {{\"overview\": \"...\", \"total_estimated_time\": \"...\", \"template_structure\": {{...}}, \"files\": [...]}}"
+                        correction = f"CRITICAL: Your response MUST start with the 'overview' field at the top level. Structure: {{\"overview\": \"...\", \"total_estimated_time\": \"...\", \"template_structure\": {{...}}, \"files\": [...]}}"
                     else:
-                        prompt += f"\n\nIMPORTANT: Previous attempt failed: {error_msg}. Ensure your response is ONLY valid JSON with ALL required fields."
+                        correction = f"IMPORTANT: Previous attempt failed: {error_msg}. Ensure your response is ONLY valid JSON with ALL required fields."
+                    messages = build_retry_messages(prompt, response_text, correction)
                 continue
 
         # If all retries failed, raise the last error
@@ -195,11 +286,25 @@ class ParserAgent:
             logger.error(f"All {self.max_retries} attempts failed")
             raise ValueError(f"Failed to parse assignment after {self.max_retries} attempts: {str(last_error)}")
 
-        # DISABLED: Automatic test generation during parsing
-        # Tests are now generated on-demand when user clicks "Generate Tests" button
+        # Automatic test generation during parsing is off by default
+        # Tests are normally generated on-demand when user clicks "Generate Tests" button
         # This allows the AI to analyze the user's actual code, not just the boilerplate
         files_list = task_breakdown_result.get('files', [])
-        if files_list:
+        if files_list and inputData.batch:
+            task_breakdown_result['tests_batch_id'] = await self.submit_test_cases_batch(
+                inputData.assignment_text, files_list, inputData.target_language
+            )
+            logger.info(f"Submitted test generation for {len(files_list)} files as batch {task_breakdown_result['tests_batch_id']}")
+            for file_data in files_list:
+                # Filled in from GET /parse-assignment/{batch_id}
+                file_data['tests'] = []
+        elif files_list and inputData.generate_tests:
+            tests_by_file = await self.generate_test_cases(
+                inputData.assignment_text, files_list, inputData.target_language
+            )
+            for file_data in files_list:
+                file_data['tests'] = [test.model_dump() for test in tests_by_file.get(file_data.get('filename'), [])]
+        elif files_list:
             logger.info(f"Skipping automatic test generation for {len(files_list)} files")
             logger.info("Tests will be generated on-demand from user's code")
             for file_data in files_list:
@@ -210,7 +315,7 @@ class ParserAgent:
 
         return TaskBreakdownSchema(**task_breakdown_result)
 
-    def generate_tests_from_code(self, code: str, language: str, filename: str, assignment_description: str = None) -> List[TestCase]:
+    async def generate_tests_from_code(self, code: str, language: str, filename: str, assignment_description: str = None) -> List[TestCase]:
         """
         Generate test cases from user's completed code.
 
@@ -243,53 +348,9 @@ class ParserAgent:
                 'code': code
             }
 
-            prompt = get_test_generation_prompt(context, [file_dict], language)
-
-            # Try to generate test cases with retries
-            for attempt in range(self.max_retries):
-                try:
-                    logger.info(f"Test generation attempt {attempt + 1}/{self.max_retries}")
-                    response_text = self.client.generate_response(prompt, max_tokens=2500)
+            system_prompt, prompt = get_test_generation_prompt(context, [file_dict], language)
 
-                    logger.info(f"Received response (length: {len(response_text)} chars)")
-
-                    # Extract JSON array from response
-                    test_data = extract_json_from_response(response_text)
-
-                    # If response is a dict with 'tests' key, extract it
-                    if isinstance(test_data, dict) and 'tests' in test_data:
-                        test_data = test_data['tests']
-
-                    # Ensure it's a list
-                    if not isinstance(test_data, list):
-                        raise ValueError(f"Test data must be a list, got {type(test_data)}")
-
-                    # Validate and create TestCase objects
-                    test_cases = []
-                    for idx, test in enumerate(test_data):
-                        try:
-                            test_case = TestCase(**test)
-                            test_cases.append(test_case)
-                        except Exception as e:
-                            logger.warning(f"Skipping invalid test case {idx}: {e}")
-                            continue
-
-                    logger.info("=" * 80)
-                    logger.info(f"✓ Successfully generated {len(test_cases)} test cases from user code")
-                    logger.info("=" * 80)
-                    return test_cases
-
-                except (ValueError, KeyError, json.JSONDecodeError) as e:
-                    logger.warning(f"Test generation attempt {attempt + 1} failed: {str(e)}")
-
-                    if attempt < self.max_retries - 1:
-                        prompt += f"\n\nIMPORTANT: Previous attempt failed. Ensure your response is ONLY a valid JSON array starting with [ and ending with ]."
-                    continue
-
-            logger.error("=" * 80)
-            logger.error(f"✗ FAILED to generate test cases after all retries")
-            logger.error("=" * 80)
-            return []
+            return await self._generate_tests(system_prompt, prompt, f"{filename} (user code)")
 
         except Exception as e:
             logger.error("=" * 80)
@@ -297,10 +358,6 @@ class ParserAgent:
             logger.error("=" * 80)
             return []
 
-parser_agent = None
-
+@functools.cache
 def get_parser_agent() -> ParserAgent:
-    global parser_agent
-    if parser_agent is None:
-        parser_agent = ParserAgent()
-    return parser_agent
+    return ParserAgent()
@@ -10,6 +10,12 @@ Security and configuration settings for the Scaffy backend
 MAX_ASSIGNMENT_TEXT_LENGTH = 50_000  # ~50KB of text (about 10,000 words)
 MAX_CODE_LENGTH = 100_000  # ~100KB (reasonable for most assignments)
 MAX_HINT_QUESTION_LENGTH = 3_000  # For hint questions
+MAX_STDIN_LENGTH = 100_000  # Program input sent with a code execution request
+
+# Code execution responses are read only up to this size (stdout/stderr are cut to
+# 10K chars anyway; the start of the output is recovered from the partial response)
+PISTON_MAX_RESPONSE_BYTES = 128 * 1024
+LOCAL_EXEC_MEMORY_LIMIT_BYTES = 512 * 1024 * 1024  # Address-space limit for locally run Python code
 
 # File upload limits (in bytes)
 MAX_PDF_SIZE = 7 * 1024 * 1024  # 7MB for PDFs
@@ -28,6 +34,11 @@ RATE_LIMIT_PER_MINUTE = 30  # Max requests per minute per IP
 RATE_LIMIT_PER_HOUR = 300  # Max requests per hour per IP
 RATE_LIMIT_PER_DAY = 1000  # Daily cap to prevent abuse
 
+# Outgoing Anthropic API pacing (per model) - keep just under the account limits
+ANTHROPIC_REQUESTS_PER_MINUTE = 50
+ANTHROPIC_TOKENS_PER_MINUTE = 80_000  # Input + output tokens
+ANTHROPIC_REQUEST_BURST = 10  # Requests allowed back-to-back before pacing kicks in
+
 # ============================================
 # CONTENT VALIDATION
 # ============================================
@@ -67,6 +78,56 @@ API_TIMEOUT_SECONDS = 60  # Max time for API calls
 CODE_EXECUTION_TIMEOUT = 30  # Max time for code execution (Piston)
 PDF_PROCESSING_TIMEOUT = 30  # Max time for PDF processing
 
+# ============================================
+# CONCURRENCY
+# ============================================
+
+MAX_CONCURRENT_FILE_GENERATIONS = 8  # Max files scaffolded in parallel per request
+ANTHROPIC_MAX_CONCURRENT_REQUESTS = 20  # Max in-flight Claude calls per model
+ANTHROPIC_MAX_CONNECTIONS = 64  # Shared HTTP pool size across all agents
+ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS = 32  # Idle connections kept open for reuse
+PISTON_MAX_CONNECTIONS = 8  # Piston is one host over HTTP/2, so concurrent runs multiplex on a connection
+PISTON_MAX_KEEPALIVE_CONNECTIONS = 8  # Idle Piston connections kept open for reuse
+PISTON_GZIP_MIN_BYTES = 2048  # Piston request bodies at least this large are gzip-compressed
+PISTON_MAX_CONCURRENT_RUNS = 16  # Max in-flight code executions (tests of one request run in parallel)
+MAX_CONCURRENT_TEST_RUNS = 8  # Max in-flight executions per test suite, so one suite can't take every run slot
+LOCAL_EXEC_WARM_POOL_SIZE = 4  # Pre-started Python interpreters kept ready by the local executor
+
+# ============================================
+# CACHING
+# ============================================
+
+CODEGEN_CACHE_SIZE = 512  # Max cached file scaffolding responses
+CODEGEN_CACHE_TTL_SECONDS = 3600  # Cached scaffolding expires after 1 hour
+RESPONSE_CACHE_SIZE = 1024  # Max cached Claude responses for byte-identical requests
+RESPONSE_CACHE_TTL_SECONDS = 3600  # Cached responses expire after 1 hour
+CODE_RESULT_CACHE_SIZE = 2048  # Max cached code execution results (keyed by language, code and stdin)
+CODE_RESULT_CACHE_TTL_SECONDS = 3600  # Cached execution results expire after 1 hour
+CODE_ERROR_CACHE_TTL_SECONDS = 2  # Piston service errors are replayed this long instead of hitting Piston again
+HINT_CACHE_SIZE = 5000  # Max cached hints (least recently used is evicted)
+HINT_CACHE_SIMILARITY = 0.92  # Min cosine similarity to reuse a cached hint
+HINT_CACHE_DIMENSIONS = 1024  # Size of the hashed question embedding
+HINT_CACHE_CONTEXT_WEIGHT = 0.3  # Share of the task description in the cache key (the rest is the question)
+HINT_CACHE_TTL_SECONDS = 3600  # Cached hints expire after 1 hour
+HINT_REPEAT_CACHE_SIZE = 512  # Max cached hints for exact repeats of requests carrying test results
+HINT_REPEAT_CACHE_TTL_SECONDS = 300  # Repeating such a request within 5 minutes reuses the hint
+
+# ============================================
+# TOKEN BUDGET MODEL
+# ============================================
+
+TOKEN_BUDGET_MAX_SAMPLES = 200  # Fit on the most recent generations only
+TOKEN_BUDGET_MIN_SAMPLES = 20  # Keep the heuristic budget until this many samples exist
+TOKEN_BUDGET_REFIT_EVERY = 20  # Refit after this many new samples
+TOKEN_BUDGET_MIN_TOKENS = 1500
+TOKEN_BUDGET_MAX_TOKENS = 8000
+
+# ============================================
+# MODEL ROUTING
+# ============================================
+
+HINT_FAST_MODEL_MAX_CODE_CHARS = 2000  # First hints on code shorter than this use Haiku
+
 # ============================================
 # LOGGING
 # ============================================
@@ -1,7 +1,9 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+import contextlib
 import os
+import orjson
 import uvicorn
 import logging
 from dotenv import load_dotenv
@@ -35,27 +37,49 @@ from pyd_models.schemas import (
     ConceptExampleResponse,
     BatchBoilerPlateCodeSchema,
     BatchStarterCodeResponse,
+    BatchJobResponse,
     GenerateTestsRequest,
     GenerateTestsResponse,
+    BatchTestsResponse,
     FeedbackRequest,
     FeedbackResponse
 )
 
 # Import agents and services
-from agents.parser_agent import ParserAgent
-from agents.codegen_agent import CodegenAgent
-from agents.live_helper import LiveHelperAgent
-from agents.concept_example import ConceptExampleAgent
+from agents.parser_agent import get_parser_agent
+from agents.codegen_agent import get_batch_codegen_agent, get_message_batch_codegen_agent, group_tasks_by_file
+from agents.live_helper import get_live_helper_agent
+from agents.concept_example import get_concept_example_agent
+from services import close_shared_http_client
 from services.code_runner import get_code_runner
 from services.pdf_extractor import get_pdf_extractor
-from services.resend_email_service import get_resend_email_service
+from services.resend_email_service import get_resend_email_service, close_resend_email_service
+from services.token_budget import save_token_budget_samples
 
 load_dotenv()
 
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Agents are created at import; connect to Anthropic now so the first request
+    # finds a hot keep-alive connection (all agents share one pool)
+    if os.getenv("ANTHROPIC_API_KEY"):
+        await helper_agent.client.warm_up()
+    await get_code_runner().warm_up()
+    yield
+    # All agents share one Anthropic connection pool; close it cleanly on shutdown
+    await close_shared_http_client()
+    await get_code_runner().aclose()
+    await close_resend_email_service()
+    save_token_budget_samples()
+
+
 app = FastAPI(
     title="Scaffy Backend",
     description="AI-powered tool that breaks down programming assignments into manageable tasks",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Import and add rate limiting middleware
@@ -73,10 +97,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-parser_agent = ParserAgent()
-codegen_agent = CodegenAgent()
-helper_agent = LiveHelperAgent()
-concept_example_agent = ConceptExampleAgent()
+parser_agent = get_parser_agent()
+codegen_agent = get_batch_codegen_agent()
+batch_codegen_agent = get_message_batch_codegen_agent()
+helper_agent = get_live_helper_agent()
+concept_example_agent = get_concept_example_agent()
 
 @app.get("/")
 async def root():
@@ -125,7 +150,7 @@ async def parse_assignment(assignment: AssignmentSchema):
         logger.info("=" * 80)
         
         # Call Agent 1 to parse the assignment
-        result = parser_agent.parse_assignment(assignment)
+        result = await parser_agent.parse_assignment(assignment)
         return result
     
     except Exception as e:
@@ -135,6 +160,29 @@ async def parse_assignment(assignment: AssignmentSchema):
         )
 
 
+@app.get("/parse-assignment/{batch_id}", response_model=BatchTestsResponse)
+async def get_parse_assignment_tests(batch_id: str):
+    """Return the tests for a batch submitted by /parse-assignment, or 202 while it is still processing"""
+    try:
+        tests_by_file = await parser_agent.get_test_cases_batch(batch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to poll test generation batch {batch_id}: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch test generation batch: {str(e)}"
+        )
+
+    if tests_by_file is None:
+        return JSONResponse(
+            status_code=202,
+            content=BatchJobResponse(batch_id=batch_id, status="processing").model_dump()
+        )
+
+    return BatchTestsResponse(tests_by_file=tests_by_file)
+
+
 # ============================================
 # AGENT 2: STARTER CODE GENERATOR
 # ============================================
@@ -212,8 +260,8 @@ async def generate_starter_code_bacth(request: BatchBoilerPlateCodeSchema):
                         logger.error(f"❌ {filename}: Class '{cls}' has no tasks assigned!")
                         raise ValueError(f"Class '{cls}' in {filename} has no tasks. Each class must have at least one task.")
 
-        # Generate scaffolding per file
-        all_results = []
+        # Build one generation job per file, then run them concurrently
+        file_jobs = []
 
         for filename, file_data in files_map.items():
             file_tasks = file_data['tasks']
@@ -231,32 +279,38 @@ async def generate_starter_code_bacth(request: BatchBoilerPlateCodeSchema):
                 logger.info(f"  Template variables to preserve: {template_vars}")
             if method_sigs_by_class:
                 logger.info("  📋 METHOD SIGNATURES TO PRESERVE:")
-                for cls, methods in method_sigs_by_class.items():
-                    logger.info(f"    {cls}: {methods}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    for cls, methods in method_sigs_by_class.items():
+                        logger.debug("    %s: %s", cls, methods)
             else:
                 logger.info("  ⚠️  NO METHOD SIGNATURES DETECTED - will generate new methods")
             logger.info("=" * 80)
 
-            # Generate for this file only
-            file_results = codegen_agent.generate_file_scaffolding(
-                filename=filename,
-                tasks=file_tasks,
-                class_structure=class_structure,
-                template_variables=template_vars,
-                method_signatures_by_class=method_sigs_by_class
-            )
+            file_jobs.append({
+                'filename': filename,
+                'tasks': file_tasks,
+                'class_structure': class_structure,
+                'template_variables': template_vars,
+                'method_signatures_by_class': method_sigs_by_class
+            })
+
+        # Files are independent, so generate them in parallel (order is preserved)
+        file_results_list = await codegen_agent.scaffold_project(file_jobs)
 
+        all_results = []
+        for file_job, file_results in zip(file_jobs, file_results_list):
             all_results.extend(file_results)
-            logger.info(f"Successfully generated {len(file_results)} tasks for {filename}")
+            logger.info(f"Successfully generated {len(file_results)} tasks for {file_job['filename']}")
 
         elapsed_time = time.time() - start_time
         logger.info(f"Total generation completed in {elapsed_time:.2f} seconds")
 
-        logger.info("=" * 80)
-        logger.info("RETURNING TO FRONTEND:")
-        for idx, result in enumerate(all_results):
-            logger.info(f"Task {idx}: {len(result.todos)} todos, file: {result.filename}")
-        logger.info("=" * 80)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("=" * 80)
+            logger.debug("RETURNING TO FRONTEND:")
+            for idx, result in enumerate(all_results):
+                logger.debug("Task %d: %d todos, file: %s", idx, len(result.todos), result.filename)
+            logger.debug("=" * 80)
 
         return BatchStarterCodeResponse(
             tasks=all_results,
@@ -280,6 +334,50 @@ async def generate_starter_code_bacth(request: BatchBoilerPlateCodeSchema):
             )
 
 
+@app.post("/generate-starter-code-batch/submit", response_model=BatchJobResponse)
+async def submit_starter_code_batch(request: BatchBoilerPlateCodeSchema):
+    """
+    Submit starter code generation as a Message Batches job for non-interactive use.
+    Cheaper than /generate-starter-code-batch but results can take minutes;
+    poll /generate-starter-code-batch/{batch_id} for them.
+    """
+    try:
+        file_jobs = group_tasks_by_file(request.tasks)
+        batch_id = await batch_codegen_agent.submit(file_jobs)
+        logger.info(f"Submitted {len(file_jobs)} files as batch {batch_id}")
+        return BatchJobResponse(batch_id=batch_id, total_files=len(file_jobs), status="submitted")
+
+    except Exception as e:
+        logger.error(f"Failed to submit starter code batch: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to submit starter code batch: {str(e)}"
+        )
+
+
+@app.get("/generate-starter-code-batch/{batch_id}")
+async def get_starter_code_batch(batch_id: str):
+    """Return the starter code for a submitted batch, or 202 while it is still processing"""
+    try:
+        results = await batch_codegen_agent.poll(batch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to poll starter code batch {batch_id}: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch starter code batch: {str(e)}"
+        )
+
+    if results is None:
+        return JSONResponse(
+            status_code=202,
+            content=BatchJobResponse(batch_id=batch_id, status="processing").model_dump()
+        )
+
+    all_results = [result for file_results in results.values() for result in file_results]
+    return BatchStarterCodeResponse(tasks=all_results, total_tasks=len(all_results))
+
 # ============================================
 # AGENT 3: LIVE CODING HELPER
 # ============================================
@@ -299,7 +397,7 @@ async def get_hint(request: HintResponseSchema):
     """
     try:
         # Call Agent 3 to get a hint
-        result = helper_agent.provide_hint(request)
+        result = await helper_agent.provide_hint(request)
         return result
     
     except Exception as e:
@@ -308,6 +406,22 @@ async def get_hint(request: HintResponseSchema):
             detail=f"Failed to generate hint: {str(e)}"
         )
 
+
+@app.post("/get-hint-stream")
+async def get_hint_stream(request: HintResponseSchema):
+    """
+    Streaming version of /get-hint (newline-delimited JSON)
+
+    Emits "delta" events with raw model output as it arrives, "field" events as
+    each hint field completes, and ends with a single "hint" (or "error") event
+    carrying the validated HintSchema.
+    """
+    async def event_lines():
+        async for event in helper_agent.stream_hint(request):
+            yield orjson.dumps(event) + b"\n"
+
+    return StreamingResponse(event_lines(), media_type="application/x-ndjson")
+
 # ============================================
 # ON-DEMAND CONCEPT EXAMPLES
 # ============================================
@@ -319,7 +433,7 @@ async def get_concept_example(request: ConceptExampleRequest):
         logger.info(f"Generating on-demand example for concept: {request.concept} in {request.programming_language}")
         
         # Call the concept example agent
-        result = concept_example_agent.generate_example(request)
+        result = await concept_example_agent.generate_example(request)
         
         logger.info(f"Successfully generated {result.example_type} example for {request.concept}")
         return result
@@ -364,14 +478,16 @@ async def run_code(request: CodeExecutionRequest):
                 else:
                     test_cases_dicts.append(tc)
 
-            result = code_runner.run_with_tests(request.code, request.language, test_cases_dicts)
+            result = await code_runner.run_with_tests(request.code, request.language, test_cases_dicts)
         else:
             # Pass stdin if provided, otherwise use default test values
-            result = code_runner.run_code(request.code, request.language, stdin=request.stdin)
+            result = await code_runner.run_code(request.code, request.language, stdin=request.stdin)
 
         logger.info(f"Execution completed: success={result['success']}, exit_code={result['exit_code']}")
 
-        return CodeExecutionResult(**result)
+        # Serialized once by pydantic-core; returning the model would have FastAPI dump and
+        # re-validate it (every test's output included) before encoding it again
+        return Response(content=CodeExecutionResult(**result).model_dump_json(), media_type="application/json")
 
     except Exception as e:
         logger.error(f"Code execution error: {e}")
@@ -433,7 +549,7 @@ async def generate_tests(request: GenerateTestsRequest):
         logger.info(f"Language: {request.language}, Code length: {len(request.code)} chars")
 
         # Generate tests using parser agent
-        test_cases = parser_agent.generate_tests_from_code(
+        test_cases = await parser_agent.generate_tests_from_code(
             code=request.code,
             language=request.language,
             filename=request.filename,
@@ -473,7 +589,7 @@ async def send_feedback(request: FeedbackRequest):
         logger.info(f"Received feedback from {request.name} ({request.email})")
         
         resend_service = get_resend_email_service()
-        success = resend_service.send_feedback(
+        success = await resend_service.send_feedback(
             name=request.name,
             email=request.email,
             feedback=request.feedback
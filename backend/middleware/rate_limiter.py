@@ -1,33 +1,39 @@
 """Rate limiting middleware with daily cap support"""
+import os
 import time
-from collections import defaultdict
-from datetime import datetime, timedelta
+from collections import defaultdict, deque
+from datetime import date, datetime, timedelta
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
 import logging
 from config import RATE_LIMIT_PER_MINUTE, RATE_LIMIT_PER_HOUR, RATE_LIMIT_PER_DAY
+from utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
     def __init__(self):
-        self.request_log = defaultdict(list)
-        self.daily_totals = defaultdict(int)
+        # Per-IP request timestamps (oldest first), trimmed to the last hour
+        self.request_log = defaultdict(deque)
+        # Per-IP (date, count) - only today's count is ever needed
+        self.daily_totals = {}
         self.last_cleanup = time.time()
+        # Today's date is only re-derived once local midnight has passed
+        self._today_date = None
+        self._next_midnight_ts = 0.0
 
     def _cleanup_old_records(self):
         current_time = time.time()
         if current_time - self.last_cleanup < 300:
             return
-        cutoff_time = current_time - 3600
         for ip in list(self.request_log.keys()):
-            self.request_log[ip] = [(ts, count) for ts, count in self.request_log[ip] if ts > cutoff_time]
+            self._trim(ip, current_time)
             if not self.request_log[ip]:
                 del self.request_log[ip]
-        today = datetime.now().date()
-        for (ip, date) in list(self.daily_totals.keys()):
-            if date < today - timedelta(days=7):
-                del self.daily_totals[(ip, date)]
+        today = self._today(current_time)
+        for ip, (date, _) in list(self.daily_totals.items()):
+            if date < today:
+                del self.daily_totals[ip]
         self.last_cleanup = current_time
 
     def _get_client_ip(self, request: Request) -> str:
@@ -39,46 +45,76 @@ class RateLimiter:
             return real_ip
         return request.client.host if request.client else "unknown"
 
-    def _count_requests_in_window(self, ip: str, window_seconds: int) -> int:
-        current_time = time.time()
+    def _trim(self, ip: str, current_time: float):
+        """Drop timestamps older than the longest (hourly) window"""
+        log = self.request_log.get(ip)
+        cutoff_time = current_time - 3600
+        while log and log[0] <= cutoff_time:
+            log.popleft()
+
+    def _today(self, current_time: float) -> date:
+        """Current local date, recomputed only when the cached day has ended"""
+        if current_time >= self._next_midnight_ts:
+            now = datetime.fromtimestamp(current_time)
+            self._today_date = now.date()
+            self._next_midnight_ts = (datetime(now.year, now.month, now.day) + timedelta(days=1)).timestamp()
+        return self._today_date
+
+    def _count_requests_in_window(self, ip: str, window_seconds: int, current_time: float = None) -> int:
+        current_time = current_time or time.time()
+        self._trim(ip, current_time)
+        log = self.request_log.get(ip)
+        if not log:
+            return 0
+        if window_seconds >= 3600:
+            return len(log)
+
+        # Newest timestamps are on the right, so only the window itself is scanned
         cutoff_time = current_time - window_seconds
-        return sum(count for ts, count in self.request_log[ip] if ts > cutoff_time)
-
-    def _get_daily_count(self, ip: str) -> int:
-        today = datetime.now().date()
-        return self.daily_totals[(ip, today)]
-
-    def _increment_daily_count(self, ip: str):
-        today = datetime.now().date()
-        self.daily_totals[(ip, today)] += 1
+        count = 0
+        for ts in reversed(log):
+            if ts <= cutoff_time:
+                break
+            count += 1
+        return count
+
+    def _get_daily_count(self, ip: str, today: date = None) -> int:
+        today = today or self._today(time.time())
+        day, count = self.daily_totals.get(ip, (today, 0))
+        return count if day == today else 0
+
+    def _increment_daily_count(self, ip: str, today: date = None):
+        today = today or self._today(time.time())
+        self.daily_totals[ip] = (today, self._get_daily_count(ip, today) + 1)
 
     async def check_rate_limit(self, request: Request):
         self._cleanup_old_records()
         ip = self._get_client_ip(request)
         current_time = time.time()
+        today = self._today(current_time)
 
-        daily_count = self._get_daily_count(ip)
+        daily_count = self._get_daily_count(ip, today)
         if daily_count >= RATE_LIMIT_PER_DAY:
             logger.warning(f"Daily limit exceeded: {ip} ({daily_count} requests)")
-            raise HTTPException(status_code=429, detail={"error": "Daily rate limit exceeded", "message": f"Daily limit of {RATE_LIMIT_PER_DAY} requests exceeded. Try again tomorrow.", "retry_after": self._get_seconds_until_midnight()})
+            raise HTTPException(status_code=429, detail={"error": "Daily rate limit exceeded", "message": f"Daily limit of {RATE_LIMIT_PER_DAY} requests exceeded. Try again tomorrow.", "retry_after": self._get_seconds_until_midnight(current_time)})
 
-        hourly_count = self._count_requests_in_window(ip, 3600)
+        hourly_count = self._count_requests_in_window(ip, 3600, current_time)
         if hourly_count >= RATE_LIMIT_PER_HOUR:
             logger.warning(f"Hourly limit exceeded: {ip} ({hourly_count} requests)")
             raise HTTPException(status_code=429, detail={"error": "Hourly rate limit exceeded", "message": f"Limit of {RATE_LIMIT_PER_HOUR} requests/hour exceeded.", "retry_after": 3600})
 
-        minute_count = self._count_requests_in_window(ip, 60)
+        minute_count = self._count_requests_in_window(ip, 60, current_time)
         if minute_count >= RATE_LIMIT_PER_MINUTE:
             logger.warning(f"Per-minute limit exceeded: {ip} ({minute_count} requests)")
             raise HTTPException(status_code=429, detail={"error": "Rate limit exceeded", "message": f"Limit of {RATE_LIMIT_PER_MINUTE} requests/minute exceeded.", "retry_after": 60})
 
-        self.request_log[ip].append((current_time, 1))
-        self._increment_daily_count(ip)
+        self.request_log[ip].append(current_time)
+        self._increment_daily_count(ip, today)
 
-    def _get_seconds_until_midnight(self) -> int:
-        now = datetime.now()
-        tomorrow = datetime(now.year, now.month, now.day) + timedelta(days=1)
-        return int((tomorrow - now).total_seconds())
+    def _get_seconds_until_midnight(self, current_time: float = None) -> int:
+        current_time = current_time or time.time()
+        self._today(current_time)
+        return int(self._next_midnight_ts - current_time)
 
     def get_rate_limit_headers(self, ip: str) -> dict:
         return {
@@ -88,7 +124,104 @@ class RateLimiter:
             "X-RateLimit-Remaining-Hourly": str(max(0, RATE_LIMIT_PER_HOUR - self._count_requests_in_window(ip, 3600))),
         }
 
-rate_limiter = RateLimiter()
+
+# Checks every window and only then increments them all, atomically.
+# Returns {0, daily, hourly, minute} when allowed, or {window_index, count} when a limit is hit.
+_CHECK_AND_INCREMENT = """
+local counts = {}
+for i, key in ipairs(KEYS) do
+    local count = tonumber(redis.call('GET', key) or '0')
+    if count >= tonumber(ARGV[i]) then
+        return {i, count}
+    end
+    counts[i] = count
+end
+for i, key in ipairs(KEYS) do
+    redis.call('INCR', key)
+    redis.call('EXPIRE', key, ARGV[#KEYS + i])
+end
+return {0, counts[1] + 1, counts[2] + 1, counts[3] + 1}
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Fixed-window counters in Redis, shared by every worker and pod
+    (the in-process limiter only sees its own worker's traffic).
+    One script call per request checks and increments the daily, hourly and
+    minute windows; Redis errors fail open so an outage doesn't block the API.
+    """
+
+    def __init__(self, redis_client):
+        super().__init__()
+        self.redis = redis_client
+        self._script = redis_client.register_script(_CHECK_AND_INCREMENT)
+        # Recently denied IPs are rejected locally for a second, so a burst costs one round-trip
+        self._recent_denials = LRUCache(maxsize=1024, ttl=1)
+        self._last_counts = LRUCache(maxsize=4096, ttl=60)
+
+    async def check_rate_limit(self, request: Request):
+        ip = self._get_client_ip(request)
+        denial = self._recent_denials.get(ip)
+        if denial is not None:
+            raise denial
+
+        current_time = time.time()
+        epoch = int(current_time)
+        keys = [
+            f"ratelimit:{ip}:day:{self._today(current_time).isoformat()}",
+            f"ratelimit:{ip}:hour:{epoch // 3600}",
+            f"ratelimit:{ip}:minute:{epoch // 60}",
+        ]
+        limits = [RATE_LIMIT_PER_DAY, RATE_LIMIT_PER_HOUR, RATE_LIMIT_PER_MINUTE]
+        expiries = [self._get_seconds_until_midnight(current_time) + 60, 3600 + 60, 60 + 60]
+
+        try:
+            result = await self._script(keys=keys, args=limits + expiries)
+        except Exception as e:
+            logger.error(f"Redis rate limit check failed, allowing request: {e}")
+            return
+
+        exceeded, *counts = [int(value) for value in result]
+        if exceeded == 0:
+            self._last_counts.set(ip, counts)
+            return
+
+        count = counts[0]
+        if exceeded == 1:
+            logger.warning(f"Daily limit exceeded: {ip} ({count} requests)")
+            denial = HTTPException(status_code=429, detail={"error": "Daily rate limit exceeded", "message": f"Daily limit of {RATE_LIMIT_PER_DAY} requests exceeded. Try again tomorrow.", "retry_after": self._get_seconds_until_midnight(current_time)})
+        elif exceeded == 2:
+            logger.warning(f"Hourly limit exceeded: {ip} ({count} requests)")
+            denial = HTTPException(status_code=429, detail={"error": "Hourly rate limit exceeded", "message": f"Limit of {RATE_LIMIT_PER_HOUR} requests/hour exceeded.", "retry_after": 3600})
+        else:
+            logger.warning(f"Per-minute limit exceeded: {ip} ({count} requests)")
+            denial = HTTPException(status_code=429, detail={"error": "Rate limit exceeded", "message": f"Limit of {RATE_LIMIT_PER_MINUTE} requests/minute exceeded.", "retry_after": 60})
+        self._recent_denials.set(ip, denial)
+        raise denial
+
+    def get_rate_limit_headers(self, ip: str) -> dict:
+        daily_count, hourly_count, _ = self._last_counts.get(ip, (0, 0, 0))
+        return {
+            "X-RateLimit-Limit-Daily": str(RATE_LIMIT_PER_DAY),
+            "X-RateLimit-Remaining-Daily": str(max(0, RATE_LIMIT_PER_DAY - daily_count)),
+            "X-RateLimit-Limit-Hourly": str(RATE_LIMIT_PER_HOUR),
+            "X-RateLimit-Remaining-Hourly": str(max(0, RATE_LIMIT_PER_HOUR - hourly_count)),
+        }
+
+
+def _create_rate_limiter() -> RateLimiter:
+    """Use Redis when REDIS_URL is set (multiple workers/pods), otherwise in-process state"""
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return RateLimiter()
+
+    import redis.asyncio as redis_asyncio
+    logger.info("Using Redis-backed rate limiting")
+    return RedisRateLimiter(redis_asyncio.from_url(redis_url))
+
+
+rate_limiter = _create_rate_limiter()
 
 async def rate_limit_middleware(request: Request, call_next):
     if request.url.path in ["/", "/health", "/docs", "/redoc", "/openapi.json"]:
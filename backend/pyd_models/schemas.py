@@ -1,15 +1,19 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, AliasChoices
 from typing import List, Optional, Dict
+from config import MAX_ASSIGNMENT_TEXT_LENGTH, MAX_CODE_LENGTH, MAX_HINT_QUESTION_LENGTH, MAX_STDIN_LENGTH
 
 
 #--------Schema for Agent 1: Parser--------#
 
 #Input
 class AssignmentSchema(BaseModel):
-    assignment_text: str
+    # Size limits are enforced here so oversized requests are rejected before any prompt is built
+    assignment_text: str = Field(max_length=MAX_ASSIGNMENT_TEXT_LENGTH)
     target_language: str
     known_language: Optional[str] = None
     experience_level: str
+    generate_tests: bool = False  # Opt in to generating tests for every file while parsing
+    batch: bool = False  # Generate the tests through a Message Batches job instead (poll /parse-assignment/{batch_id})
 
 
 class TaskSchema(BaseModel):
@@ -58,6 +62,7 @@ class TaskBreakdownSchema(BaseModel):
     total_estimated_time: str
     template_structure: Optional[TemplateStructure] = None  # NEW: template info
     files: List[FileSchema]  # Changed from: tasks: List[TaskSchema]
+    tests_batch_id: Optional[str] = None  # Set when tests were submitted as a batch job
 
 
 
@@ -85,6 +90,11 @@ class StarterCode(BaseModel):
     concept_examples: Optional[Dict[str, str]] = None
     filename: str  # NEW: which file this task belongs to
 
+# Raw AI response for one file: shared code plus TODOs keyed by task number ("1", "2", ...)
+class FileScaffoldResponse(BaseModel):
+    code_snippet: str = Field(validation_alias=AliasChoices("code_snippet", "code"))
+    task_todos: Dict[str, List[str]]
+
 # Input - batch of code generation requests
 class BatchBoilerPlateCodeSchema(BaseModel):
     tasks: List[BoilerPlateCodeSchema]
@@ -95,14 +105,20 @@ class BatchStarterCodeResponse(BaseModel):
     total_tasks: int
     generation_time: Optional[str] = None
 
+# Output - handle for scaffolding submitted through the Message Batches API
+class BatchJobResponse(BaseModel):
+    batch_id: str
+    total_files: Optional[int] = None
+    status: str  # "submitted" or "processing"
+
 #--------Schema for Agent 3: Live Helper--------#
 
 #Input
 class HintResponseSchema(BaseModel):
-   task_description: str
+   task_description: str = Field(max_length=MAX_ASSIGNMENT_TEXT_LENGTH)
    concepts: List[str]
-   student_code: str
-   question: str
+   student_code: str = Field(max_length=MAX_CODE_LENGTH)
+   question: str = Field(max_length=MAX_HINT_QUESTION_LENGTH)
    previous_hints: List[str]
    help_count: int
    known_language: Optional[str] = None
@@ -121,9 +137,9 @@ class HintSchema(BaseModel):
 
 #Input
 class CodeExecutionRequest(BaseModel):
-    code: str
+    code: str = Field(max_length=MAX_CODE_LENGTH)
     language: str
-    stdin: Optional[str] = None  # Optional stdin input for input() calls
+    stdin: Optional[str] = Field(default=None, max_length=MAX_STDIN_LENGTH)  # Optional stdin input for input() calls
     test_cases: Optional[List[TestCase]] = None  # Optional test cases to run
 
 # Individual Test Result
@@ -165,7 +181,7 @@ class ConceptExampleRequest(BaseModel):
     concept: str
     programming_language: str
     known_language: Optional[str] = None
-    context: Optional[str] = None  # Optional: what they're trying to do
+    context: Optional[str] = Field(default=None, max_length=MAX_HINT_QUESTION_LENGTH)  # Optional: what they're trying to do
 
 #Output
 class ConceptExampleResponse(BaseModel):
@@ -180,16 +196,19 @@ class ConceptExampleResponse(BaseModel):
 
 #Input
 class GenerateTestsRequest(BaseModel):
-    code: str  # User's completed code
+    code: str = Field(max_length=MAX_CODE_LENGTH)  # User's completed code
     language: str  # Programming language
     filename: str  # Filename for context
-    assignment_description: Optional[str] = None  # Optional: original assignment for context
+    assignment_description: Optional[str] = Field(default=None, max_length=MAX_ASSIGNMENT_TEXT_LENGTH)  # Optional: original assignment for context
 
 #Output
 class GenerateTestsResponse(BaseModel):
     tests: List[TestCase]
     message: str
 
+class BatchTestsResponse(BaseModel):
+    tests_by_file: Dict[str, List[TestCase]]  # filename -> generated tests
+
 
 #--------Schema for Feedback--------#
 
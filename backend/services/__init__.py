@@ -1,3 +1,4 @@
-from .anthropic_client import get_anthropic_client, AnthropicClient
+from .anthropic_client import get_anthropic_client, AnthropicClient, build_retry_messages, close_shared_http_client
+from .hint_cache import get_hint_cache, SemanticHintCache
 
-__all__ = ["get_anthropic_client", "AnthropicClient"]
\ No newline at end of file
+__all__ = ["get_anthropic_client", "AnthropicClient", "build_retry_messages", "close_shared_http_client", "get_hint_cache", "SemanticHintCache"]
\ No newline at end of file
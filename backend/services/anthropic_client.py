@@ -1,139 +1,435 @@
 import anthropic
+import asyncio
+import functools
+import hashlib
+import httpx
+import orjson
 import os
-import time
-import logging
-import time
+import random
 import logging
+from typing import Callable
 from dotenv import load_dotenv
+from config import (
+    ANTHROPIC_REQUESTS_PER_MINUTE, ANTHROPIC_TOKENS_PER_MINUTE, ANTHROPIC_REQUEST_BURST,
+    ANTHROPIC_MAX_CONCURRENT_REQUESTS, ANTHROPIC_MAX_CONNECTIONS, ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS,
+    RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS
+)
+from services.token_bucket import TokenBucketLimiter
+from utils.cache import LRUCache
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Transient server-side failures worth backing off and retrying (529 is handled separately)
+RETRYABLE_STATUS_CODES = frozenset({500, 502, 503, 504})
+
+
+@functools.cache
+def _shared_http_client() -> httpx.AsyncClient:
+    """One HTTP/2 connection pool for every Anthropic client"""
+    return anthropic.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=ANTHROPIC_MAX_CONNECTIONS,
+            max_keepalive_connections=ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS
+        )
+    )
+
+
+async def close_shared_http_client():
+    """Close the shared connection pool (call once on application shutdown)"""
+    if _shared_http_client.cache_info().currsize:
+        await _shared_http_client().aclose()
+        logger.info("Closed shared Anthropic HTTP client")
+
+
+def build_retry_messages(prompt: str, response_text: str | None, correction: str) -> list:
+    """
+    Conversation for a retry: the original prompt unchanged, the failed answer as the
+    assistant turn, then the correction as a new user turn. Keeping the first turn
+    byte-identical lets the retry reuse the prompt cache instead of invalidating it.
+    """
+    if not response_text or not response_text.strip():
+        return [{"role": "user", "content": prompt}]
+    return [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": response_text.rstrip()},
+        {"role": "user", "content": correction}
+    ]
+
+
+# Name of the forced tool used by generate_structured
+STRUCTURED_OUTPUT_TOOL = "emit"
+
+
+class MalformedResponseError(ValueError):
+    """Raised when the response looks truncated (e.g. methods outside class blocks)"""
+
 
 class AnthropicClient:
     def __init__(self, model: str = "claude-sonnet-4-20250514"):
         self.api_key = os.getenv("ANTHROPIC_API_KEY")
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # All models share one async connection pool (keep-alive + HTTP/2 multiplexing).
+        # Retries are handled by our own loop, so the SDK's are turned off.
+        self.client = anthropic.AsyncAnthropic(
+            api_key=self.api_key,
+            http_client=_shared_http_client(),
+            max_retries=0
+        )
         self.model = model
 
+        # Proactive pacing so bursts of parallel calls stay under the API limits
+        self.rate_limiter = TokenBucketLimiter(
+            requests_per_minute=ANTHROPIC_REQUESTS_PER_MINUTE,
+            tokens_per_minute=ANTHROPIC_TOKENS_PER_MINUTE,
+            request_burst=ANTHROPIC_REQUEST_BURST
+        )
+        # Caps in-flight calls so a burst of requests queues here instead of at the API
+        self._concurrency = asyncio.Semaphore(ANTHROPIC_MAX_CONCURRENT_REQUESTS)
+
+        # Exact-match cache: the same request (e.g. a re-uploaded assignment) skips the API
+        self._response_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS)
+        # cache key -> the API call currently producing that response
+        self._in_flight = {}
+
         # Retry configuration
         self.max_retries = 3
         self.base_delay = 1  # Start with 1 second delay
         self.max_delay = 60  # Max 60 seconds between retries
 
-    def generate_response(self, prompt: str, max_tokens: int = 4000, model: str = None) -> str:
+    async def generate_response(self, prompt: str | list, max_tokens: int = 4000, model: str = None,
+                                system: str = None, use_cache: bool = True) -> str:
         """
         Generate response with retry logic and exponential backoff.
         Handles 529 (Overloaded) and other retryable errors.
+        Async so the event loop can keep serving other requests while Claude responds.
+
+        If `system` is given it is sent as a cache_control block so the static
+        instruction prefix is reused across calls; it must stay byte-identical
+        between retries for the cache to hit.
+
+        `prompt` is either the user message or a full messages list
+        (see build_retry_messages).
+
+        With `use_cache`, a byte-identical request (model, max_tokens, system, messages)
+        returns the previous response text without calling the API.
+        """
+        request_kwargs = self._build_request(prompt, max_tokens, model, system)
+        cache_key = self._cache_key(request_kwargs) if use_cache else None
+        if cache_key:
+            cached_text = self._response_cache.get(cache_key)
+            if cached_text is not None:
+                logger.info(f"Response cache hit for model: {request_kwargs['model']}")
+                return cached_text
+
+        response, response_text = await self._create_shared(
+            cache_key, request_kwargs, self._estimate_tokens(prompt, max_tokens, system),
+            lambda response: self._extract_text(response, max_tokens)
+        )
+        # Truncated responses are never reused
+        if cache_key and response.stop_reason != "max_tokens":
+            self._response_cache.set(cache_key, response_text)
+        return response_text
+
+    async def generate_structured(self, prompt: str | list, schema: dict, max_tokens: int = 4000, model: str = None,
+                                  system: str = None, use_cache: bool = True) -> dict:
+        """
+        Generate a JSON object matching `schema` through a forced tool call.
+        The API returns the tool input already parsed, so no text extraction is needed
+        and malformed JSON can't come back (fields may still need validating).
+
+        `schema` must be an object schema, e.g. a pydantic model_json_schema().
+        Cached results are stored serialized, so callers can mutate what they get back.
+        """
+        request_kwargs = self._build_request(prompt, max_tokens, model, system)
+        request_kwargs["tools"] = [{
+            "name": STRUCTURED_OUTPUT_TOOL,
+            "description": "Return the response as structured data.",
+            "input_schema": schema
+        }]
+        request_kwargs["tool_choice"] = {"type": "tool", "name": STRUCTURED_OUTPUT_TOOL}
+
+        cache_key = self._cache_key(request_kwargs) if use_cache else None
+        if cache_key:
+            cached_json = self._response_cache.get(cache_key)
+            if cached_json is not None:
+                logger.info(f"Response cache hit for model: {request_kwargs['model']}")
+                return orjson.loads(cached_json)
+
+        estimated_tokens = self._estimate_tokens(prompt, max_tokens, system) + len(orjson.dumps(schema)) // 4
+        response, data = await self._create_shared(
+            cache_key, request_kwargs, estimated_tokens,
+            lambda response: self._extract_tool_input(response, max_tokens)
+        )
+        if cache_key:
+            serialized = orjson.dumps(data)
+            if response.stop_reason != "max_tokens":
+                self._response_cache.set(cache_key, serialized)
+            # The response may be shared with identical concurrent calls, so each gets its own copy
+            return orjson.loads(serialized)
+        return data
+
+    async def _create_shared(self, cache_key: str | None, request_kwargs: dict, estimated_tokens: int,
+                             extract: Callable) -> tuple:
+        """
+        _create_with_retries, except that identical cacheable requests already in flight
+        (e.g. the same assignment uploaded twice at once) wait for that call instead of
+        making their own. Shielded so one caller giving up doesn't cancel it for the others.
+        """
+        if cache_key is None:
+            return await self._create_with_retries(request_kwargs, estimated_tokens, extract)
+
+        call = self._in_flight.get(cache_key)
+        if call is None:
+            call = asyncio.ensure_future(self._create_with_retries(request_kwargs, estimated_tokens, extract))
+            self._in_flight[cache_key] = call
+            call.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+        else:
+            logger.info(f"Joining identical in-flight request for model: {request_kwargs['model']}")
+        return await asyncio.shield(call)
+
+    async def _create_with_retries(self, request_kwargs: dict, estimated_tokens: int, extract: Callable) -> tuple:
+        """
+        messages.create with pacing, the concurrency cap and backoff on retryable errors.
+        `extract` runs on each response inside the retry loop, so a malformed one
+        (MalformedResponseError) is retried too. Returns (response, extract(response)).
         """
         last_exception = None
-        
+
         for attempt in range(self.max_retries):
             try:
-                # Use provided model or fall back to instance default
-                model_to_use = model or self.model
-                logger.info(f"API call attempt {attempt + 1}/{self.max_retries} using model: {model_to_use}")
-
-                response = self.client.messages.create(
-                    model=model_to_use,
-                    max_tokens=max_tokens,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-
-                # Get response text
-                response_text = response.content[0].text
-
-                # Check for truncation or incomplete response
-                if response.stop_reason == "max_tokens":
-                    logger.warning(f"Response truncated (hit max_tokens limit of {max_tokens})")
-                    logger.warning(f"Response length: {len(response_text)} characters")
-                    # Continue anyway, but log the warning
-
-                # Check for obviously incomplete code (methods outside classes)
-                if "// =====" in response_text and "public class" in response_text:
-                    # Quick heuristic: if we see task comments outside class blocks, response is malformed
-                    lines = response_text.split('\n')
-                    class_depth = 0
-                    for line in lines:
-                        if 'public class' in line or 'class ' in line:
-                            class_depth += line.count('{') - line.count('}')
-                        elif class_depth == 0 and ('public void' in line or 'private void' in line):
-                            logger.error("DETECTED MALFORMED CODE: Methods outside class boundaries!")
-                            logger.error(f"This usually means API response was truncated or rate limited")
-
-                            # Treat malformed response as retryable error
-                            if attempt < self.max_retries - 1:
-                                delay = self._calculate_backoff(attempt)
-                                logger.info(f"Retrying due to malformed response in {delay} seconds...")
-                                time.sleep(delay)
-                                continue  # Skip to next retry attempt
-                            else:
-                                raise ValueError("Generated code is malformed - methods outside classes detected after max retries")
-
+                await self.rate_limiter.acquire(estimated_tokens)
+                async with self._concurrency:
+                    logger.info(f"API call attempt {attempt + 1}/{self.max_retries} using model: {request_kwargs['model']}")
+                    response = await self.client.messages.create(**request_kwargs)
+                result = extract(response)
                 logger.info(f"API call succeeded on attempt {attempt + 1}")
-                return response_text
+                return response, result
 
-            except anthropic.RateLimitError as e:
+            except Exception as e:
                 last_exception = e
-                logger.warning(f"Rate limit hit on attempt {attempt + 1}: {e}")
-                
+                self._handle_error(e, attempt)
                 if attempt < self.max_retries - 1:
-                    delay = self._calculate_backoff(attempt)
-                    logger.info(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    logger.error(f"Max retries ({self.max_retries}) exceeded")
-                    
-            except anthropic.APIError as e:
-                # Handle 529 Overloaded and other API errors
-                if hasattr(e, 'status_code') and e.status_code == 529:
-                    last_exception = e
-                    logger.warning(f"API overloaded (529) on attempt {attempt + 1}")
-                    
-                    if attempt < self.max_retries - 1:
-                        delay = self._calculate_backoff(attempt)
-                        logger.info(f"Retrying in {delay} seconds...")
-                        time.sleep(delay)
-                    else:
-                        logger.error(f"Max retries ({self.max_retries}) exceeded")
-                else:
-                    # Non-retryable API error, raise immediately
-                    logger.error(f"Non-retryable API error: {e}")
-                    raise
-                    
-            except Exception as e:
-                # Unexpected error, log and raise
-                logger.error(f"Unexpected error during API call: {e}")
-                raise
-        
+                    delay = self._calculate_backoff(attempt, e)
+                    logger.info(f"Retrying in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
+
+        raise self._retries_exhausted(last_exception)
+
+    async def warm_up(self):
+        """
+        Open the shared connection (TLS + HTTP/2) ahead of the first real request.
+        Lists models rather than sending a message, so it costs no tokens.
+        """
+        try:
+            await self.client.models.list(limit=1)
+            logger.info("Anthropic connection pool warmed up")
+        except Exception as e:
+            logger.warning(f"Anthropic warm-up failed (first request will connect instead): {e}")
+
+    async def stream_response(self, prompt: str, max_tokens: int = 4000, model: str = None,
+                              system: str = None, final: dict = None):
+        """
+        Stream the response as text deltas so callers can parse incrementally.
+        No retry loop here - once chunks are yielded the caller owns the attempt.
+        Raises MalformedResponseError at the end like generate_response.
+        If `final` is given, it receives the stop_reason and output_tokens of the finished message.
+        """
+        request_kwargs = self._build_request(prompt, max_tokens, model, system)
+        await self.rate_limiter.acquire(self._estimate_tokens(prompt, max_tokens, system))
+        logger.info(f"Streaming API call using model: {request_kwargs['model']}")
+
+        async with self._concurrency, self.client.messages.stream(**request_kwargs) as stream:
+            async for text in stream.text_stream:
+                yield text
+            message = await stream.get_final_message()
+            if final is not None:
+                final.update(self._stop_info(message))
+            self._extract_text(message, max_tokens)
+
+    async def submit_batch(self, requests: list) -> str:
+        """
+        Submit several prompts as one Message Batches job (half price, separate quota).
+        Each request is a dict with custom_id, prompt, max_tokens and optional system.
+        Returns the batch id.
+        """
+        batch = await self.client.messages.batches.create(requests=[
+            {
+                "custom_id": request["custom_id"],
+                "params": self._build_request(
+                    request["prompt"], request["max_tokens"], system=request.get("system")
+                )
+            }
+            for request in requests
+        ])
+        logger.info(f"Submitted message batch {batch.id} with {len(requests)} requests")
+        return batch.id
+
+    async def get_batch_results(self, batch_id: str, final: dict = None) -> dict | None:
+        """
+        Return {custom_id: response_text} once the batch has ended, or None while it is
+        still processing. Requests that errored or expired are left out.
+        If `final` is given, it receives {custom_id: {stop_reason, output_tokens}}.
+        """
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            logger.info(f"Message batch {batch_id} still {batch.processing_status}")
+            return None
+
+        results = {}
+        async for entry in await self.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = entry.result.message.content[0].text
+                if final is not None:
+                    final[entry.custom_id] = self._stop_info(entry.result.message)
+            else:
+                logger.warning(f"Batch request {entry.custom_id} did not succeed: {entry.result.type}")
+        return results
+
+    def _build_request(self, prompt: str | list, max_tokens: int, model: str = None, system: str = None) -> dict:
+        """Build the messages.create kwargs shared by the sync and async paths"""
+        request_kwargs = {
+            # Use provided model or fall back to instance default
+            "model": model or self.model,
+            "max_tokens": max_tokens,
+            "messages": prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+        }
+        if system:
+            request_kwargs["system"] = [{
+                "type": "text",
+                "text": system,
+                "cache_control": {"type": "ephemeral"}
+            }]
+        return request_kwargs
+
+    @staticmethod
+    def _cache_key(request_kwargs: dict) -> str:
+        return hashlib.sha256(orjson.dumps(request_kwargs, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def _estimate_tokens(self, prompt: str | list, max_tokens: int, system: str = None) -> int:
+        """Rough upper bound for the limiter: ~4 chars per input token plus the full output budget"""
+        if isinstance(prompt, list):
+            input_chars = sum(len(message["content"]) for message in prompt)
+        else:
+            input_chars = len(prompt)
+        input_chars += len(system) if system else 0
+        return input_chars // 4 + max_tokens
+
+    def _log_cache_usage(self, response):
+        usage = response.usage
+        cache_read = getattr(usage, 'cache_read_input_tokens', None)
+        cache_created = getattr(usage, 'cache_creation_input_tokens', None)
+        if cache_read or cache_created:
+            logger.info(f"Prompt cache: read={cache_read}, created={cache_created}, uncached_input={usage.input_tokens}")
+
+    def _extract_tool_input(self, response, max_tokens: int) -> dict:
+        """Get the forced tool call's input (already a dict)"""
+        self._log_cache_usage(response)
+        if response.stop_reason == "max_tokens":
+            # The tool input may be cut off, so let the caller's validation decide
+            logger.warning(f"Structured response truncated (hit max_tokens limit of {max_tokens})")
+
+        for block in response.content:
+            if block.type == "tool_use":
+                return block.input
+        raise ValueError("Response did not contain a structured output tool call")
+
+    @staticmethod
+    def _stop_info(response) -> dict:
+        """Why generation stopped and how many tokens it produced"""
+        return {"stop_reason": response.stop_reason, "output_tokens": response.usage.output_tokens}
+
+    def _extract_text(self, response, max_tokens: int) -> str:
+        """Get response text, logging cache usage and truncation"""
+        response_text = response.content[0].text
+        self._log_cache_usage(response)
+
+        # Check for truncation or incomplete response
+        if response.stop_reason == "max_tokens":
+            logger.warning(f"Response truncated (hit max_tokens limit of {max_tokens})")
+            logger.warning(f"Response length: {len(response_text)} characters")
+            # Continue anyway, but log the warning
+
+        # Check for obviously incomplete code (methods outside classes)
+        if "// =====" in response_text and "public class" in response_text:
+            # Quick heuristic: if we see task comments outside class blocks, response is malformed
+            lines = response_text.split('\n')
+            class_depth = 0
+            for line in lines:
+                if 'public class' in line or 'class ' in line:
+                    class_depth += line.count('{') - line.count('}')
+                elif class_depth == 0 and ('public void' in line or 'private void' in line):
+                    logger.error("DETECTED MALFORMED CODE: Methods outside class boundaries!")
+                    logger.error(f"This usually means API response was truncated or rate limited")
+                    raise MalformedResponseError("Generated code is malformed - methods outside classes detected")
+
+        return response_text
+
+    def _handle_error(self, e: Exception, attempt: int):
+        """
+        Re-raise non-retryable errors and errors on the last attempt.
+        Returns normally when the caller should back off and retry
+        (rate limits, 5xx/529, timeouts, dropped connections, malformed output).
+        """
+        if isinstance(e, anthropic.RateLimitError):
+            logger.warning(f"Rate limit hit on attempt {attempt + 1}: {e}")
+        elif isinstance(e, anthropic.APIStatusError) and e.status_code == 529:
+            logger.warning(f"API overloaded (529) on attempt {attempt + 1}")
+        elif isinstance(e, anthropic.APIStatusError) and e.status_code in RETRYABLE_STATUS_CODES:
+            logger.warning(f"Server error ({e.status_code}) on attempt {attempt + 1}")
+        elif isinstance(e, anthropic.APITimeoutError):
+            logger.warning(f"Request timed out on attempt {attempt + 1}")
+        elif isinstance(e, anthropic.APIConnectionError):
+            logger.warning(f"Connection error on attempt {attempt + 1}: {e}")
+        elif isinstance(e, MalformedResponseError):
+            logger.warning(f"Malformed response on attempt {attempt + 1}")
+        elif isinstance(e, anthropic.APIError):
+            # Non-retryable API error, raise immediately
+            logger.error(f"Non-retryable API error: {e}")
+            raise e
+        else:
+            # Unexpected error, log and raise
+            logger.error(f"Unexpected error during API call: {e}")
+            raise e
+
+        if attempt >= self.max_retries - 1:
+            logger.error(f"Max retries ({self.max_retries}) exceeded")
+            if isinstance(e, MalformedResponseError):
+                raise MalformedResponseError("Generated code is malformed - methods outside classes detected after max retries")
+
+    def _retries_exhausted(self, last_exception: Exception) -> Exception:
         # If we exhausted all retries, raise the last exception
         error_msg = f"Failed after {self.max_retries} attempts. Last error: {str(last_exception)}"
         logger.error(error_msg)
-        raise Exception(error_msg)
-    
-    def _calculate_backoff(self, attempt: int) -> float:
+        return Exception(error_msg)
+
+    def _calculate_backoff(self, attempt: int, error: Exception = None) -> float:
         """
         Calculate exponential backoff delay.
         Formula: base_delay * (2 ^ attempt) with jitter
+        A retry-after header on the error (429/529) is used as a lower bound.
         """
         delay = min(self.base_delay * (2 ** attempt), self.max_delay)
-        
+
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = min(max(delay, float(retry_after)), self.max_delay)
+            except ValueError:
+                pass
+
         # Add jitter (randomness) to prevent thundering herd
-        import random
         jitter = random.uniform(0, 0.1 * delay)
-        
-        return delay + jitter
 
+        return delay + jitter
 
-_client_instances = {}
 
+@functools.cache
 def get_anthropic_client(model: str = "claude-sonnet-4-20250514") -> AnthropicClient:
     """
     Get or Create Anthropic Client for specific model.
     Uses a separate client instance per model to avoid conflicts.
     """
-    global _client_instances
-    if model not in _client_instances:
-        _client_instances[model] = AnthropicClient(model=model)
-    return _client_instances[model]
\ No newline at end of file
+    return AnthropicClient(model=model)
@@ -3,19 +3,304 @@ Code execution service using Piston API
 Runs Python and JavaScript code with interactive input support
 """
 
-import requests
+import asyncio
+import functools
+import gzip
+import hashlib
+import httpx
+import orjson
+import random
+import re
 import logging
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional
 import os
+from config import (
+    PISTON_MAX_CONNECTIONS, PISTON_MAX_KEEPALIVE_CONNECTIONS, PISTON_MAX_CONCURRENT_RUNS, MAX_CONCURRENT_TEST_RUNS,
+    CODE_RESULT_CACHE_SIZE, CODE_RESULT_CACHE_TTL_SECONDS, CODE_ERROR_CACHE_TTL_SECONDS, PISTON_GZIP_MIN_BYTES, PISTON_MAX_RESPONSE_BYTES
+)
+from pyd_models.schemas import TestResult
+from services.local_executor import LocalExecBackend
+from utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
+# stdin for runs that don't provide one (see run_code)
+DEFAULT_STDIN = "1234\ntest_input\ny\nyes\n1\n0\nx\n"
+
+# Serialized end of the /execute body for the stdin values nearly every run uses
+STDIN_PAYLOAD_TAILS = {
+    stdin: b',"stdin":' + orjson.dumps(stdin) + b'}' for stdin in ("", DEFAULT_STDIN)
+}
+
+# Piston responses worth backing off and retrying (the public API rate-limits under load)
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+# stderr fragments that mean the code didn't compile/parse (Python, Java/C/C++, C#)
+COMPILE_ERROR_MARKERS = ("SyntaxError", "IndentationError", "error:", "error CS", "CompileError")
+
+# run_code result for a clean exit; copied with output/execution_time filled in
+SUCCESS_RESULT_TEMPLATE = {"success": True, "output": "", "error": "", "exit_code": 0, "execution_time": ""}
+
+# Body of a JSON string up to its closing quote (escapes consumed as pairs, plain runs in one step)
+JSON_STRING_CONTENT = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*')
+
+# A C# entry point (sync or async Main)
+CSHARP_MAIN_PATTERN = re.compile(r'static\s+(?:void|async\s+Task)\s+Main')
+
+# Per-test harnesses for the simple languages (appended to the student code). The Python driver
+# executes solution.py into a `solution` module and evaluates the call there, like the batch
+# driver does, so underscore-prefixed helpers are callable too (`import *` would skip them)
+PYTHON_TEST_DRIVER = """import os as _os
+import sys as _sys
+import types as _types
+
+_solution_path = _os.path.join(_os.path.dirname(_os.path.abspath(__file__)), "solution.py")
+_solution = _types.ModuleType("solution")
+_solution.__file__ = _solution_path
+_sys.modules["solution"] = _solution
+with open(_solution_path) as _file:
+    exec(compile(_file.read(), _solution_path, "exec"), _solution.__dict__)
+
+# Test execution
+result = eval(compile({call!r}, "<test>", "eval"), _solution.__dict__)
+print(result)"""
+JAVASCRIPT_TEST_TEMPLATE = "\n\n// Test execution\nconst result = {fn}({inp});\nconsole.log(result);"
+GENERIC_TEST_TEMPLATE = "\n\n{fn}({inp});"
+
+# Per-test TestRunner entry points appended to C# and Java student code
+CSHARP_MAIN_TEST_TEMPLATE = """
+
+// Test execution
+class TestRunner {{
+    static void Main(string[] args) {{
+        {fn}({inp});
+    }}
+}}"""
+CSHARP_METHOD_TEST_TEMPLATE = """
+
+// Test execution
+class TestRunner {{
+    static void Main(string[] args) {{
+        var instance = new {cls}();
+        var result = instance.{method}({inp});
+        Console.WriteLine(result);
+    }}
+}}"""
+CSHARP_FUNCTION_TEST_TEMPLATE = """
+
+// Test execution
+class TestRunner {{
+    static void Main(string[] args) {{
+        var result = {fn}({inp});
+        Console.WriteLine(result);
+    }}
+}}"""
+JAVA_METHOD_TEST_TEMPLATE = """
+
+// Test execution
+class TestRunner {{
+    public static void main(String[] args) {{
+        {cls} instance = new {cls}();
+        var result = instance.{method}({inp});
+        System.out.println(result);
+    }}
+}}"""
+JAVA_FUNCTION_TEST_TEMPLATE = """
+
+// Test execution
+class TestRunner {{
+    public static void main(String[] args) {{
+        var result = {fn}({inp});
+        System.out.println(result);
+    }}
+}}"""
+
+# Starts each record of a batched test run (ASCII record separator)
+BATCH_RECORD_SEPARATOR = "\x1e"
+
+# Entry point for batched Python test runs; one _run_case(index, call source) line per test is
+# appended. Each case executes the solution into a fresh `solution` module, as a separate run
+# would, and compiles its own call so a malformed input only fails that test. A solution that
+# doesn't compile exits before any record is written. Helpers are underscored to stay out of the way.
+PYTHON_BATCH_DRIVER = """import contextlib as _contextlib
+import io as _io
+import json as _json
+import os as _os
+import sys as _sys
+import traceback as _traceback
+import types as _types
+
+_solution_path = _os.path.join(_os.path.dirname(_os.path.abspath(__file__)), "solution.py")
+try:
+    with open(_solution_path) as _file:
+        _solution = compile(_file.read(), _solution_path, "exec")
+except SyntaxError:
+    _traceback.print_exc()
+    _sys.exit(1)
+
+def _run_case(_index, _call_source):
+    _out = _io.StringIO()
+    _record = {"i": _index}
+    try:
+        with _contextlib.redirect_stdout(_out):
+            _call = compile(_call_source, "<test>", "eval")
+            _module = _types.ModuleType("solution")
+            _module.__file__ = _solution_path
+            _sys.modules["solution"] = _module
+            exec(_solution, _module.__dict__)
+            print(eval(_call, _module.__dict__))
+    except BaseException:
+        _record["error"] = _traceback.format_exc()
+    _record["out"] = _out.getvalue()
+    _sys.__stdout__.write("\\x1e" + _json.dumps(_record) + "\\n")
+    _sys.__stdout__.flush()
+
+"""
+
+# Entry point for batched JavaScript test runs; one _runCase(index, call source) line per test
+# is appended. Each case runs the solution in a fresh vm context (top-level state isn't shared,
+# as with separate runs) and compiles its own call, so a malformed input only fails that test.
+# console.log is captured per case. A solution that doesn't parse exits before any record.
+JAVASCRIPT_BATCH_DRIVER = """const _fs = require('fs');
+const _path = require('path');
+const _util = require('util');
+const _vm = require('vm');
+
+const _solutionPath = _path.join(__dirname, 'solution.js');
+let _solution;
+try {
+    _solution = new _vm.Script(_fs.readFileSync(_solutionPath, 'utf8'), { filename: _solutionPath });
+} catch (error) {
+    console.error((error && error.stack) || String(error));
+    process.exit(1);
+}
+
+const _runCase = (_index, _callSource) => {
+    let _out = '';
+    const _record = { i: _index };
+    const _console = Object.create(console);
+    _console.log = _console.info = (...args) => { _out += _util.format(...args) + '\\n'; };
+    const _module = { exports: {} };
+    const _context = _vm.createContext({
+        console: _console, require, module: _module, exports: _module.exports,
+        __filename: _solutionPath, __dirname, process, Buffer,
+        setTimeout, setInterval, setImmediate, clearTimeout, clearInterval, clearImmediate
+    });
+    try {
+        const _call = new _vm.Script(_callSource, { filename: 'test.js' });
+        _solution.runInContext(_context);
+        _console.log(_call.runInContext(_context));
+    } catch (error) {
+        _record.error = (error && error.stack) || String(error);
+    }
+    _record.out = _out;
+    process.stdout.write('\\x1e' + JSON.stringify(_record) + '\\n');
+};
+
+"""
+
+# Batch driver entry point and the name the student code is shipped under, by Piston language
+DRIVER_FILE_NAMES = {
+    'python3': ("main.py", "solution.py"),
+    'javascript': ("main.js", "solution.js"),
+}
+
+@functools.lru_cache(maxsize=16)
+def _json_string(text: str) -> bytes:
+    """JSON-encoded student code, shared by every test run (and cache key) of one submission"""
+    return orjson.dumps(text)
+
+
+@functools.lru_cache(maxsize=16)
+def _has_csharp_main(code: str) -> bool:
+    """Whether the code defines Main; asked once per test of a suite with the same code"""
+    return CSHARP_MAIN_PATTERN.search(code) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_output_matcher(expected_output: str) -> Callable[[str], bool]:
+    """
+    Parse an expected output (or CONTAINS:/COUNT: pattern) once into a predicate on the
+    stripped actual output. A test suite's expected outputs repeat on every run.
+    """
+    expected = expected_output.strip()
+
+    # Pattern 1: CONTAINS check
+    if expected.startswith("CONTAINS:"):
+        patterns = tuple(pattern.strip() for pattern in expected[9:].split(","))  # Remove "CONTAINS:" prefix
+        # All patterns must be in output
+        return lambda actual: all(pattern in actual for pattern in patterns)
+
+    # Pattern 2: COUNT check
+    if expected.startswith("COUNT:"):
+        parts = expected[6:].split(":")  # Remove "COUNT:" prefix
+        if len(parts) == 2:
+            pattern, count_str = parts
+            pattern = pattern.strip()
+            try:
+                expected_count = int(count_str.strip())
+            except ValueError:
+                logger.warning(f"Invalid COUNT pattern: {expected}")
+                return lambda actual: False
+            return lambda actual: actual.count(pattern) == expected_count
+
+    # Default: Exact match
+    return lambda actual: actual == expected
+
+
 class CodeRunner:
     def __init__(self):
         # Use public Piston API or set your own instance URL via environment variable
         self.piston_api_url = os.getenv("PISTON_API_URL", "https://emkc.org/api/v2/piston")
         self.timeout = 30  # 30 second timeout (Piston API limit)
         self.max_output_length = 10000  # Limit output to prevent memory issues
+
+        # One async keep-alive (HTTP/2) pool for every execution: calls after the first skip the
+        # TCP/TLS handshake and the event loop keeps serving other requests while Piston runs the code.
+        # A test suite's concurrent runs are multiplexed as streams on one connection, so the pool
+        # stays small. Failed connection attempts are retried by the transport.
+        self.client = httpx.AsyncClient(
+            base_url=self.piston_api_url,
+            timeout=self.timeout + 5,  # Add buffer for timeout
+            headers={"Content-Type": "application/json"},
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(
+                    max_connections=PISTON_MAX_CONNECTIONS,
+                    max_keepalive_connections=PISTON_MAX_KEEPALIVE_CONNECTIONS
+                )
+            )
+        )
+        # PISTON_API_URL=local:// runs code in local subprocesses instead of calling Piston
+        self.local_backend = None
+        if self.piston_api_url.startswith("local://"):
+            logger.info("Using the local code execution backend")
+            self.local_backend = LocalExecBackend(self.timeout, self.max_output_length * 4)
+
+        # Test harness builder per (lowercased) language, resolved once per test run
+        self._test_harnesses = {
+            'python': self._python_harness,
+            'javascript': self._javascript_harness,
+            'js': self._javascript_harness,
+            'csharp': self._csharp_harness,
+            'c#': self._csharp_harness,
+            'cs': self._csharp_harness,
+            'java': self._java_harness
+        }
+
+        # Caps in-flight executions so one large test suite can't flood Piston
+        self._concurrency = asyncio.Semaphore(PISTON_MAX_CONCURRENT_RUNS)
+        # Identical (language, code, stdin) runs - resubmissions, re-run tests - reuse the last result
+        self._result_cache = LRUCache(maxsize=CODE_RESULT_CACHE_SIZE, ttl=CODE_RESULT_CACHE_TTL_SECONDS)
+        # Service errors (after retries) are replayed briefly, so resubmits during an outage don't pile on
+        self._error_cache = LRUCache(maxsize=CODE_RESULT_CACHE_SIZE, ttl=CODE_ERROR_CACHE_TTL_SECONDS)
+        # cache key -> the execution currently computing it
+        self._in_flight = {}
+        # Rate limits and gateway errors are retried too (running the same code twice is harmless)
+        self.max_retries = 5
+        self.base_delay = 0.3
+        self.max_delay = 10
         
         # Note: Piston API has hard limits:
         # - 30 second execution timeout
@@ -35,6 +320,17 @@ class CodeRunner:
             'c': 'c',
             'typescript': 'typescript'
         }
+        self._supported_languages = ", ".join(self.language_map)
+
+        # Serialized start of every /execute body: '{"language":...,"version":...,"run_timeout":...,'
+        self._payload_prefixes = {
+            piston_language: orjson.dumps({
+                "language": piston_language,
+                "version": "*",  # Use latest version
+                "run_timeout": self.timeout * 1000  # Convert to milliseconds
+            })[:-1] + b','
+            for piston_language in set(self.language_map.values())
+        }
     
     def _inject_timeout_handling(self, code: str, language: str, timeout_seconds: int = 10) -> str:
         """
@@ -57,27 +353,21 @@ class CodeRunner:
         if language in ['csharp', 'c#', 'cs']:
             # For C#, add a timer that sets a flag after timeout_seconds
             # Look for Main method and inject timeout logic
-            if 'static void Main' in code or 'static async Task Main' in code:
+            main = CSHARP_MAIN_PATTERN.search(code)
+            if main:
                 # Add using statements if not present
-                if 'using System.Threading;' not in code:
-                    code = 'using System.Threading;\n' + code
+                usings = ''
                 if 'using System.Timers;' not in code:
-                    code = 'using System.Timers;\n' + code
-                
-                # Add a global flag and timer setup
-                # Find the class containing Main
-                lines = code.split('\n')
-                main_class_index = -1
-                for i, line in enumerate(lines):
-                    if 'static void Main' in line or 'static async Task Main' in line:
-                        # Find the class declaration before this
-                        for j in range(i-1, -1, -1):
-                            if 'class ' in lines[j]:
-                                main_class_index = j
-                                break
-                        break
+                    usings += 'using System.Timers;\n'
+                if 'using System.Threading;' not in code:
+                    usings += 'using System.Threading;\n'
+                code = usings + code
                 
-                if main_class_index >= 0:
+                # Add a global flag and timer setup, inserted after the class containing Main
+                main_line_start = code.rfind('\n', 0, main.start() + len(usings)) + 1
+                class_index = code.rfind('class ', 0, main_line_start)
+
+                if class_index >= 0:
                     # Inject timeout flag and timer
                     timeout_code = f"""
     // AUTO-INJECTED: Timeout handling for testing (program will stop after {timeout_seconds} seconds)
@@ -94,20 +384,19 @@ class CodeRunner:
         _testTimer.Start();
     }}
 """
-                    # Insert after class declaration
-                    lines.insert(main_class_index + 1, timeout_code)
-                    
-                    # Find Main method and add InitTestTimeout() call at the start
-                    for i, line in enumerate(lines):
-                        if 'static void Main' in line or 'static async Task Main' in line:
-                            # Find the opening brace
-                            for j in range(i, len(lines)):
-                                if '{' in lines[j]:
-                                    lines.insert(j + 1, '        InitTestTimeout(); // Start test timeout timer')
-                                    break
-                            break
-                    
-                    code = '\n'.join(lines)
+                    # Add InitTestTimeout() call on the line after Main's opening brace
+                    brace_index = code.find('{', main_line_start)
+                    if brace_index >= 0:
+                        line_end = code.find('\n', brace_index)
+                        init_call = '        InitTestTimeout(); // Start test timeout timer'
+                        if line_end < 0:
+                            code += '\n' + init_call
+                        else:
+                            code = code[:line_end + 1] + init_call + '\n' + code[line_end + 1:]
+
+                    # Insert after class declaration (after the brace edit, so its offset is still valid)
+                    class_line_end = code.find('\n', class_index) + 1
+                    code = code[:class_line_end] + timeout_code + '\n' + code[class_line_end:]
         
         return code
     
@@ -127,32 +416,31 @@ class CodeRunner:
         Returns:
             True if outputs match, False otherwise
         """
-        expected = expected_output.strip()
-        actual = actual_output.strip()
-
-        # Pattern 1: CONTAINS check
-        if expected.startswith("CONTAINS:"):
-            patterns = expected[9:].split(",")  # Remove "CONTAINS:" prefix
-            # All patterns must be in output
-            return all(pattern.strip() in actual for pattern in patterns)
-
-        # Pattern 2: COUNT check
-        if expected.startswith("COUNT:"):
-            parts = expected[6:].split(":")  # Remove "COUNT:" prefix
-            if len(parts) == 2:
-                pattern, count_str = parts
-                try:
-                    expected_count = int(count_str.strip())
-                    actual_count = actual.count(pattern.strip())
-                    return actual_count == expected_count
-                except ValueError:
-                    logger.warning(f"Invalid COUNT pattern: {expected}")
-                    return False
-
-        # Default: Exact match
-        return actual == expected
+        return _compile_output_matcher(expected_output)(actual_output.strip())
 
-    def run_code(self, code: str, language: str, stdin: Optional[str] = None) -> Dict[str, Any]:
+    async def warm_up(self):
+        """
+        Open the pooled Piston connection (TCP + TLS) ahead of the first execution.
+        Lists runtimes rather than running code, so it uses no execution quota.
+        With the local backend, starts its warm interpreters instead.
+        """
+        if self.local_backend is not None:
+            await self.local_backend.warm_up()
+            return
+        try:
+            await self.client.get("/runtimes")
+            logger.info("Piston connection pool warmed up")
+        except httpx.HTTPError as e:
+            logger.warning(f"Piston warm-up failed (first execution will connect instead): {e}")
+
+    async def aclose(self):
+        """Close the connection pool and any warm local interpreters (call once on application shutdown)"""
+        await self.client.aclose()
+        if self.local_backend is not None:
+            await self.local_backend.aclose()
+
+    async def run_code(self, code: str, language: str, stdin: Optional[str] = None,
+                       driver: Optional[str] = None, code_suffix: str = "") -> Dict[str, Any]:
         """
         Run code using Piston API
         
@@ -160,95 +448,151 @@ class CodeRunner:
             code: Code to execute
             language: Programming language
             stdin: Optional stdin input (for input() calls). If None, provides default test values.
+            driver: Optional entry point (Python or JavaScript) run instead of `code`, which is then
+                shipped unchanged as solution.py/.js (so tests don't rebuild the whole source per case)
+            code_suffix: Optional text run after `code` (a test harness). Kept separate so
+                the shared code is JSON-encoded once, not copied and re-encoded per test
         
         Returns:
             Dict with success, output, error, exit_code, execution_time
         """
-        language = language.lower()
+        # Callers (and the test path) usually pass an already-lowercase name
+        language = language if language.islower() else language.lower()
         
         # Map language to Piston API language name
         piston_language = self.language_map.get(language)
         if not piston_language:
-            return {
-                "success": False,
-                "output": "",
-                "error": f"Language '{language}' is not supported. Supported languages: {', '.join(self.language_map.keys())}",
-                "exit_code": -1,
-                "execution_time": "0s"
-            }
+            return self._unsupported_language_result(language)
         
         # If no stdin provided, use default test values for input() calls
         # This allows code with input() to run without EOFError
         if stdin is None:
             # Provide multiple test inputs (one per line) for multiple input() calls
             # Common test values: numbers, strings, yes/no, exit commands
-            stdin = "1234\ntest_input\ny\nyes\n1\n0\nx\n"
+            stdin = DEFAULT_STDIN
         
+        cache_key = hashlib.sha256(_json_string(code))
+        cache_key.update(f"\0{piston_language}\0{code_suffix}\0{stdin}\0{driver}".encode())
+        cache_key = cache_key.digest()
+        cached_result = self._result_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("Code result cache hit for %s code (%d characters)", language, len(code))
+            return dict(cached_result)
+        cached_error = self._error_cache.get(cache_key)
+        if cached_error is not None:
+            return dict(cached_error)
+
+        # An identical run already in flight (a double-clicked Run, a repeated test) is shared
+        execution = self._in_flight.get(cache_key)
+        if execution is None:
+            execution = asyncio.ensure_future(
+                self._execute(code, language, piston_language, stdin, driver, code_suffix, cache_key)
+            )
+            self._in_flight[cache_key] = execution
+            execution.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+        # Shielded so one caller giving up doesn't cancel the run for the others
+        return dict(await asyncio.shield(execution))
+
+    async def _execute(self, code: str, language: str, piston_language: str, stdin: str,
+                       driver: Optional[str], code_suffix: str, cache_key: bytes) -> Dict[str, Any]:
+        """Run once on the local backend or Piston and shape the result (run_code's uncached path)"""
+        truncated = False
         try:
-            # Prepare request payload
-            payload = {
-                "language": piston_language,
-                "version": "*",  # Use latest version
-                "files": [
-                    {
-                        "content": code
-                    }
-                ],
-                "stdin": stdin,  # Provide stdin for input() calls
-                "run_timeout": self.timeout * 1000  # Convert to milliseconds
-            }
-            
-            logger.info(f"Executing {language} code via Piston API ({len(code)} characters)")
+            if self.local_backend is not None:
+                # Piston-style files: the first one is run
+                if driver is not None:
+                    entry_name, solution_name = DRIVER_FILE_NAMES[piston_language]
+                    files = [{"name": entry_name, "content": driver}, {"name": solution_name, "content": code}]
+                else:
+                    files = [{"content": code + code_suffix}]
+                logger.info("Executing %s code locally (%d characters)", language, len(code))
+                async with self._concurrency:
+                    run_result = await self.local_backend.run(piston_language, files, stdin)
+            else:
+                # Only files and stdin (for input() calls) change per call; the rest is pre-serialized.
+                # The fragments are joined once, so the encoded code is copied only into the body.
+                stdin_tail = STDIN_PAYLOAD_TAILS.get(stdin) or b',"stdin":' + orjson.dumps(stdin) + b'}'
+                body = b"".join((self._payload_prefixes[piston_language],
+                                 *self._files_json_parts(code, code_suffix, driver, piston_language), stdin_tail))
+
+                # Source code compresses well, so larger bodies are sent gzipped
+                headers = {}
+                if len(body) >= PISTON_GZIP_MIN_BYTES:
+                    body = gzip.compress(body, compresslevel=5)
+                    headers["Content-Encoding"] = "gzip"
             
-            # Make request to Piston API
-            response = requests.post(
-                f"{self.piston_api_url}/execute",
-                json=payload,
-                timeout=self.timeout + 5  # Add buffer for timeout
-            )
+                logger.info("Executing %s code via Piston API (%d characters)", language, len(code))
             
-            if response.status_code != 200:
-                logger.error(f"Piston API error: {response.status_code} - {response.text}")
-                return {
-                    "success": False,
-                    "output": "",
-                    "error": f"Code execution service error: {response.status_code}. Please try again later.",
-                    "exit_code": -1,
-                    "execution_time": "error"
-                }
+                # Make request to Piston API. The body is streamed so a runaway program's
+                # megabytes of output are never buffered - we stop at PISTON_MAX_RESPONSE_BYTES.
+                for attempt in range(self.max_retries):
+                    async with self._concurrency, self.client.stream("POST", "/execute", content=body, headers=headers) as response:
+                        if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries - 1:
+                            raw, truncated = await self._read_capped(response, PISTON_MAX_RESPONSE_BYTES)
+                            break
+                    delay = self._calculate_backoff(attempt, response)
+                    logger.warning(f"Piston API returned {response.status_code}, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                    await asyncio.sleep(delay)
             
-            result = response.json()
+                if response.status_code != 200:
+                    logger.error(f"Piston API error: {response.status_code} - {raw[:500].decode(errors='replace')}")
+                    error_result = {
+                        "success": False,
+                        "output": "",
+                        "error": f"Code execution service error: {response.status_code}. Please try again later.",
+                        "exit_code": -1,
+                        "execution_time": "error"
+                    }
+                    if response.status_code in RETRYABLE_STATUS_CODES:
+                        self._error_cache.set(cache_key, error_result)
+                    return error_result
+
+                if truncated:
+                    logger.warning(f"Piston response exceeded {PISTON_MAX_RESPONSE_BYTES} bytes, keeping the start of the output")
+                    run_result = self._salvage_run_result(raw)
+                else:
+                    result = orjson.loads(raw)
+                    run_result = result.get("run", {})
             
-            # Extract output and error
-            run_result = result.get("run", {})
+            # Extract output and error (salvaged output is already cut to length)
             stdout = run_result.get("stdout", "")[:self.max_output_length]
             stderr = run_result.get("stderr", "")[:self.max_output_length]
+            if truncated:
+                # Appended after the cut, so it shows even when stderr is what overflowed
+                stderr += "\n[Output truncated: your program produced too much output. Check for a loop that prints forever.]"
             exit_code = run_result.get("code")
 
-            # Ensure exit_code is always an integer
-            if exit_code is None:
-                exit_code = 1 if stderr else 0
-            exit_code = int(exit_code)
-
-            # Check if execution was successful
-            success = exit_code == 0 and not stderr
-            
             # Get execution time if available
             execution_time = run_result.get("time", "< 5s")
             if isinstance(execution_time, (int, float)):
                 execution_time = f"{execution_time:.2f}s"
+
+            if exit_code == 0 and not stderr:
+                # Clean run (most test cases): only the output and timing differ
+                result = SUCCESS_RESULT_TEMPLATE.copy()
+                result["output"] = stdout
+                result["execution_time"] = execution_time
+            else:
+                # Ensure exit_code is always an integer
+                if exit_code is None:
+                    exit_code = 1 if stderr else 0
+                exit_code = int(exit_code)
+
+                result = {
+                    "success": exit_code == 0 and not stderr,
+                    "output": stdout,
+                    "error": stderr,
+                    "exit_code": exit_code,
+                    "execution_time": execution_time
+                }
+
+            logger.info("Execution completed: success=%s, exit_code=%s", result["success"], result["exit_code"])
+
+            # Service errors and timeouts return before this point, so only real runs are cached
+            self._result_cache.set(cache_key, result)
+            return result
             
-            logger.info(f"Execution completed: success={success}, exit_code={exit_code}")
-            
-            return {
-                "success": success,
-                "output": stdout,
-                "error": stderr,
-                "exit_code": exit_code,
-                "execution_time": execution_time
-            }
-            
-        except requests.exceptions.Timeout:
+        except (httpx.TimeoutException, asyncio.TimeoutError):
             logger.warning(f"Execution timed out after {self.timeout} seconds")
             return {
                 "success": False,
@@ -257,15 +601,17 @@ class CodeRunner:
                 "exit_code": -1,
                 "execution_time": f"> {self.timeout}s"
             }
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Piston API request error: {e}")
-            return {
+            error_result = {
                 "success": False,
                 "output": "",
                 "error": f"Failed to connect to code execution service: {str(e)}. Please check your connection or try again later.",
                 "exit_code": -1,
                 "execution_time": "error"
             }
+            self._error_cache.set(cache_key, error_result)
+            return error_result
         except Exception as e:
             logger.error(f"Error running code via Piston API: {e}", exc_info=True)
             return {
@@ -276,7 +622,83 @@ class CodeRunner:
                 "execution_time": "error"
             }
 
-    def run_with_tests(self, code: str, language: str, test_cases: list, inject_timeout: bool = False) -> Dict[str, Any]:
+    def _unsupported_language_result(self, language: str) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "output": "",
+            "error": f"Language '{language}' is not supported. Supported languages: {self._supported_languages}",
+            "exit_code": -1,
+            "execution_time": "0s"
+        }
+
+    def _calculate_backoff(self, attempt: int, response: httpx.Response) -> float:
+        """Exponential backoff with jitter; a Retry-After header (429/503) is used as a lower bound"""
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                delay = min(max(delay, float(retry_after)), self.max_delay)
+            except ValueError:
+                pass
+
+        return delay + random.uniform(0, 0.1 * delay)
+
+    @staticmethod
+    def _files_json_parts(code: str, code_suffix: str, driver: Optional[str], piston_language: str) -> tuple:
+        """
+        Fragments of the serialized Piston `files` array (the first file is run). The student
+        code's JSON encoding is cached, and a harness suffix is spliced onto it: two encoded
+        strings join into one by dropping the closing and opening quotes between them
+        (memoryview slices, so nothing is copied until the body is joined).
+        """
+        content = (_json_string(code),)
+        if code_suffix:
+            content = (memoryview(content[0])[:-1], memoryview(orjson.dumps(code_suffix))[1:])
+        if driver is not None:
+            entry_name, solution_name = DRIVER_FILE_NAMES[piston_language]
+            return (b'"files":[{"name":"' + entry_name.encode() + b'","content":', orjson.dumps(driver),
+                    b'},{"name":"' + solution_name.encode() + b'","content":', *content, b'}]')
+        return (b'"files":[{"content":', *content, b'}]')
+
+    @staticmethod
+    async def _read_capped(response: httpx.Response, limit: int) -> tuple:
+        """Read a streamed response body, stopping after `limit` bytes. Returns (body, truncated)"""
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                return b"".join(chunks)[:limit], True
+        return b"".join(chunks), False
+
+    def _salvage_run_result(self, partial_body: bytes) -> Dict[str, Any]:
+        """
+        Recover the start of stdout/stderr from a response cut off by _read_capped.
+        Only the first max_output_length characters are kept anyway, so each value is scanned
+        and decoded only that far instead of to the end of the buffered body.
+        """
+        run_result = {}
+        for key in ("stdout", "stderr"):
+            prefix = b'"' + key.encode() + b'":"'
+            start = partial_body.find(prefix)
+            if start < 0:
+                continue
+            # Up to 6 bytes of JSON per character, read only up to the closing quote
+            start += len(prefix)
+            value = JSON_STRING_CONTENT.match(partial_body, start, start + self.max_output_length * 6).group()
+            # The cut may land inside an escape sequence or a UTF-8 character
+            for end in range(len(value), max(len(value) - 6, -1), -1):
+                try:
+                    run_result[key] = orjson.loads(b'"' + value[:end] + b'"')[:self.max_output_length]
+                    break
+                except orjson.JSONDecodeError:
+                    continue
+        return run_result
+
+    async def run_with_tests(self, code: str, language: str, test_cases: list, inject_timeout: bool = False,
+                             include_normal_run: bool = False) -> Dict[str, Any]:
         """
         Run code with test cases and return results
 
@@ -285,178 +707,43 @@ class CodeRunner:
             language: Programming language
             test_cases: List of test case dicts with function_name, input_data, expected_output
             inject_timeout: If True, inject timeout handling for long-running programs (default False)
+            include_normal_run: If True, also run the unmodified code for the reported output (default False)
 
         Returns:
             Dict with test_results, tests_passed, tests_failed, plus regular execution info
         """
         try:
-            from pyd_models.schemas import TestResult
-
-            test_results = []
-            tests_passed = 0
-            tests_failed = 0
-
-            logger.info(f"Running {len(test_cases)} test cases for {language} code")
-            
-            # Optionally inject timeout handling for long-running programs
-            base_code = code
-            if inject_timeout:
-                logger.info("Injecting timeout handling for long-running program testing")
-                base_code = self._inject_timeout_handling(code, language, timeout_seconds=10)
-
-            for test_case in test_cases:
-                try:
-                    test_name = test_case.get('test_name', 'Unknown Test')
-                    function_name = test_case.get('function_name', '')
-                    input_data = test_case.get('input_data', '')
-                    expected_output = test_case.get('expected_output', '').strip()
-
-                    # Generate test code based on language
-                    if language.lower() == 'python':
-                        test_code = f"{base_code}\n\n# Test execution\nresult = {function_name}({input_data})\nprint(result)"
-                    elif language.lower() in ['javascript', 'js']:
-                        test_code = f"{base_code}\n\n// Test execution\nconst result = {function_name}({input_data});\nconsole.log(result);"
-                    elif language.lower() in ['csharp', 'c#', 'cs']:
-                        # For C#, check if code already has Main method
-                        has_main = 'static void Main' in base_code or 'static async Task Main' in base_code
-
-                        if function_name.lower() == 'main' and has_main:
-                            # Integration test - code already has Main, just run it
-                            test_code = base_code
-                        elif function_name.lower() == 'main' and not has_main:
-                            # Need to add Main method to call the function
-                            test_code = f"""{base_code}
-
-// Test execution
-class TestRunner {{
-    static void Main(string[] args) {{
-        {function_name}({input_data});
-    }}
-}}"""
-                        elif '.' in function_name:
-                            # Method test with namespace/class qualification (e.g., Namespace.ClassName.MethodName or ClassName.MethodName)
-                            parts = function_name.split('.')
-
-                            if len(parts) == 3:
-                                # Namespace.ClassName.MethodName format
-                                namespace_name, class_name, method_name = parts
-                                full_class_name = f"{namespace_name}.{class_name}"
-                            elif len(parts) == 2:
-                                # ClassName.MethodName format
-                                class_name, method_name = parts
-                                full_class_name = class_name
-                            else:
-                                # Fallback for unexpected format
-                                full_class_name = parts[0]
-                                method_name = parts[-1]
-
-                            if has_main:
-                                # Code has Main, need to call method from outside the namespace
-                                # Remove the existing Main and add test Main outside namespace
-                                # This is complex, so for integration tests just run the code
-                                test_code = base_code
-                            else:
-                                # No Main exists, add TestRunner outside the namespace
-                                test_code = f"""{base_code}
-
-// Test execution
-class TestRunner {{
-    static void Main(string[] args) {{
-        var instance = new {full_class_name}();
-        var result = instance.{method_name}({input_data});
-        Console.WriteLine(result);
-    }}
-}}"""
-                        else:
-                            # Simple function name without dots
-                            if has_main:
-                                # Already has Main, just run it
-                                test_code = base_code
-                            else:
-                                # Add Main to call the function
-                                test_code = f"""{base_code}
-
-// Test execution
-class TestRunner {{
-    static void Main(string[] args) {{
-        var result = {function_name}({input_data});
-        Console.WriteLine(result);
-    }}
-}}"""
-                    elif language.lower() in ['java']:
-                        # For Java, handle integration tests vs function tests
-                        if function_name.lower() == 'main':
-                            # Integration test - run the whole program
-                            test_code = base_code
-                        else:
-                            # Function test
-                            if '.' in function_name:
-                                class_name, method_name = function_name.split('.', 1)
-                                test_code = f"""{base_code}
-
-// Test execution
-class TestRunner {{
-    public static void main(String[] args) {{
-        {class_name} instance = new {class_name}();
-        var result = instance.{method_name}({input_data});
-        System.out.println(result);
-    }}
-}}"""
-                            else:
-                                test_code = f"""{base_code}
-
-// Test execution
-class TestRunner {{
-    public static void main(String[] args) {{
-        var result = {function_name}({input_data});
-        System.out.println(result);
-    }}
-}}"""
-                    else:
-                        # For other languages, try a generic approach
-                        test_code = f"{base_code}\n\n{function_name}({input_data});"
-
-                    # Run the test
-                    result = self.run_code(test_code, language, stdin="")
-
-                    # Get actual output and clean it
-                    actual_output = result.get('output', '').strip()
-
-                    # Check if test passed (compare outputs with special pattern matching)
-                    passed = self._check_output_match(actual_output, expected_output)
-
-                    if passed:
-                        tests_passed += 1
-                    else:
-                        tests_failed += 1
-
-                    # Create test result
-                    test_result = TestResult(
-                        test_name=test_name,
-                        function_name=function_name,  # Add function name
-                        passed=passed,
-                        input_data=input_data,
-                        expected_output=expected_output,
-                        actual_output=actual_output,
-                        error=result.get('error') if result.get('error') else None
-                    )
-                    test_results.append(test_result)
-
-                except Exception as e:
-                    logger.error(f"Error running test case '{test_name}': {e}")
-                    test_results.append(TestResult(
-                        test_name=test_case.get('test_name', 'Unknown Test'),
-                        function_name=test_case.get('function_name', 'Unknown'),  # Add function name
-                        passed=False,
-                        input_data=test_case.get('input_data', ''),
-                        expected_output=test_case.get('expected_output', ''),
-                        actual_output='',
-                        error=f"Test execution error: {str(e)}"
-                    ))
-                    tests_failed += 1
-
-            # Also run the code normally to get any compilation/syntax errors
-            normal_result = self.run_code(base_code, language, stdin="")
+            logger.info("Running %d test cases for %s code", len(test_cases), language)
+            language = language if language.islower() else language.lower()
+
+            if language not in self.language_map:
+                # Every test would fail the same way, so no harnesses are built or run
+                normal_result = self._unsupported_language_result(language)
+                results = [(self._test_result(test_case, normal_result), normal_result) for test_case in test_cases]
+            else:
+                # Optionally inject timeout handling for long-running programs
+                base_code = code
+                if inject_timeout:
+                    logger.info("Injecting timeout handling for long-running program testing")
+                    base_code = self._inject_timeout_handling(code, language, timeout_seconds=10)
+
+                runs = [self._run_test_cases(base_code, language, test_cases)]
+                if include_normal_run:
+                    runs.append(self.run_code(base_code, language, stdin=""))
+                results, *normal_run = await asyncio.gather(*runs)
+                normal_result = normal_run[0] if normal_run else None
+
+            test_results = [test_result for test_result, _ in results]
+            tests_passed = sum(1 for test_result in test_results if test_result.passed)
+            tests_failed = len(test_results) - tests_passed
+
+            # Compilation/syntax errors show up in every test run, so the summary is taken
+            # from the test runs instead of paying for a separate normal run
+            if normal_result is None:
+                normal_result = self._summary_result([run_result for _, run_result in results if run_result])
+                if not normal_result:
+                    # No test produced a run (empty suite, or every harness failed to build)
+                    normal_result = await self.run_code(base_code, language, stdin="")
 
             return {
                 "success": tests_passed > 0 and tests_failed == 0,
@@ -482,21 +769,210 @@ class TestRunner {{
                 "tests_failed": len(test_cases)
             }
 
-    def run_python(self, code: str, stdin: Optional[str] = None) -> Dict[str, Any]:
+    def _summary_result(self, run_results: list) -> Dict[str, Any]:
+        """Pick the run reported as the overall output: the first compile/syntax failure, else the first run"""
+        for run_result in run_results:
+            if any(marker in run_result.get('error', '') for marker in COMPILE_ERROR_MARKERS):
+                return run_result
+        return run_results[0] if run_results else {}
+
+    async def _run_test_case(self, base_code: str, language: str, test_case: dict, build_harness) -> tuple:
+        """Build the harness for one test case, run it and compare its output. Returns (TestResult, run result)"""
+
+        try:
+            test_name = test_case.get('test_name', 'Unknown Test')
+            function_name = test_case.get('function_name', '')
+            input_data = test_case.get('input_data', '')
+
+            # Generate test code based on language
+            code_suffix, driver = build_harness(base_code, function_name, input_data)
+
+            # Run the test
+            result = await self.run_code(base_code, language, stdin="", driver=driver, code_suffix=code_suffix)
+            return self._test_result(test_case, result), result
+
+        except Exception as e:
+            logger.error(f"Error running test case '{test_name}': {e}")
+            return TestResult(
+                test_name=test_case.get('test_name', 'Unknown Test'),
+                function_name=test_case.get('function_name', 'Unknown'),  # Add function name
+                passed=False,
+                input_data=test_case.get('input_data', ''),
+                expected_output=test_case.get('expected_output', ''),
+                actual_output='',
+                error=f"Test execution error: {str(e)}"
+            ), None
+
+    # Test harness builders: (base_code, function_name, input_data) -> (code_suffix, driver).
+    # They return only what is appended to the student code, never a copy of it.
+
+    def _python_harness(self, base_code: str, function_name: str, input_data: str) -> tuple:
+        # The student code goes out unchanged as its own module; only this driver differs per test
+        return "", PYTHON_TEST_DRIVER.format(call=f"{function_name}({input_data})")
+
+    def _javascript_harness(self, base_code: str, function_name: str, input_data: str) -> tuple:
+        return JAVASCRIPT_TEST_TEMPLATE.format(fn=function_name, inp=input_data), None
+
+    def _generic_harness(self, base_code: str, function_name: str, input_data: str) -> tuple:
+        # For other languages, try a generic approach
+        return GENERIC_TEST_TEMPLATE.format(fn=function_name, inp=input_data), None
+
+    def _csharp_harness(self, base_code: str, function_name: str, input_data: str) -> tuple:
+        # For C#, check if code already has Main method
+        has_main = _has_csharp_main(base_code)
+
+        if function_name.lower() == 'main' and has_main:
+            # Integration test - code already has Main, just run it
+            return "", None
+        elif function_name.lower() == 'main' and not has_main:
+            # Need to add Main method to call the function
+            return CSHARP_MAIN_TEST_TEMPLATE.format(fn=function_name, inp=input_data), None
+        elif '.' in function_name:
+            # Method test with namespace/class qualification (e.g., Namespace.ClassName.MethodName or ClassName.MethodName)
+            parts = function_name.split('.')
+
+            if len(parts) == 3:
+                # Namespace.ClassName.MethodName format
+                namespace_name, class_name, method_name = parts
+                full_class_name = f"{namespace_name}.{class_name}"
+            elif len(parts) == 2:
+                # ClassName.MethodName format
+                class_name, method_name = parts
+                full_class_name = class_name
+            else:
+                # Fallback for unexpected format
+                full_class_name = parts[0]
+                method_name = parts[-1]
+
+            if has_main:
+                # Code has Main, need to call method from outside the namespace
+                # Remove the existing Main and add test Main outside namespace
+                # This is complex, so for integration tests just run the code
+                return "", None
+            # No Main exists, add TestRunner outside the namespace
+            return CSHARP_METHOD_TEST_TEMPLATE.format(cls=full_class_name, method=method_name, inp=input_data), None
+        else:
+            # Simple function name without dots
+            if has_main:
+                # Already has Main, just run it
+                return "", None
+            # Add Main to call the function
+            return CSHARP_FUNCTION_TEST_TEMPLATE.format(fn=function_name, inp=input_data), None
+
+    def _java_harness(self, base_code: str, function_name: str, input_data: str) -> tuple:
+        # For Java, handle integration tests vs function tests
+        if function_name.lower() == 'main':
+            # Integration test - run the whole program
+            return "", None
+
+        # Function test
+        if '.' in function_name:
+            class_name, method_name = function_name.split('.', 1)
+            return JAVA_METHOD_TEST_TEMPLATE.format(cls=class_name, method=method_name, inp=input_data), None
+        return JAVA_FUNCTION_TEST_TEMPLATE.format(fn=function_name, inp=input_data), None
+
+    def _test_result(self, test_case: dict, result: Dict[str, Any]):
+        """Compare one run's output with the test's expected output"""
+
+        expected_output = test_case.get('expected_output', '').strip()
+
+        # Get actual output and clean it
+        actual_output = result.get('output', '').strip()
+
+        # Check if test passed (compare outputs with special pattern matching)
+        passed = self._check_output_match(actual_output, expected_output)
+
+        # Create test result
+        return TestResult(
+            test_name=test_case.get('test_name', 'Unknown Test'),
+            function_name=test_case.get('function_name', ''),  # Add function name
+            passed=passed,
+            input_data=test_case.get('input_data', ''),
+            expected_output=expected_output,
+            actual_output=actual_output,
+            error=result.get('error') if result.get('error') else None
+        )
+
+    async def _run_test_cases(self, base_code: str, language: str, test_cases: list) -> list:
+        """
+        Run every test case, returning (TestResult, run result) pairs in order.
+        Python and JavaScript tests go out as one batched execution; any test the batch
+        didn't report (crash, timeout, truncated output) and every other language run one
+        per execution, up to MAX_CONCURRENT_TEST_RUNS at a time.
+        """
+        language = language.lower()
+        build_harness = self._test_harnesses.get(language, self._generic_harness)
+
+        results = [None] * len(test_cases)
+        if build_harness in (self._python_harness, self._javascript_harness) and len(test_cases) > 1:
+            for index, result in (await self._run_batched_tests(base_code, language, test_cases)).items():
+                results[index] = (self._test_result(test_cases[index], result), result)
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        if len(pending) < len(test_cases):
+            logger.info("Batched run reported %d/%d tests", len(test_cases) - len(pending), len(test_cases))
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_TEST_RUNS)
+
+        async def run_one(index: int) -> tuple:
+            async with semaphore:
+                return await self._run_test_case(base_code, language, test_cases[index], build_harness)
+
+        for index, result in zip(pending, await asyncio.gather(*[run_one(index) for index in pending])):
+            results[index] = result
+        return results
+
+    async def _run_batched_tests(self, base_code: str, language: str, test_cases: list) -> Dict[int, Dict[str, Any]]:
+        """
+        Run all Python or JavaScript tests in one Piston execution (one container start instead of N).
+        Each test's stdout is captured separately and reported as a delimited JSON record.
+        Returns {test index: run result} for the tests that reported.
+        """
+        # Each call goes into the driver as a string and is compiled per case
+        call_sources = [f"{test_case.get('function_name', '')}({test_case.get('input_data', '')})" for test_case in test_cases]
+        if language == 'python':
+            calls = "\n".join(f"_run_case({index}, {source!r})" for index, source in enumerate(call_sources))
+            result = await self.run_code(base_code, language, stdin="", driver=PYTHON_BATCH_DRIVER + calls + "\n")
+        else:
+            # A JSON string is also a valid JavaScript string literal
+            calls = "\n".join(f"_runCase({index}, {orjson.dumps(source).decode()});" for index, source in enumerate(call_sources))
+            result = await self.run_code(base_code, language, stdin="", driver=JAVASCRIPT_BATCH_DRIVER + calls + "\n")
+
+        # The solution itself didn't compile (the driver exits before any record) -
+        # every separate run would fail the same way
+        if BATCH_RECORD_SEPARATOR not in result.get('output', '') and any(
+            marker in result.get('error', '') for marker in COMPILE_ERROR_MARKERS
+        ):
+            return dict.fromkeys(range(len(test_cases)), result)
+
+        # Each record starts at a separator; the drivers print nothing outside them
+        records = result.get('output', '').split(BATCH_RECORD_SEPARATOR)[1:]
+        results = {}
+        for chunk in records:
+            try:
+                record = orjson.loads(chunk.partition("\n")[0])
+            except orjson.JSONDecodeError:
+                # Cut off by the output limit
+                break
+            results[record["i"]] = {
+                "success": not record.get("error"),
+                "output": record["out"],
+                "error": record.get("error") or "",
+                "exit_code": 1 if record.get("error") else 0,
+                "execution_time": result.get('execution_time', '')
+            }
+        return results
+
+    async def run_python(self, code: str, stdin: Optional[str] = None) -> Dict[str, Any]:
         """Run Python code"""
-        return self.run_code(code, "python", stdin)
+        return await self.run_code(code, "python", stdin)
     
-    def run_javascript(self, code: str, stdin: Optional[str] = None) -> Dict[str, Any]:
+    async def run_javascript(self, code: str, stdin: Optional[str] = None) -> Dict[str, Any]:
         """Run JavaScript code"""
-        return self.run_code(code, "javascript", stdin)
-
+        return await self.run_code(code, "javascript", stdin)
 
-# Singleton instance
-_code_runner = None
 
+@functools.cache
 def get_code_runner() -> CodeRunner:
-    """Get the code runner singleton"""
-    global _code_runner
-    if _code_runner is None:
-        _code_runner = CodeRunner()
-    return _code_runner
+    """Get the code runner singleton (shares one connection pool across requests)"""
+    return CodeRunner()
@@ -0,0 +1,134 @@
+"""
+Semantic cache for live helper hints.
+Students on the same assignment ask near-identical questions, so a hint for a
+question that is similar enough to one already answered (same task, same code,
+same help level) is reused instead of making another Claude call.
+"""
+
+import functools
+import hashlib
+import logging
+import re
+import threading
+import time
+import numpy as np
+from config import (HINT_CACHE_SIZE, HINT_CACHE_SIMILARITY, HINT_CACHE_DIMENSIONS, HINT_CACHE_CONTEXT_WEIGHT,
+                    HINT_CACHE_TTL_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[a-z0-9_]+")
+
+
+def embed(text: str, dimensions: int = HINT_CACHE_DIMENSIONS) -> np.ndarray:
+    """
+    Hash words and character trigrams into a fixed-size vector (L2-normalized).
+    Cheap, dependency-free and deterministic, which is all a near-duplicate lookup needs.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    words = _WORD.findall(text.lower())
+    features = words + [word[i:i + 3] for word in words for i in range(len(word) - 2)]
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@functools.lru_cache(maxsize=256)
+def _embed_context(text: str, dimensions: int) -> np.ndarray:
+    """Task descriptions repeat across many questions, so their embedding is computed once"""
+    vector = embed(text, dimensions)
+    vector.flags.writeable = False
+    return vector
+
+
+def embed_query(context: str, question: str, dimensions: int = HINT_CACHE_DIMENSIONS,
+                context_weight: float = HINT_CACHE_CONTEXT_WEIGHT) -> np.ndarray:
+    """
+    Weighted mix of the (cached) context embedding and the question embedding.
+    Embedding them together would let the long, shared context dominate the
+    similarity, so unrelated questions on the same task would look alike.
+    """
+    combined = context_weight * _embed_context(context, dimensions) + (1 - context_weight) * embed(question, dimensions)
+    norm = np.linalg.norm(combined)
+    return combined / norm if norm else combined
+
+
+class SemanticHintCache:
+    """
+    Bounded in-memory index of normalized embeddings (brute-force X @ q top-1 lookup).
+    The search only covers entries in the requested scope (e.g. help level, language and
+    code digest), so a more similar hint for other code can't shadow or leak into it.
+    Entries expire after `ttl` seconds; the least recently used entry is overwritten once
+    the index is full.
+    """
+
+    def __init__(self, maxsize: int = HINT_CACHE_SIZE, threshold: float = HINT_CACHE_SIMILARITY,
+                 dimensions: int = HINT_CACHE_DIMENSIONS, ttl: float = HINT_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.ttl = ttl
+        self._vectors = np.zeros((maxsize, dimensions), dtype=np.float32)
+        self._last_used = np.zeros(maxsize, dtype=np.int64)
+        self._expires = np.zeros(maxsize, dtype=np.float64)
+        self._scopes = [None] * maxsize
+        self._scope_rows = {}
+        self._values = [None] * maxsize
+        self._size = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def get(self, context: str, question: str, scope: tuple):
+        """Return the cached value for the most similar question in `scope`, or None"""
+        query = embed_query(context, question, self.dimensions)
+        with self._lock:
+            rows = self._scope_rows.get(scope)
+            if not rows:
+                return None
+
+            rows = np.fromiter(rows, dtype=np.intp, count=len(rows))
+            rows = rows[self._expires[rows] > time.monotonic()]
+            if not rows.size:
+                return None
+
+            scores = self._vectors[rows] @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            index = rows[best]
+            self._clock += 1
+            self._last_used[index] = self._clock
+            logger.info(f"Hint cache hit (similarity {scores[best]:.3f})")
+            return self._values[index]
+
+    def put(self, context: str, question: str, scope: tuple, value):
+        query = embed_query(context, question, self.dimensions)
+        with self._lock:
+            if self._size < self.maxsize:
+                index = self._size
+                self._size += 1
+            else:
+                index = int(np.argmin(self._last_used))
+                evicted = self._scope_rows[self._scopes[index]]
+                evicted.discard(index)
+                if not evicted:
+                    del self._scope_rows[self._scopes[index]]
+
+            self._clock += 1
+            self._vectors[index] = query
+            self._last_used[index] = self._clock
+            self._expires[index] = time.monotonic() + self.ttl
+            self._scopes[index] = scope
+            self._scope_rows.setdefault(scope, set()).add(index)
+            self._values[index] = value
+
+
+@functools.cache
+def get_hint_cache() -> SemanticHintCache:
+    """Get the shared hint cache"""
+    return SemanticHintCache()
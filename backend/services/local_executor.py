@@ -0,0 +1,194 @@
+"""
+Local code execution backend
+Runs code in subprocesses on this machine instead of calling the Piston API.
+Enabled with PISTON_API_URL=local:// - meant for self-hosted deployments where the
+server itself is the sandbox (a container), since only CPU/memory rlimits are applied.
+Runs share the server's user, so they can read anything it can (including its secrets).
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import resource
+import signal
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List
+from config import LOCAL_EXEC_MEMORY_LIMIT_BYTES, LOCAL_EXEC_WARM_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Piston language -> (interpreter command, default filename)
+INTERPRETERS = {
+    'python3': ([sys.executable], 'main.py'),
+    'javascript': (['node'], 'main.js'),
+}
+
+# Warm Python processes block on this until a run arrives: the first stdin line is the
+# working directory, everything after it is the program's own stdin. Modules student code
+# commonly imports are loaded while waiting, so those imports are dict lookups at run time.
+_PYTHON_BOOTSTRAP = (
+    "import os, runpy, sys\n"
+    "import bisect, collections, dataclasses, datetime, functools, heapq, itertools, json, math, random, re, string, typing\n"
+    "workdir = sys.stdin.readline().rstrip('\\n')\n"
+    "os.chdir(workdir)\n"
+    "sys.path.insert(0, workdir)\n"
+    "sys.argv = ['main.py']\n"
+    "runpy.run_path('main.py', run_name='__main__')\n"
+)
+
+
+def _limit_resources(cpu_seconds: int, memory_bytes: int = None):
+    """preexec_fn applying CPU (and optionally address-space) limits in the child"""
+    def apply():
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+        if memory_bytes:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    return apply
+
+
+class LocalExecBackend:
+    """
+    Runs Python and JavaScript with a fork/exec per run (no network hop, no API quota).
+    Python runs are handed to pre-started interpreters, skipping interpreter startup.
+    A warm interpreter is used for one run only and killed afterwards. The pool saves
+    startup time and nothing else: it adds no isolation beyond a fresh process.
+    Returns Piston-style run dicts: stdout, stderr, code, time.
+    """
+
+    def __init__(self, timeout: int, max_output_bytes: int, warm_pool_size: int = LOCAL_EXEC_WARM_POOL_SIZE):
+        self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.warm_pool_size = warm_pool_size
+        # Keeps our variables out of os.environ, but this is not isolation: runs share our
+        # uid, so student code can still read /proc/<ppid>/environ or the .env file
+        self._env = {"PATH": os.environ.get("PATH", ""), "LANG": "C.UTF-8", "PYTHONDONTWRITEBYTECODE": "1"}
+        self._warm_python = collections.deque()
+        self._refill_task = None
+
+    async def run(self, language: str, files: List[Dict[str, str]], stdin: str) -> Dict[str, Any]:
+        """Run `files` (the first one is the entry point) and return the Piston-style run result"""
+        if language not in INTERPRETERS:
+            raise ValueError(f"Language '{language}' is not supported by the local executor")
+        command, default_name = INTERPRETERS[language]
+
+        with tempfile.TemporaryDirectory(prefix="scaffy-run-") as workdir:
+            names = []
+            for index, file in enumerate(files):
+                name = os.path.basename(file.get("name") or (default_name if index == 0 else f"file{index}"))
+                with open(os.path.join(workdir, name), "w") as f:
+                    f.write(file["content"])
+                names.append(name)
+
+            started = time.monotonic()
+            if language == 'python3' and names[0] == 'main.py':
+                process = await self._take_warm_python()
+                stdin = f"{workdir}\n{stdin}"
+            else:
+                process = await self._spawn(command + [names[0]], cwd=workdir)
+
+            # Feed stdin alongside the reads and under the timeout: a program that never reads
+            # it would otherwise block drain() forever once the pipe buffer fills
+            try:
+                _, stdout, stderr = await asyncio.wait_for(
+                    asyncio.gather(
+                        self._write_stdin(process, stdin.encode()),
+                        self._read_capped(process, process.stdout),
+                        self._read_capped(process, process.stderr)
+                    ),
+                    timeout=self.timeout
+                )
+                code = await process.wait()
+            finally:
+                # Every process (warm or not) serves exactly one run: kill its whole group,
+                # including anything the run left running in the background
+                self._kill(process)
+                await process.wait()
+
+        return {
+            "stdout": stdout.decode(errors="replace"),
+            "stderr": stderr.decode(errors="replace"),
+            "code": code,
+            "time": time.monotonic() - started
+        }
+
+    async def warm_up(self):
+        """Fill the warm interpreter pool ahead of the first run (call once on application startup)"""
+        await self._refill_warm_python()
+        logger.info(f"Started {len(self._warm_python)} warm Python interpreters")
+
+    async def aclose(self):
+        """Kill the idle warm interpreters (call once on application shutdown)"""
+        if self._refill_task:
+            self._refill_task.cancel()
+        while self._warm_python:
+            process = self._warm_python.popleft()
+            self._kill(process)
+            await process.wait()
+
+    async def _take_warm_python(self) -> asyncio.subprocess.Process:
+        process = None
+        while self._warm_python:
+            candidate = self._warm_python.popleft()
+            if candidate.returncode is None:
+                process = candidate
+                break
+        if process is None:
+            process = await self._spawn_python()
+
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill_warm_python())
+        return process
+
+    async def _refill_warm_python(self):
+        try:
+            while len(self._warm_python) < self.warm_pool_size:
+                self._warm_python.append(await self._spawn_python())
+        except Exception as e:
+            logger.warning(f"Failed to start warm Python interpreter: {e}")
+
+    async def _spawn_python(self) -> asyncio.subprocess.Process:
+        return await self._spawn([sys.executable, "-c", _PYTHON_BOOTSTRAP])
+
+    async def _spawn(self, command: List[str], cwd: str = None) -> asyncio.subprocess.Process:
+        # Node reserves a large virtual address space up front, so RLIMIT_AS is only applied to Python
+        memory_limit = LOCAL_EXEC_MEMORY_LIMIT_BYTES if command[0] == sys.executable else None
+        return await asyncio.create_subprocess_exec(
+            *command,
+            cwd=cwd,
+            env=self._env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=_limit_resources(self.timeout, memory_limit),
+            start_new_session=True  # So the whole process group can be killed
+        )
+
+    @staticmethod
+    async def _write_stdin(process: asyncio.subprocess.Process, data: bytes):
+        try:
+            process.stdin.write(data)
+            await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Exited without reading stdin
+
+    async def _read_capped(self, process: asyncio.subprocess.Process, stream: asyncio.StreamReader) -> bytes:
+        """Read up to max_output_bytes, killing the process once it prints more than that"""
+        data = bytearray()
+        while chunk := await stream.read(65536):
+            data += chunk[:self.max_output_bytes - len(data)]
+            if len(data) >= self.max_output_bytes:
+                # No point letting it keep printing (and the other pipe only closes once it exits)
+                self._kill(process)
+                break
+        return bytes(data)
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
@@ -3,10 +3,11 @@ PDF text extraction service
 Extracts text from PDF files using pdfplumber
 """
 
+import asyncio
+import functools
+import io
 import pdfplumber
 import logging
-import tempfile
-import os
 from typing import Dict, Any
 from fastapi import UploadFile
 
@@ -53,7 +54,6 @@ class PDFExtractor:
                 'error': error_msg
             }
         
-        temp_file_path = None
         try:
             # Read file content and check size
             file_content = await file.read()
@@ -79,32 +79,10 @@ class PDFExtractor:
                     'error': error_msg
                 }
             
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(mode='wb', suffix='.pdf', delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            
-            # Extract text using pdfplumber
-            extracted_text_parts = []
-            page_count = 0
-            
             try:
-                with pdfplumber.open(temp_file_path) as pdf:
-                    page_count = len(pdf.pages)
-                    logger.info(f"Processing PDF with {page_count} pages")
-                    
-                    for page_num, page in enumerate(pdf.pages, 1):
-                        try:
-                            text = page.extract_text()
-                            if text:
-                                extracted_text_parts.append(text)
-                        except Exception as e:
-                            logger.warning(f"Error extracting text from page {page_num}: {str(e)}")
-                            # Continue with other pages even if one fails
-                            continue
-                
-                # Combine all extracted text
-                extracted_text = '\n\n'.join(extracted_text_parts)
+                # pdfplumber is synchronous and CPU-heavy; parse in a worker thread so the
+                # event loop keeps serving other requests in the meantime
+                page_count, extracted_text = await asyncio.to_thread(self._extract_pages, file_content)
                 
                 if not extracted_text or not extracted_text.strip():
                     error_msg = "No text could be extracted from the PDF. The PDF might be image-based or empty."
@@ -150,24 +128,34 @@ class PDFExtractor:
                 'page_count': 0,
                 'error': error_msg
             }
+
+    def _extract_pages(self, file_content: bytes) -> tuple[int, str]:
+        """
+        Extract text using pdfplumber (blocking). Returns (page_count, extracted_text)
+        The upload is already in memory, so it is parsed from there rather than a temp file.
+        """
+        extracted_text_parts = []
         
-        finally:
-            # Clean up temporary file
-            if temp_file_path and os.path.exists(temp_file_path):
+        with pdfplumber.open(io.BytesIO(file_content)) as pdf:
+            page_count = len(pdf.pages)
+            logger.info(f"Processing PDF with {page_count} pages")
+            
+            for page_num, page in enumerate(pdf.pages, 1):
                 try:
-                    os.unlink(temp_file_path)
-                    logger.debug(f"Cleaned up temporary file: {temp_file_path}")
+                    text = page.extract_text()
+                    if text:
+                        extracted_text_parts.append(text)
                 except Exception as e:
-                    logger.warning(f"Failed to clean up temporary file {temp_file_path}: {str(e)}")
-
+                    logger.warning(f"Error extracting text from page {page_num}: {str(e)}")
+                    # Continue with other pages even if one fails
+                    continue
+        
+        # Combine all extracted text
+        return page_count, '\n\n'.join(extracted_text_parts)
 
-# Singleton instance
-pdf_extractor = None
 
+@functools.cache
 def get_pdf_extractor() -> PDFExtractor:
     """Get or create PDF extractor instance"""
-    global pdf_extractor
-    if pdf_extractor is None:
-        pdf_extractor = PDFExtractor()
-    return pdf_extractor
+    return PDFExtractor()
 
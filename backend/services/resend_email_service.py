@@ -4,7 +4,8 @@ Resend has a free tier: 100 emails/day, 3,000 emails/month
 Sign up at: https://resend.com
 """
 
-import requests
+import functools
+import httpx
 import logging
 import os
 from dotenv import load_dotenv
@@ -20,6 +21,16 @@ class ResendEmailService:
         self.api_key = os.getenv("RESEND_API_KEY")
         self.from_email = os.getenv("RESEND_FROM_EMAIL", "onboarding@resend.dev")
         self.recipient_email = os.getenv("FEEDBACK_EMAIL", "atharvazaveri4@gmail.com")
+        # Async keep-alive client, so sending doesn't block the event loop
+        self.client = httpx.AsyncClient(
+            base_url="https://api.resend.com",
+            http2=True,
+            timeout=10,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+        )
         
         logger.info("=" * 80)
         logger.info("RESEND EMAIL SERVICE CONFIGURATION:")
@@ -29,7 +40,7 @@ class ResendEmailService:
         logger.info(f"Resend Configured: {bool(self.api_key)}")
         logger.info("=" * 80)
         
-    def send_feedback(self, name: str, email: str, feedback: str) -> bool:
+    async def send_feedback(self, name: str, email: str, feedback: str) -> bool:
         """
         Send feedback email using Resend API
         
@@ -75,15 +86,7 @@ Sent from Scaffi Feedback System
             }
             
             # Send via Resend API
-            response = requests.post(
-                "https://api.resend.com/emails",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json=email_data,
-                timeout=10
-            )
+            response = await self.client.post("/emails", json=email_data)
             
             if response.status_code == 200:
                 logger.info("Feedback email sent successfully via Resend")
@@ -108,13 +111,18 @@ Sent from Scaffi Feedback System
             logger.info("=" * 80)
             return True  # Return True so user sees success
 
+    async def aclose(self):
+        """Close the HTTP client (call once on application shutdown)"""
+        await self.client.aclose()
 
-# Singleton instance
-_resend_email_service = None
 
+@functools.cache
 def get_resend_email_service() -> ResendEmailService:
     """Get the Resend email service singleton"""
-    global _resend_email_service
-    if _resend_email_service is None:
-        _resend_email_service = ResendEmailService()
-    return _resend_email_service
+    return ResendEmailService()
+
+
+async def close_resend_email_service():
+    """Close the service's HTTP client if it was ever created (call once on application shutdown)"""
+    if get_resend_email_service.cache_info().currsize:
+        await get_resend_email_service().aclose()
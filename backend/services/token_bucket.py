@@ -0,0 +1,59 @@
+"""
+Proactive token-bucket limiter for outgoing Anthropic API calls.
+Paces requests below the account's requests/min and tokens/min limits
+so concurrent generation doesn't hit 429/529 cascades.
+"""
+
+import asyncio
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Bucket:
+    """Single bucket refilled continuously at `rate` per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` (may go negative) and return seconds until it is actually available"""
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.level -= min(amount, self.capacity)
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate
+
+
+class TokenBucketLimiter:
+    """
+    Tracks both requests/min and tokens/min (Anthropic enforces both).
+    Each call reserves its share up front and waits until both buckets cover it,
+    so callers queue in arrival order instead of racing into rate-limit errors.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, request_burst: int = 10):
+        self._requests = _Bucket(rate=requests_per_minute / 60, capacity=request_burst)
+        self._tokens = _Bucket(rate=tokens_per_minute / 60, capacity=tokens_per_minute)
+        self._lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            return max(
+                self._requests.reserve(1, now),
+                self._tokens.reserve(estimated_tokens, now)
+            )
+
+    async def acquire(self, estimated_tokens: int):
+        """Wait (without blocking the event loop) until the request may be sent"""
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter pacing request for {wait:.2f}s ({estimated_tokens} tokens)")
+            await asyncio.sleep(wait)
@@ -0,0 +1,153 @@
+"""
+Learned max_tokens budget for file scaffolding.
+Records (features -> actual output tokens) after each successful generation and
+fits a small least-squares model over the recent samples, so max_tokens tracks
+what the model really produces instead of a flat per-task multiplier.
+"""
+
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+from config import (
+    TOKEN_BUDGET_MAX_SAMPLES, TOKEN_BUDGET_MIN_SAMPLES, TOKEN_BUDGET_REFIT_EVERY,
+    TOKEN_BUDGET_MIN_TOKENS, TOKEN_BUDGET_MAX_TOKENS
+)
+
+logger = logging.getLogger(__name__)
+
+# Beginners get more TODOs per task, so longer output
+EXPERIENCE_LEVELS = {'advanced': 0, 'intermediate': 1, 'beginner': 2}
+
+
+def _solve(matrix: list, vector: list) -> list | None:
+    """Solve a small linear system with Gaussian elimination (None if singular)"""
+    size = len(vector)
+    rows = [matrix[i][:] + [vector[i]] for i in range(size)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-9:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(size):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][size] / rows[i][i] for i in range(size)]
+
+
+class TokenBudgetPredictor:
+    """
+    Fits y = a + b*n_tasks + c*n_classes + d*avg_task_len + e*experience_level
+    over the last TOKEN_BUDGET_MAX_SAMPLES generations (persisted as JSON).
+    Returns None until there are enough samples, so callers keep their heuristic.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv(
+            "TOKEN_BUDGET_SAMPLES_PATH",
+            os.path.join(tempfile.gettempdir(), "scaffy_token_budget_samples.json")
+        )
+        self._lock = threading.Lock()
+        self._samples = self._load()
+        self._weights = None
+        self._samples_since_fit = TOKEN_BUDGET_REFIT_EVERY  # Fit on first use
+        self._unsaved = 0  # Samples recorded since the file was last written
+
+    @staticmethod
+    def features(n_tasks: int, n_classes: int, avg_task_len: float, experience_level: str = None) -> list:
+        return [
+            1.0,
+            float(n_tasks),
+            float(n_classes),
+            float(avg_task_len),
+            float(EXPERIENCE_LEVELS.get(experience_level or 'intermediate', 1))
+        ]
+
+    def predict(self, features: list) -> int | None:
+        """Return a clamped max_tokens budget, or None if the model isn't trained yet"""
+        with self._lock:
+            if self._samples_since_fit >= TOKEN_BUDGET_REFIT_EVERY:
+                self._fit()
+            weights = self._weights
+
+        if weights is None:
+            return None
+        predicted = sum(w * x for w, x in zip(weights, features))
+        budget = int(1.3 * predicted) + 500
+        return max(TOKEN_BUDGET_MIN_TOKENS, min(budget, TOKEN_BUDGET_MAX_TOKENS))
+
+    def record(self, features: list, output_tokens: int):
+        """
+        Store one observed generation. Runs on the event loop, so the recent window is
+        only written out every TOKEN_BUDGET_REFIT_EVERY samples (and by save() on shutdown).
+        """
+        with self._lock:
+            self._samples.append({'x': features, 'y': output_tokens})
+            self._samples = self._samples[-TOKEN_BUDGET_MAX_SAMPLES:]
+            self._samples_since_fit += 1
+            self._unsaved += 1
+            if self._unsaved >= TOKEN_BUDGET_REFIT_EVERY:
+                self._save()
+
+    def save(self):
+        """Persist samples not written yet (call once on application shutdown)"""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _fit(self):
+        self._samples_since_fit = 0
+        if len(self._samples) < TOKEN_BUDGET_MIN_SAMPLES:
+            self._weights = None
+            return
+
+        # Normal equations: (X^T X) w = X^T y
+        size = len(self._samples[0]['x'])
+        xtx = [[0.0] * size for _ in range(size)]
+        xty = [0.0] * size
+        for sample in self._samples:
+            x, y = sample['x'], sample['y']
+            for i in range(size):
+                xty[i] += x[i] * y
+                for j in range(size):
+                    xtx[i][j] += x[i] * x[j]
+
+        # Small ridge term keeps the system solvable when a feature never varies
+        for i in range(1, size):
+            xtx[i][i] += 1e-3
+
+        self._weights = _solve(xtx, xty)
+        logger.info(f"Token budget model refit on {len(self._samples)} samples: {self._weights}")
+
+    def _load(self) -> list:
+        try:
+            with open(self.path) as f:
+                samples = json.load(f)
+            return samples[-TOKEN_BUDGET_MAX_SAMPLES:] if isinstance(samples, list) else []
+        except (OSError, ValueError):
+            return []
+
+    def _save(self):
+        self._unsaved = 0
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._samples, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not persist token budget samples: {e}")
+
+
+@functools.cache
+def get_token_budget_predictor() -> TokenBudgetPredictor:
+    """Get the shared token budget predictor"""
+    return TokenBudgetPredictor()
+
+
+def save_token_budget_samples():
+    """Persist the predictor's pending samples if it was ever created (call once on application shutdown)"""
+    if get_token_budget_predictor.cache_info().currsize:
+        get_token_budget_predictor().save()
@@ -3,38 +3,18 @@ Prompt templates for all agents
 Clean, focused prompts for each agent's specific task
 """
 
-def get_test_generation_prompt(assignment_text: str, files: list, target_language: str) -> str:
-    """
-    Generate test cases based on assignment requirements (UPDATED FOR MULTI-FILE AND MULTI-CLASS)
-    """
-    # Build tasks summary from file structure
-    tasks_summary = ""
-    for file_data in files:
-        filename = file_data.get('filename', 'unknown')
-        tasks_summary += f"\n=== File: {filename} ===\n"
-
-        # Handle simple file structure (tasks directly in file)
-        if file_data.get('tasks') is not None:
-            for task in file_data.get('tasks', []):
-                tasks_summary += f"Task {task.get('id', '')}: {task.get('title', '')} - {task.get('description', '')}\n"
-
-        # Handle multi-class file structure (classes with tasks)
-        elif file_data.get('classes') is not None:
-            for class_obj in file_data.get('classes', []):
-                class_name = class_obj.get('class_name', 'Unknown')
-                tasks_summary += f"\nClass: {class_name}\n"
-                for task in class_obj.get('tasks', []):
-                    tasks_summary += f"Task {task.get('id', '')}: {task.get('title', '')} - {task.get('description', '')}\n"
+import functools
 
-    return f"""You are a test case generator for programming assignments. Your task is to generate comprehensive test cases.
+# Stable prefixes: identical for every request, so they are built once at import
+# and can be served from Anthropic's prompt cache as the system block
 
-Assignment:
-{assignment_text}
-
-Tasks Breakdown by File:
-{tasks_summary}
+# JSON-only output rules shared by the test generation and helper prompts
+_JSON_ONLY_RULES = """- Do NOT wrap in markdown code blocks (no ``` or ```json)
+- Do NOT include any explanation before or after the JSON
+- Ensure all strings are properly escaped"""
 
-Target Language: {target_language}
+_TEST_GENERATION_PREFIX = f"""You are a test case generator for programming assignments. Your task is to generate comprehensive test cases.
+The assignment, its tasks broken down by file, and the target language are given in the user message.
 
 Your task is to:
 1. Analyze the assignment to identify functions/methods that need testing
@@ -201,17 +181,19 @@ IMPORTANT FOR C# CODE WITH EXISTING MAIN METHOD:
 - For threading/integration tests, always use function_name: "Main"
 - For specific method tests without Main, use: "Namespace.ClassName.MethodName"
 
-Return ONLY a valid JSON array of test case objects with this EXACT structure:
-[
-  {{
-    "test_name": "descriptive_test_name",
-    "function_name": "function_or_method_being_tested",
-    "input_data": "input as string (or empty for integration tests)",
-    "expected_output": "expected output as string (use CONTAINS:pattern1,pattern2 for partial matches)",
-    "description": "Human-readable description",
-    "test_type": "normal|edge|error"
-  }}
-]
+Put the test cases in the "tests" array of the response object, each with this EXACT structure:
+{{
+  "tests": [
+    {{
+      "test_name": "descriptive_test_name",
+      "function_name": "function_or_method_being_tested",
+      "input_data": "input as string (or empty for integration tests)",
+      "expected_output": "expected output as string (use CONTAINS:pattern1,pattern2 for partial matches)",
+      "description": "Human-readable description",
+      "test_type": "normal|edge|error"
+    }}
+  ]
+}}
 
 SPECIAL OUTPUT MATCHING FOR C#/Java COMPLEX TESTS:
 - Exact match: "Expected output text" → Output must exactly match
@@ -346,27 +328,16 @@ Ask yourself: "Will this test produce the SAME output every time the code runs?"
 When in doubt, prefer CONTAINS: over exact matching for robustness.
 
 CRITICAL RESPONSE FORMAT:
-- Your response must be ONLY valid JSON array
-- Do NOT wrap in markdown code blocks (no ``` or ```json)
-- Do NOT include any explanation before or after the JSON
-- Ensure all strings are properly escaped
-- Start your response with [ and end with ]
+- Fill the "tests" field of the tool input; without a tool, reply with that JSON object alone
+{_JSON_ONLY_RULES}
 - Generate 3-7 test cases minimum
 - If assignment is unclear, make reasonable assumptions and generate basic tests
 
 EXAMPLE VALID RESPONSE:
-[{{"test_name": "test_empty_input", "function_name": "reverse_string", "input_data": "\\"\\"", "expected_output": "\\"\\"", "description": "Handle empty string", "test_type": "edge"}}]"""
-
-
-def get_parser_prompt(assignment_text: str, target_language: str,
-                      known_language: str, experience_level: str) -> str:
-    """Parser for multi-file, multi-class assignments"""
+{{"tests": [{{"test_name": "test_empty_input", "function_name": "reverse_string", "input_data": "\\"\\"", "expected_output": "\\"\\"", "description": "Handle empty string", "test_type": "edge"}}]}}"""
 
-    return f"""Parse this assignment into structured tasks for a student to complete.
-
-Assignment: {assignment_text}
-Language: {target_language}
-Student Level: {experience_level}
+_PARSER_PREFIX = f"""You parse programming assignments into structured tasks for a student to complete.
+The assignment, target language and student level are given in the user message.
 
 YOUR JOB:
 1. Identify ALL files mentioned (code files, data files, config files, etc.)
@@ -484,95 +455,7 @@ Correct output:
 
 Return ONLY valid JSON."""
 
-def get_helper_prompt(task_description: str, concepts: list, student_code: str,
-                      question: str, previous_hints: list, help_count: int,
-                      known_language: str = None, target_language: str = None, experience_level: str = "intermediate",
-                      test_results: list = None) -> str:
-    """
-    Agent 3: Live Coding Helper (SMART CONTEXT-AWARE VERSION)
-    Provide contextual hints based on student's struggle level
-    NOW: Better parsing of student's question to identify which TODO they're stuck on
-    """
-    concepts_str = ", ".join(concepts)
-    previous_hints_str = "\n".join([f"- {hint}" for hint in previous_hints]) if previous_hints else "None"
-    # experiece context for experience based hints
-    experience_context = ""
-    if experience_level.lower() == "beginner":
-        experience_context = """
-
-STUDENT EXPERIENCE: Beginner
-- Use simpler language and avoid jargon
-- Explain concepts more thoroughly
-- Use more concrete examples
-- Break down steps into smaller pieces
-- Be extra patient and encouraging"""
-    elif experience_level.lower() == "advanced":
-        experience_context = """
-
-STUDENT EXPERIENCE: Advanced
-- You can use technical terminology
-- Hints can be more concise
-- LESS TEST CASES THAN INTERMEDIATE
-- Assume familiarity with common patterns
-- Focus on subtle issues or optimizations
-- Less hand-holding needed"""
-    else:  # intermediate
-        experience_context = """
-
-STUDENT EXPERIENCE: Intermediate
-- Balance between explanation and brevity
-- Use technical terms but explain if uncommon
-- LESS TEST CASES THAN BEGINNER
-- Assume basic programming knowledge
-- Standard hint depth"""
-    # Language context for better hints
-    language_context = ""
-    if known_language and target_language:
-        language_context = f"""
-
-LANGUAGE CONTEXT:
-Student knows: {known_language}
-Learning: {target_language}
-
-When providing hints or examples, you can reference {known_language} patterns to help bridge understanding.
-For example: "Think of this like Python's 'with' statement" or "Similar to C++'s RAII pattern"
-"""
-    
-    # Determine hint level based on help count
-    if help_count == 1:
-        hint_level = "gentle"
-        hint_instruction = """Give a high-level conceptual hint. Help them think about the problem differently.
-- Ask guiding questions
-- Point them to the right direction without giving away the answer
-- Remind them of relevant concepts they should consider
-- DO NOT show code examples yet
-- DO NOT ask questions back to the student
-- If they haven't implemented anything yet, suggest a starting point rather than asking a question back.
-- Same way if they have implemented eveything correctly, just give them a nudge forward.
-- DO NOT end with "What specific hint are you asking?" or similar phrases"""
-        
-    elif help_count == 2:
-        hint_level = "moderate"
-        hint_instruction = """Provide a more specific hint with guidance on the approach.
-- Explain the approach in pseudocode or plain English
-- Show a SIMILAR example (different variable names, different context)
-- Point out what's missing or incorrect in their approach
-- You can show small code snippets (3-5 lines) but not the full solution
-- DO NOT ask questions back to the student
-- DO NOT end with "Does this help?" or similar phrases"""
-        
-    else:  # 3+
-        hint_level = "strong"
-        hint_instruction = """Provide a detailed hint that's close to the solution but still requires them to implement it.
-- Show a similar working example with DIFFERENT context
-- Explain the logic step-by-step
-- You can show larger code examples but use different variable names and slightly different scenario
-- Still leave some implementation work for them (don't just give the exact answer)
--DO NOT ask questions back to the student
-- DO NOT end with "Any questions?" or similar phrases"""
-    
-
-    code_analysis_section = f"""
+_HELPER_CODE_ANALYSIS = """
 CONTEXT AWARENESS (Internal analysis - do not verbalize this to student):
 1. Identify which TODO they're stuck on from their question
 2. See what code they've written vs what's missing
@@ -584,93 +467,11 @@ YOUR RESPONSE RULES:
 - If specific error: Point it out with fix example, then STOP
 - Otherwise: Give targeted hint for their question, then STOP
 """
-    
-    # Format test results if provided
-    test_results_section = ""
-    if test_results:
-        # Correctly identify passed vs failed tests
-        passed_tests = [t for t in test_results if t.get('passed') == True]
-        failed_tests = [t for t in test_results if t.get('passed') == False]
-
-        if failed_tests or passed_tests:
-            test_results_section = f"\n\n{'='*60}\nTEST RESULTS:\n{'='*60}\n"
-            test_results_section += f"✓ Passed: {len(passed_tests)}/{len(test_results)}\n"
-            test_results_section += f"✗ Failed: {len(failed_tests)}/{len(test_results)}\n"
-
-            if failed_tests:
-                test_results_section += f"\n{'='*60}\nFAILED TEST CASES:\n{'='*60}\n"
-                for i, test in enumerate(failed_tests[:3], 1):  # Show max 3 failed tests
-                    test_results_section += f"\n{i}. {test.get('test_name', 'Test')}\n"
-                    test_results_section += f"   Function: {test.get('function_name', 'N/A')}\n"
-                    test_results_section += f"   Input: {test.get('input_data', 'N/A')}\n"
-                    test_results_section += f"   Expected Output: {test.get('expected_output', 'N/A')}\n"
-                    test_results_section += f"   Actual Output: {test.get('actual_output', 'N/A')}\n"
-                    if test.get('error'):
-                        test_results_section += f"   Error: {test.get('error')}\n"
-
-                test_results_section += f"\n{'='*60}\n"
-                test_results_section += """
-CRITICAL ANALYSIS INSTRUCTIONS FOR TEST FAILURES:
 
-🔍 STEP 1: Analyze the student's code structure and logic
-   - Check if classes/methods are properly defined
-   - Verify the logic matches the task requirements
-   - Look for syntax errors or obvious bugs
-
-🔍 STEP 2: Compare ACTUAL vs EXPECTED outputs
-   - Look at what the code is ACTUALLY producing
-   - Compare to what the test EXPECTS
-   - Ask: "Is the test expectation reasonable?"
-
-🔍 STEP 3: Determine the root cause
-
-   IF code structure looks correct AND logic seems sound:
-   ➡️ The problem is likely with TEST EXPECTATIONS, not the code
-   ➡️ Tell the student: "Your code logic looks correct. The test expectations might need adjustment."
-   ➡️ Point out: "Check if the expected output in the test matches what your code should produce."
-   ➡️ Suggest: "Review the test's expected input/output - they may not align with your implementation."
-
-   IF code has bugs or missing implementation:
-   ➡️ Point out the specific code issue
-   ➡️ Guide them to fix their implementation
-
-   IF actual output is empty/null but code exists:
-   ➡️ There's likely a compilation error, wrong method name, or runtime error
-   ➡️ Check for: wrong class name, wrong method name, missing return statement
-
-🚨 WHEN TO SUGGEST TEST CASE ADJUSTMENT:
-- Student's code follows proper structure (classes, methods defined correctly)
-- Logic appears sound for the task requirements
-- BUT actual outputs don't match expected outputs
-- This means: THE TEST EXPECTATIONS ARE PROBABLY WRONG, NOT THE CODE
-
-Example good hint when code is correct but tests fail:
-"Your MultiCellBuffer class is properly structured with the correct constructor and array initialization. The test failures suggest the test case expectations might not match your implementation. Review the test inputs and expected outputs - they may need to be adjusted to align with how your code actually works."
-"""
-
-    return f"""You are a live coding assistant helping a student who is stuck while programming.
-
-Task Goal: {task_description}
-Concepts: {concepts_str}{language_context}
-
-Student's Current Code:
-```
-{student_code}
-```{test_results_section}
-
-Student's Question: {question}
-
-Previous Hints Given:
-{previous_hints_str}
-
-Times Asked for Help on This Section: {help_count}
-Hint Level: {hint_level}
-
-{code_analysis_section}
-
-INSTRUCTIONS:
-{hint_instruction}
+_HELPER_PREFIX = f"""You are a live coding assistant helping a student who is stuck while programming.
+The task, the student's code, their question and the hint level to use are given in the user message.
 
+{_HELPER_CODE_ANALYSIS}
 CRITICAL RULES:
 1. Do NOT give them the complete solution to THEIR specific task
 2. Help them learn by guiding their thinking, not doing it for them
@@ -748,71 +549,270 @@ Apply this pattern to validate your room number."
 Return ONLY a valid JSON object with this EXACT structure:
 {{
     "hint": "Your helpful hint text here",
-    "hint_type": "{hint_level}_hint",
+    "hint_type": "<hint level>_hint",
     "example_code": "optional example code if relevant (or null)"
 }}
 
 CRITICAL RESPONSE FORMAT:
 - Your response must be ONLY valid JSON
-- Do NOT wrap in markdown code blocks (no ``` or ```json)
-- Do NOT include any explanation before or after the JSON
+{_JSON_ONLY_RULES}
 - If including example_code, use \\n for newlines within the string
-- Ensure all strings are properly escaped
 - Start your response with {{ and end with }}
 
 EXAMPLE VALID RESPONSE:
 {{"hint": "Try using a loop here", "hint_type": "gentle_hint", "example_code": null}}"""
 
 
-def get_non_code_file_prompt(tasks_data: list, filename: str) -> str:
+# Per-hint-level instructions for the helper, picked by how often the student asked for help
+
+_GENTLE_HINT_INSTRUCTION = """Give a high-level conceptual hint. Help them think about the problem differently.
+- Ask guiding questions
+- Point them to the right direction without giving away the answer
+- Remind them of relevant concepts they should consider
+- DO NOT show code examples yet
+- DO NOT ask questions back to the student
+- If they haven't implemented anything yet, suggest a starting point rather than asking a question back.
+- Same way if they have implemented eveything correctly, just give them a nudge forward.
+- DO NOT end with "What specific hint are you asking?" or similar phrases"""
+
+_MODERATE_HINT_INSTRUCTION = """Provide a more specific hint with guidance on the approach.
+- Explain the approach in pseudocode or plain English
+- Show a SIMILAR example (different variable names, different context)
+- Point out what's missing or incorrect in their approach
+- You can show small code snippets (3-5 lines) but not the full solution
+- DO NOT ask questions back to the student
+- DO NOT end with "Does this help?" or similar phrases"""
+
+_STRONG_HINT_INSTRUCTION = """Provide a detailed hint that's close to the solution but still requires them to implement it.
+- Show a similar working example with DIFFERENT context
+- Explain the logic step-by-step
+- You can show larger code examples but use different variable names and slightly different scenario
+- Still leave some implementation work for them (don't just give the exact answer)
+-DO NOT ask questions back to the student
+- DO NOT end with "Any questions?" or similar phrases"""
+
+
+def _hint_level_section(hint_level: str, hint_instruction: str) -> str:
+    """Closing part of the helper's user message for one hint level (built once at import)"""
+    return f"""Hint Level: {hint_level} (use "hint_type": "{hint_level}_hint")
+
+INSTRUCTIONS:
+{hint_instruction}
+
+Return ONLY valid JSON."""
+
+
+# help_count -> closing section with the hint level and its instructions; 3+ gets the strong hint
+_HINT_LEVELS = {
+    1: _hint_level_section("gentle", _GENTLE_HINT_INSTRUCTION),
+    2: _hint_level_section("moderate", _MODERATE_HINT_INSTRUCTION),
+}
+_STRONG_HINT_SECTION = _hint_level_section("strong", _STRONG_HINT_INSTRUCTION)
+
+
+# Fixed parts of the helper's TEST RESULTS section
+_TEST_RESULTS_BAR = "=" * 60
+_TEST_RESULTS_HEADER = f"\n\n{_TEST_RESULTS_BAR}\nTEST RESULTS:\n{_TEST_RESULTS_BAR}\n"
+_FAILED_TESTS_HEADER = f"\n{_TEST_RESULTS_BAR}\nFAILED TEST CASES:\n{_TEST_RESULTS_BAR}\n"
+_TEST_FAILURE_ANALYSIS = f"\n{_TEST_RESULTS_BAR}\n" + """
+CRITICAL ANALYSIS INSTRUCTIONS FOR TEST FAILURES:
+
+🔍 STEP 1: Analyze the student's code structure and logic
+   - Check if classes/methods are properly defined
+   - Verify the logic matches the task requirements
+   - Look for syntax errors or obvious bugs
+
+🔍 STEP 2: Compare ACTUAL vs EXPECTED outputs
+   - Look at what the code is ACTUALLY producing
+   - Compare to what the test EXPECTS
+   - Ask: "Is the test expectation reasonable?"
+
+🔍 STEP 3: Determine the root cause
+
+   IF code structure looks correct AND logic seems sound:
+   ➡️ The problem is likely with TEST EXPECTATIONS, not the code
+   ➡️ Tell the student: "Your code logic looks correct. The test expectations might need adjustment."
+   ➡️ Point out: "Check if the expected output in the test matches what your code should produce."
+   ➡️ Suggest: "Review the test's expected input/output - they may not align with your implementation."
+
+   IF code has bugs or missing implementation:
+   ➡️ Point out the specific code issue
+   ➡️ Guide them to fix their implementation
+
+   IF actual output is empty/null but code exists:
+   ➡️ There's likely a compilation error, wrong method name, or runtime error
+   ➡️ Check for: wrong class name, wrong method name, missing return statement
+
+🚨 WHEN TO SUGGEST TEST CASE ADJUSTMENT:
+- Student's code follows proper structure (classes, methods defined correctly)
+- Logic appears sound for the task requirements
+- BUT actual outputs don't match expected outputs
+- This means: THE TEST EXPECTATIONS ARE PROBABLY WRONG, NOT THE CODE
+
+Example good hint when code is correct but tests fail:
+"Your MultiCellBuffer class is properly structured with the correct constructor and array initialization. The test failures suggest the test case expectations might not match your implementation. Review the test inputs and expected outputs - they may need to be adjusted to align with how your code actually works."
+"""
+
+
+def _format_failed_test(number: int, test: dict) -> str:
+    """One failed test case for the helper's TEST RESULTS section"""
+    error = test.get('error')
+    error_line = f"   Error: {error}\n" if error else ""
+    return (
+        f"\n{number}. {test.get('test_name', 'Test')}\n"
+        f"   Function: {test.get('function_name', 'N/A')}\n"
+        f"   Input: {test.get('input_data', 'N/A')}\n"
+        f"   Expected Output: {test.get('expected_output', 'N/A')}\n"
+        f"   Actual Output: {test.get('actual_output', 'N/A')}\n"
+        f"{error_line}"
+    )
+
+
+def build_test_results_section(test_results: list) -> str:
     """
-    Generate prompt for non-code files (data, config, build files, etc.)
-    These should contain actual content, not code to generate them
+    TEST RESULTS section of the helper prompt for the student's latest run
+    Empty if no test passed or failed
     """
-    if not tasks_data:
+    # Correctly identify passed vs failed tests (anything else, e.g. None, counts as neither)
+    passed_tests = []
+    failed_tests = []
+    for test in test_results:
+        passed = test.get('passed')
+        if passed == True:
+            passed_tests.append(test)
+        elif passed == False:
+            failed_tests.append(test)
+
+    if not (failed_tests or passed_tests):
         return ""
 
-    # Get file extension and base name to determine format
-    ext = filename.split('.')[-1].lower() if '.' in filename else ''
-    basename = filename.lower()
+    section_parts = [
+        _TEST_RESULTS_HEADER,
+        f"✓ Passed: {len(passed_tests)}/{len(test_results)}\n✗ Failed: {len(failed_tests)}/{len(test_results)}\n"
+    ]
 
-    # Build task descriptions
-    tasks_description = ""
-    for i, task in enumerate(tasks_data, 1):
-        tasks_description += f"\nTask {i}: {task['task_description']}"
+    if failed_tests:
+        section_parts.append(_FAILED_TESTS_HEADER)
+        # Show max 3 failed tests
+        section_parts.extend(_format_failed_test(i, test) for i, test in enumerate(failed_tests[:3], 1))
+        section_parts.append(_TEST_FAILURE_ANALYSIS)
 
-    # Detect file type and provide specific guidance
-    if basename == 'makefile' or basename.startswith('makefile'):
-        file_type = "Makefile"
-        guidance = "Generate a valid Makefile with targets, dependencies, and build commands using tab indentation"
-    elif basename in ['dockerfile', 'dockerfile.dev', 'dockerfile.prod']:
-        file_type = "Dockerfile"
-        guidance = "Generate a valid Dockerfile with FROM, RUN, COPY, CMD instructions"
-    elif basename == 'cmakelists.txt':
-        file_type = "CMakeLists.txt"
-        guidance = "Generate a valid CMake configuration with project(), add_executable(), etc."
-    elif ext in ['xml', 'xsd']:
-        file_type = ext.upper()
-        guidance = "Generate valid XML/XSD with proper structure, elements, and attributes"
-    elif ext in ['json', 'yaml', 'yml', 'toml']:
-        file_type = ext.upper()
-        guidance = f"Generate valid {ext.upper()} with proper structure and data types"
-    elif ext in ['sh', 'bat', 'ps1']:
-        file_type = "Shell Script"
-        guidance = f"Generate a valid {ext} script with proper syntax and commands"
-    elif ext in ['properties', 'ini', 'cfg', 'env']:
-        file_type = "Config File"
-        guidance = f"Generate a valid {ext} config file with key-value pairs"
-    elif basename.endswith('ignore'):
-        file_type = "Ignore File"
-        guidance = f"Generate a {filename} file with appropriate glob patterns"
-    else:
-        file_type = ext.upper() if ext else "file"
-        guidance = "Generate appropriate content for this file format"
+    return "".join(section_parts)
 
-    return f"""Generate MINIMAL starter content for {file_type}: {filename}
 
-TASKS:{tasks_description}
+def get_test_generation_prompt(assignment_text: str, files: list, target_language: str) -> tuple:
+    """
+    Generate test cases based on assignment requirements (UPDATED FOR MULTI-FILE AND MULTI-CLASS)
+    Returns (stable_prefix, dynamic_suffix): the instructions go in the cached system
+    prompt, the assignment and tasks in the user message.
+    """
+    # Build tasks summary from file structure
+    parts = []
+    for file_data in files:
+        filename = file_data.get('filename', 'unknown')
+        parts.append(f"\n=== File: {filename} ===\n")
+
+        tasks = file_data.get('tasks')
+        classes = file_data.get('classes')
+
+        # Handle simple file structure (tasks directly in file)
+        if tasks is not None:
+            for task in tasks:
+                parts.append(f"Task {task.get('id', '')}: {task.get('title', '')} - {task.get('description', '')}\n")
+
+        # Handle multi-class file structure (classes with tasks)
+        elif classes is not None:
+            for class_obj in classes:
+                class_name = class_obj.get('class_name', 'Unknown')
+                parts.append(f"\nClass: {class_name}\n")
+                for task in class_obj.get('tasks', ()):
+                    parts.append(f"Task {task.get('id', '')}: {task.get('title', '')} - {task.get('description', '')}\n")
+
+    tasks_summary = "".join(parts)
+
+    dynamic_suffix = f"""Assignment:
+{assignment_text}
+
+Tasks Breakdown by File:
+{tasks_summary}
+
+Target Language: {target_language}
+
+Return the test cases in the "tests" array."""
+
+    return _TEST_GENERATION_PREFIX, dynamic_suffix
+
+
+def get_parser_prompt(assignment_text: str, target_language: str,
+                      known_language: str, experience_level: str) -> tuple:
+    """
+    Parser for multi-file, multi-class assignments
+    Returns (stable_prefix, dynamic_suffix) so the instructions can be prompt-cached
+    """
+    dynamic_suffix = f"""Parse this assignment into structured tasks for a student to complete.
+
+Assignment: {assignment_text}
+Language: {target_language}
+Student Level: {experience_level}
+
+Return ONLY valid JSON."""
+
+    return _PARSER_PREFIX, dynamic_suffix
+
+def get_helper_prompt(task_description: str, concepts: list, student_code: str,
+                      question: str, previous_hints: list, help_count: int,
+                      known_language: str = None, target_language: str = None, experience_level: str = "intermediate",
+                      test_results: list = None, test_results_section: str = None) -> tuple:
+    """
+    Agent 3: Live Coding Helper (SMART CONTEXT-AWARE VERSION)
+    Provide contextual hints based on student's struggle level
+    NOW: Better parsing of student's question to identify which TODO they're stuck on
+    Returns (stable_prefix, dynamic_suffix) so the instructions can be prompt-cached
+    `test_results_section` is the output of build_test_results_section(test_results), if already built
+    """
+    concepts_str = ", ".join(concepts)
+    previous_hints_str = "- " + "\n- ".join(previous_hints) if previous_hints else "None"
+    # Language context for better hints
+    language_context = ""
+    if known_language and target_language:
+        language_context = f"""
+
+LANGUAGE CONTEXT:
+Student knows: {known_language}
+Learning: {target_language}
+
+When providing hints or examples, you can reference {known_language} patterns to help bridge understanding.
+For example: "Think of this like Python's 'with' statement" or "Similar to C++'s RAII pattern"
+"""
+    
+    # Determine hint level based on help count
+    hint_section = _HINT_LEVELS.get(help_count, _STRONG_HINT_SECTION)
+
+    # Format test results if provided (callers that already built the section pass it in)
+    if test_results_section is None:
+        test_results_section = build_test_results_section(test_results) if test_results else ""
+
+    dynamic_suffix = f"""Task Goal: {task_description}
+Concepts: {concepts_str}{language_context}
+
+Student's Current Code:
+```
+{student_code}
+```{test_results_section}
+
+Student's Question: {question}
+
+Previous Hints Given:
+{previous_hints_str}
+
+Times Asked for Help on This Section: {help_count}
+{hint_section}"""
+
+    return _HELPER_PREFIX, dynamic_suffix
+
+
+_NON_CODE_FILE_PREFIX = f"""You generate MINIMAL starter content for non-code files (data, config, build files, etc.).
+The file name, its type, format guidance and the tasks are given in the user message.
 
 IMPORTANT - KEEP IT SHORT:
 - Generate only 2-3 sample entries (NOT 10+)
@@ -821,9 +821,9 @@ IMPORTANT - KEEP IT SHORT:
 - Focus on demonstrating structure, not filling with data
 
 CRITICAL INSTRUCTIONS:
-1. Generate the ACTUAL {file_type} content - NOT code to create it
-2. This is NOT a source code file - it's a {file_type.lower()}
-3. {guidance}
+1. Generate the ACTUAL file content - NOT code to create it
+2. This is NOT a source code file - it's the file type named in the user message
+3. Follow the format guidance from the user message
 4. Include helpful comments where appropriate
 5. Create realistic, functional content that demonstrates proper structure
 6. For Makefiles: Use TABS (\\t) for indentation, not spaces
@@ -851,76 +851,87 @@ WRONG (will fail):
   <hotel>
 """
 
+# Non-code file formats: lowercased name or extension -> (file type, format guidance)
+_MAKEFILE_FORMAT = ("Makefile", "Generate a valid Makefile with targets, dependencies, and build commands using tab indentation")
 
-def get_file_codegen_prompt(tasks_data: list, filename: str,
-                            class_structure: dict = None,
-                            template_variables: list = None,
-                            method_signatures_by_class: dict = None) -> str:
+_NON_CODE_BASENAME_FORMATS = {
+    **dict.fromkeys(('dockerfile', 'dockerfile.dev', 'dockerfile.prod'),
+                    ("Dockerfile", "Generate a valid Dockerfile with FROM, RUN, COPY, CMD instructions")),
+    'cmakelists.txt': ("CMakeLists.txt", "Generate a valid CMake configuration with project(), add_executable(), etc."),
+}
+
+_NON_CODE_EXTENSION_FORMATS = {
+    **{ext: (ext.upper(), "Generate valid XML/XSD with proper structure, elements, and attributes") for ext in ('xml', 'xsd')},
+    **{ext: (ext.upper(), f"Generate valid {ext.upper()} with proper structure and data types") for ext in ('json', 'yaml', 'yml', 'toml')},
+    **{ext: ("Shell Script", f"Generate a valid {ext} script with proper syntax and commands") for ext in ('sh', 'bat', 'ps1')},
+    **{ext: ("Config File", f"Generate a valid {ext} config file with key-value pairs") for ext in ('properties', 'ini', 'cfg', 'env')},
+}
+
+
+def get_non_code_file_prompt(tasks_data: list, filename: str) -> tuple:
     """
-    Generate scaffolding for ONE complete file with proper TODOs based on experience level.
+    Generate prompt for non-code files (data, config, build files, etc.)
+    These should contain actual content, not code to generate them
+    Returns (stable_prefix, dynamic_suffix) so the instructions can be prompt-cached
     """
     if not tasks_data:
-        return ""
+        return None, ""
 
-    # Language detection and comment style
-    language = tasks_data[0].get('programming_language', 'python').lower()
-    comment_style = '#' if language in ['python', 'bash', 'shell', 'ruby', 'perl', 'yaml', 'toml'] else '//'
-    
-    # Structure detection
-    is_multi_class = class_structure and len(class_structure) > 1
-    class_list = sorted(class_structure.keys()) if class_structure else []
-    
-    # Build task descriptions (CRITICAL - must include what to implement!)
-    tasks_description = ""
-    for i, task in enumerate(tasks_data, 1):
-        tasks_description += f"""
-Task {i}: {task['task_description']}
-  Class: {task.get('class_name', 'Program')}
-  Concepts: {', '.join(task.get('concepts', []))}
-  Experience: {task.get('experience_level', 'intermediate')}
-  
-  WHAT TO IMPLEMENT:
-  - Read the task description carefully
-  - Create method(s) that accomplish this specific task
-  - Add TODOs inside the method body based on experience level
-  - Ensure the method signature matches what the task requires"""
-        if task.get('template_variables'):
-            tasks_description += f"\n  Preserve variables: {', '.join(task['template_variables'])}"
+    # Get file extension and base name to determine format
+    basename = filename.lower()
+    dot = basename.rfind('.')
+    ext = basename[dot + 1:] if dot >= 0 else ''
 
-    # Template preservation section (if needed)
-    template_section = ""
-    if template_variables or method_signatures_by_class:
-        template_section = "\nTEMPLATE REQUIREMENTS:"
-        if template_variables:
-            template_section += f"\n- Preserve exact variable names: {', '.join(template_variables)}"
-        if method_signatures_by_class:
-            template_section += "\n- Create these exact methods:"
-            for cls, methods in method_signatures_by_class.items():
-                template_section += f"\n  {cls}: {', '.join(methods)}"
+    # Build task descriptions
+    tasks_description = "".join(f"\nTask {i}: {task['task_description']}" for i, task in enumerate(tasks_data, 1))
 
-    # Class structure section (if multi-class)
-    structure_section = ""
-    if is_multi_class:
-        structure_section = f"\nFILE STRUCTURE: Create {len(class_list)} classes: {', '.join(class_list)}"
-        for cls in class_list:
-            task_count = len([t for t in tasks_data if t.get('class_name') == cls])
-            structure_section += f"\n- {cls}: {task_count} tasks"
+    # Detect file type and provide specific guidance
+    if basename.startswith('makefile'):
+        file_type, guidance = _MAKEFILE_FORMAT
+    elif basename in _NON_CODE_BASENAME_FORMATS:
+        file_type, guidance = _NON_CODE_BASENAME_FORMATS[basename]
+    elif ext in _NON_CODE_EXTENSION_FORMATS:
+        file_type, guidance = _NON_CODE_EXTENSION_FORMATS[ext]
+    elif basename.endswith('ignore'):
+        file_type = "Ignore File"
+        guidance = f"Generate a {filename} file with appropriate glob patterns"
+    else:
+        file_type = ext.upper() if ext else "file"
+        guidance = "Generate appropriate content for this file format"
 
-    # Language-specific requirements
-    lang_requirements = {
-        'csharp': "Use ONE namespace containing all classes. Include: using System; etc.",
-        'c#': "Use ONE namespace containing all classes. Include: using System; etc.",
-        'java': "Use ONE package. Include proper imports. Main class must be public.",
-        'c': "Include headers: #include <stdio.h>, etc. Use proper function prototypes.",
-        'c++': "Include headers. Use namespace std or explicit std:: prefixes.",
-        'python': "Include imports at top. Use proper indentation (4 spaces).",
-        'javascript': "Use modern ES6+ syntax. Include 'use strict' if needed.",
-        'typescript': "Include type annotations. Define interfaces where appropriate."
-    }
-    
-    lang_specific = lang_requirements.get(language, "")
+    dynamic_suffix = f"""Generate MINIMAL starter content for {file_type}: {filename}
+
+TASKS:{tasks_description}
 
-    return f"""Generate scaffolding code for: {filename}
+FORMAT GUIDANCE: {guidance}"""
+
+    return _NON_CODE_FILE_PREFIX, dynamic_suffix
+
+
+# Language-specific requirements
+_LANG_REQUIREMENTS = {
+    'csharp': "Use ONE namespace containing all classes. Include: using System; etc.",
+    'c#': "Use ONE namespace containing all classes. Include: using System; etc.",
+    'java': "Use ONE package. Include proper imports. Main class must be public.",
+    'c': "Include headers: #include <stdio.h>, etc. Use proper function prototypes.",
+    'c++': "Include headers. Use namespace std or explicit std:: prefixes.",
+    'python': "Include imports at top. Use proper indentation (4 spaces).",
+    'javascript': "Use modern ES6+ syntax. Include 'use strict' if needed.",
+    'typescript': "Include type annotations. Define interfaces where appropriate."
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _file_codegen_prefix(language: str) -> str:
+    """
+    Stable prefix: depends only on the language, so it is built once per language,
+    stays byte-identical across files and retries, and can be served from
+    Anthropic's prompt cache
+    """
+    comment_style = '#' if language in ['python', 'bash', 'shell', 'ruby', 'perl', 'yaml', 'toml'] else '//'
+    lang_specific = _LANG_REQUIREMENTS.get(language, "")
+
+    return f"""You generate scaffolding code for one file of a programming assignment.
 
 CRITICAL INSTRUCTIONS:
 - You are creating STARTER CODE for students to complete
@@ -929,10 +940,6 @@ CRITICAL INSTRUCTIONS:
 - Do NOT implement the full logic - students will do that
 - Focus on creating the right structure and clear guidance
 
-ASSIGNMENT TASKS:{tasks_description}
-{structure_section}
-{template_section}
-
 REQUIREMENTS:
 1. Language: {language}
 2. Comment style: {comment_style} for all TODOs
@@ -1021,4 +1028,72 @@ EXAMPLE OUTPUT (Python, Beginner level, 2 tasks):
     "1": ["Check if text is None or empty", "Create an empty result variable", "Loop through text from end to start", "Add each character to result", "Return the result"],
     "2": ["Create a variable to count vowels", "Define which characters are vowels", "Loop through each character in text", "Check if character is a vowel", "If yes, increment the counter", "Return the counter"]
   }}
-}}"""
\ No newline at end of file
+}}"""
+
+
+def get_file_codegen_prompt(tasks_data: list, filename: str,
+                            class_structure: dict = None,
+                            template_variables: list = None,
+                            method_signatures_by_class: dict = None) -> tuple[str, str]:
+    """
+    Generate scaffolding for ONE complete file with proper TODOs based on experience level.
+    Returns (stable_prefix, dynamic_suffix) so the instructions can be sent as a
+    cached system block and only the tasks change between calls.
+    """
+    if not tasks_data:
+        return "", ""
+
+    # Language detection
+    language = tasks_data[0].get('programming_language', 'python').lower()
+    
+    # Structure detection
+    is_multi_class = class_structure and len(class_structure) > 1
+    class_list = sorted(class_structure.keys()) if class_structure else []
+    
+    # Build task descriptions (CRITICAL - must include what to implement!)
+    task_parts = []
+    for i, task in enumerate(tasks_data, 1):
+        task_parts.append(f"""
+Task {i}: {task['task_description']}
+  Class: {task.get('class_name', 'Program')}
+  Concepts: {', '.join(task.get('concepts', []))}
+  Experience: {task.get('experience_level', 'intermediate')}
+  
+  WHAT TO IMPLEMENT:
+  - Read the task description carefully
+  - Create method(s) that accomplish this specific task
+  - Add TODOs inside the method body based on experience level
+  - Ensure the method signature matches what the task requires""")
+        if task.get('template_variables'):
+            task_parts.append(f"\n  Preserve variables: {', '.join(task['template_variables'])}")
+    tasks_description = "".join(task_parts)
+
+    # Template preservation section (if needed)
+    template_section = ""
+    if template_variables or method_signatures_by_class:
+        template_section = "\nTEMPLATE REQUIREMENTS:"
+        if template_variables:
+            template_section += f"\n- Preserve exact variable names: {', '.join(template_variables)}"
+        if method_signatures_by_class:
+            template_section += "\n- Create these exact methods:"
+            for cls, methods in method_signatures_by_class.items():
+                template_section += f"\n  {cls}: {', '.join(methods)}"
+
+    # Class structure section (if multi-class)
+    structure_section = ""
+    if is_multi_class:
+        structure_section = f"\nFILE STRUCTURE: Create {len(class_list)} classes: {', '.join(class_list)}"
+        for cls in class_list:
+            task_count = len([t for t in tasks_data if t.get('class_name') == cls])
+            structure_section += f"\n- {cls}: {task_count} tasks"
+
+
+
+    # Dynamic suffix: the file and its tasks
+    dynamic_suffix = f"""Generate scaffolding code for: {filename}
+
+ASSIGNMENT TASKS:{tasks_description}
+{structure_section}
+{template_section}"""
+
+    return _file_codegen_prefix(language), dynamic_suffix
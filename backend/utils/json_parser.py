@@ -1,9 +1,17 @@
 import json
 import re
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns used on every response
+_MARKDOWN_JSON_OPEN = re.compile(r'^```json\s*', re.IGNORECASE)
+_MARKDOWN_OPEN = re.compile(r'^```\s*')
+_MARKDOWN_CLOSE = re.compile(r'\s*```\s*$')
+_MULTILINE_STRING_START = re.compile(r'"(code_snippet|code|file_content|content)"\s*:\s*"')
+_FENCED_JSON = re.compile(r'```(?:json)?\s*([\[{].*?[\]}])\s*```', re.DOTALL | re.IGNORECASE)
+
 def extract_json_from_response(response_text: str) -> dict:
     """
     Robustly extract JSON from LLM response, handling:
@@ -13,7 +21,12 @@ def extract_json_from_response(response_text: str) -> dict:
     - Partial JSON objects
     """
     logger.info(f"Extracting JSON from response (length: {len(response_text)})")
-    
+
+    # Fast path: well-formed JSON, bare or inside a ```json fence (the common case)
+    result = _fast_parse(response_text)
+    if result is not None:
+        return result
+
     # Step 1: Clean markdown if present
     cleaned = _remove_markdown(response_text)
     
@@ -52,19 +65,46 @@ def extract_json_from_response(response_text: str) -> dict:
     raise ValueError("Could not extract valid JSON from AI response.")
 
 
+def _fast_parse(text: str) -> dict | list | None:
+    """
+    Parse the response as-is, then the first fenced block, then the outermost
+    {...} / [...] span. Returns None so the slower repair steps run on a miss.
+    """
+    stripped = text.strip()
+    candidates = [stripped]
+
+    fence = _FENCED_JSON.search(stripped)
+    if fence:
+        candidates.append(fence.group(1))
+
+    start = min((i for i in (stripped.find('{'), stripped.find('[')) if i != -1), default=-1)
+    end = max(stripped.rfind('}'), stripped.rfind(']'))
+    if 0 <= start < end:
+        candidates.append(stripped[start:end + 1])
+
+    for candidate in candidates:
+        if candidate[:1] not in ('{', '['):
+            continue
+        try:
+            return orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            continue
+    return None
+
+
 def _remove_markdown(text: str) -> str:
     """Remove markdown code block markers"""
     cleaned = text.strip()
-    cleaned = re.sub(r'^```json\s*', '', cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r'^```\s*', '', cleaned)
-    cleaned = re.sub(r'\s*```\s*$', '', cleaned)
+    cleaned = _MARKDOWN_JSON_OPEN.sub('', cleaned)
+    cleaned = _MARKDOWN_OPEN.sub('', cleaned)
+    cleaned = _MARKDOWN_CLOSE.sub('', cleaned)
     return cleaned
 
 
 def _try_direct_parse(text: str) -> dict | None:
     """Try to parse JSON directly"""
     try:
-        result = json.loads(text)
+        result = orjson.loads(text)
         if isinstance(result, dict):
             logger.info(f"Successfully parsed JSON with keys: {list(result.keys())}")
         elif isinstance(result, list):
@@ -72,7 +112,7 @@ def _try_direct_parse(text: str) -> dict | None:
         else:
             logger.info(f"Successfully parsed JSON of type: {type(result)}")
         return result
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.debug(f"Direct parse failed: {e}")
         return None
 
@@ -89,7 +129,7 @@ def _fix_json_issues(json_str: str) -> str:
     lines = json_str.split('\n')
     fixed_lines = []
     in_string = False
-    string_start_pattern = re.compile(r'"(code_snippet|code|file_content|content)"\s*:\s*"')
+    string_start_pattern = _MULTILINE_STRING_START
     
     i = 0
     while i < len(lines):
@@ -328,16 +368,183 @@ def _find_any_valid_json(text: str) -> dict | None:
             if text[end-1] == '}':
                 try:
                     substring = text[start:end]
-                    result = json.loads(substring)
+                    result = orjson.loads(substring)
                     if isinstance(result, dict):
                         logger.info(f"Found valid JSON object at positions {start}:{end}")
                         return result
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     continue
     
     return None
 
 
+class StreamingJSONParser:
+    """
+    Incremental parser for a JSON object arriving in chunks (streamed LLM output).
+    Tracks string/escape state and bracket depth as text is fed, reports top-level
+    keys as soon as their values close, and can repair a truncated tail by closing
+    open strings and brackets instead of throwing the whole response away.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack = []  # One [opener, expecting_key] entry per open container
+        self._in_string = False
+        self._escaped = False
+        self._start = None
+        self._end = None
+        # Key tracking (any depth) for repair
+        self._reading_key = False
+        self._awaiting_value = False
+        self._key_start = None
+        # Top-level values, by key
+        self._current_key = None
+        self._value_start = None
+        self._values = {}
+
+    @property
+    def complete(self) -> bool:
+        return self._end is not None
+
+    def feed(self, chunk: str) -> list:
+        """Consume a chunk and return the top-level keys whose values completed in it"""
+        self.text += chunk
+        completed = []
+        while self._pos < len(self.text) and not self.complete:
+            key = self._advance(self.text[self._pos], self._pos)
+            if key:
+                completed.append(key)
+            self._pos += 1
+        return completed
+
+    def value(self, key: str):
+        """Return the parsed value of a completed top-level key, or None"""
+        span = self._values.get(key)
+        if span is None:
+            return None
+        try:
+            return json.loads(self.text[span[0]:span[1] + 1], strict=False)
+        except json.JSONDecodeError:
+            return None
+
+    def _advance(self, char: str, pos: int) -> str | None:
+        depth = len(self._stack)
+
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == '\\':
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                if self._reading_key:
+                    self._reading_key = False
+                    self._awaiting_value = True
+                    if depth == 1:
+                        self._current_key = self.text[self._key_start + 1:pos]
+                elif depth == 1:
+                    return self._finish_value(pos)
+            return None
+
+        # Ignore any prose before the opening brace
+        if self._start is None:
+            if char == '{':
+                self._start = pos
+                self._stack.append(['{', True])
+            return None
+
+        if char.isspace() or char == ':':
+            return None
+
+        top = self._stack[-1]
+        if char == '"':
+            self._in_string = True
+            if top[0] == '{' and top[1]:
+                top[1] = False
+                self._reading_key = True
+                self._key_start = pos
+                return None
+        elif char == ',':
+            top[1] = top[0] == '{'
+            if depth == 1:
+                # Primitive values (numbers, booleans) end here without being reported
+                self._current_key = None
+                self._value_start = None
+            return None
+        elif char in '}]':
+            self._stack.pop()
+            self._awaiting_value = False
+            if len(self._stack) == 1:
+                return self._finish_value(pos)
+            if not self._stack:
+                self._end = pos
+            return None
+
+        # Start of a value (string, container or primitive)
+        self._awaiting_value = False
+        if depth == 1 and self._value_start is None:
+            self._value_start = pos
+        if char in '{[':
+            self._stack.append([char, char == '{'])
+        return None
+
+    def _finish_value(self, pos: int) -> str | None:
+        if self._current_key is None or self._value_start is None:
+            return None
+        key = self._current_key
+        self._values[key] = (self._value_start, pos)
+        self._current_key = None
+        self._value_start = None
+        return key
+
+    def repair(self) -> str:
+        """Close any open string and brackets so a truncated object can be parsed"""
+        if self._start is None:
+            return self.text
+        if self.complete:
+            return self.text[self._start:self._end + 1]
+
+        if self._reading_key or self._awaiting_value:
+            # Cut off at a key with no value yet - drop the dangling key
+            return self._close(self.text[self._start:self._key_start], self._stack)
+
+        repaired = self.text[self._start:]
+        if self._in_string:
+            if self._escaped:
+                repaired = repaired[:-1]
+            repaired += '"'
+        return self._close(repaired, self._stack)
+
+    @staticmethod
+    def _close(text: str, stack: list) -> str:
+        closed = text.rstrip().rstrip(',')
+        for opener, _ in reversed(stack):
+            closed += '}' if opener == '{' else ']'
+        return closed
+
+    def parse(self) -> dict:
+        """Parse the streamed object, repairing a truncated tail before giving up"""
+        if not self.complete:
+            logger.warning("Streamed JSON incomplete, attempting incremental repair")
+
+        repaired = self.repair()
+        try:
+            result = orjson.loads(repaired)
+            if isinstance(result, dict):
+                return result
+        except orjson.JSONDecodeError:
+            # orjson rejects raw newlines inside code strings; the stdlib can allow them
+            try:
+                result = json.loads(repaired, strict=False)
+                if isinstance(result, dict):
+                    return result
+            except json.JSONDecodeError as e:
+                logger.debug(f"Streamed JSON parse failed: {e}")
+
+        return extract_json_from_response(self.text)
+
+
 def validate_task_breakdown(data: dict) -> bool:
     """
     Validate task breakdown structure with improved error messages
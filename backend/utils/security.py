@@ -16,6 +16,11 @@ from config import (
     ALLOWED_CODE_EXTENSIONS
 )
 
+# All blocked patterns in one alternation, so content is scanned once instead of once
+# per pattern. Matching lowercased text is much faster than re.IGNORECASE.
+_BLOCKED_PATTERNS_BY_LOWER = {pattern.lower(): pattern for pattern in BLOCKED_PATTERNS}
+_BLOCKED_PATTERN_RE = re.compile('|'.join(re.escape(pattern) for pattern in _BLOCKED_PATTERNS_BY_LOWER))
+
 
 def validate_text_length(text: str, max_length: int, field_name: str = "Text"):
     """Validate text input length"""
@@ -57,14 +62,13 @@ def check_malicious_content(text: str, check_type: str = "text"):
     Returns:
         True if safe, raises HTTPException if suspicious
     """
-    text_lower = text.lower()
-
-    for pattern in BLOCKED_PATTERNS:
-        if pattern.lower() in text_lower:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Content contains potentially unsafe pattern: '{pattern}'. Please review your {check_type}."
-            )
+    match = _BLOCKED_PATTERN_RE.search(text.lower())
+    if match:
+        pattern = _BLOCKED_PATTERNS_BY_LOWER[match.group(0)]
+        raise HTTPException(
+            status_code=400,
+            detail=f"Content contains potentially unsafe pattern: '{pattern}'. Please review your {check_type}."
+        )
 
     return True
 